@@ -12,13 +12,18 @@ from agti.utilities.db_manager import DBConnectionManager
 from agti.utilities.settings import PasswordMapLoader
 from agti.utilities.settings import CredentialManager
 from agti.ai.openrouter import OpenRouterTool
+from agti.agti_queries.filing_index import BM25FilingIndex
 import datetime
+import json
 import pandas as pd
 import numpy as np
 import asyncio
 from typing import List, Dict, Any, Optional
 import pandas as pd
 
+# version of the parsed qanda_filings snapshot layout
+QANDA_SNAPSHOT_VERSION = 1
+
 
 class CentralBankPDFProcessor:
     def __init__(self, pw_map: Dict, user_name: str = 'agti_corp'):
@@ -29,7 +34,20 @@ class CentralBankPDFProcessor:
         self.dbconn = None
         self.data = None
         self.openrouter_tool = OpenRouterTool(pw_map=self.pw_map,max_concurrent_requests=50)
-        self.qanda_filings = self.output_highly_relevant_q_and_a_filings()
+        self.filing_index = BM25FilingIndex()
+        # loaded on first use from the on-disk snapshot, see load_qanda_filings
+        self._qanda_filings = None
+
+    @property
+    def qanda_filings(self):
+        if self._qanda_filings is None:
+            self._qanda_filings = self.load_qanda_filings()
+            self.refresh_filing_index()
+        return self._qanda_filings
+
+    @qanda_filings.setter
+    def qanda_filings(self, value):
+        self._qanda_filings = value
         
     def __enter__(self):
         """Context manager entry - establish database connection."""
@@ -331,9 +349,9 @@ class CentralBankPDFProcessor:
             args_to_write.to_sql('agti_central_bank_summary_reference', dbconnx, if_exists='append',index=False)
             dbconnx.dispose()
 
-    def output_augmented_filings(self):
-        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-        full_extracted_history =pd.read_sql('agti_central_bank_summary_reference', dbconnx)
+    @staticmethod
+    def parse_augmented_filings(full_extracted_history):
+        """Parse pipe delimited summaries, one row per document."""
         def parse_pipes(text):
             """Extract pipe-delimited key-value pairs from a string into a dictionary."""
             result = {}
@@ -364,6 +382,11 @@ class CentralBankPDFProcessor:
         full_extracted_history['market_materiality']=pd.to_numeric(full_extracted_history['market_materiality'],errors='coerce')
         return full_extracted_history
 
+    def output_augmented_filings(self):
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        full_extracted_history =pd.read_sql('agti_central_bank_summary_reference', dbconnx)
+        return self.parse_augmented_filings(full_extracted_history)
+
 
     async def output_key_query_info(self, user_query = 'what was the BOJ cash rate in March of 2021 and how did it compare to the BOEs'):
 
@@ -480,6 +503,10 @@ class CentralBankPDFProcessor:
         g10_data = self.load_g10_data()
         date_published = g10_data.groupby('aws_link').first()['date_published']
         augmented_filings = self.output_augmented_filings()
+        return self.build_q_and_a_filings(augmented_filings, date_published)
+
+    def build_q_and_a_filings(self, augmented_filings, date_published):
+        ''' Select full, market relevant filings from parsed summaries and attach their full text'''
         valid_filings = augmented_filings[(augmented_filings['full_doc']=='TRUE') & (augmented_filings['market_materiality']>50)].copy()
         valid_filings['dex_copy'] = valid_filings.index
         valid_filings['country']= valid_filings['dex_copy'].apply(lambda x: x.split('amazonaws.com')[-1:][0].split('/')[1])
@@ -488,19 +515,20 @@ class CentralBankPDFProcessor:
         valid_filings['vector_info'] = valid_filings['extracted_info'].astype(str)+'| COUNTRY | '+valid_filings['country'].astype(str)+ ' | YEAR |'+ valid_filings['year'].astype(str)+' | DATE PUBLISHED | '+ valid_filings['date_published'].astype(str)
         valid_filings['article_ref']=list(range(0,len(valid_filings)))
         all_document_keys = list(valid_filings.index)
-
-        # Convert list to tuple for SQL IN clause
-        all_document_keys_tuple = tuple(all_document_keys)
+        if not all_document_keys:
+            valid_filings['full_extracted_text'] = None
+            valid_filings['pre_scraping_url'] = None
+            return valid_filings
 
         # Use SQLAlchemy's parameter binding
-        query = f'''
-        SELECT * 
+        query = text('''
+        SELECT aws_link, extracted_text, file_url
         FROM all_central_bank_filings 
-        WHERE aws_link IN {all_document_keys_tuple}
-        '''
+        WHERE aws_link IN :document_keys
+        ''').bindparams(sqlalchemy.bindparam('document_keys', expanding=True))
 
         dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user('agti_corp')
-        df = pd.read_sql(query, dbconnx)
+        df = pd.read_sql(query, dbconnx, params={'document_keys': all_document_keys})
         dexed_full_extraction = df.groupby('aws_link').last()
         valid_filings['full_extracted_text']=dexed_full_extraction['extracted_text']
         valid_filings['pre_scraping_url']=dexed_full_extraction['file_url']
@@ -508,6 +536,156 @@ class CentralBankPDFProcessor:
         dbconnx.dispose()
         return valid_filings
 
+    def get_qanda_snapshot_path(self):
+        """Path of the qanda_filings snapshot for the current snapshot version."""
+        snapshot_dir = CredentialManager().get_datadump_directory_path() / 'central_bank_qanda'
+        snapshot_dir.mkdir(exist_ok=True)
+        return snapshot_dir / f'qanda_filings__v{QANDA_SNAPSHOT_VERSION}.parquet'
+
+    def load_summary_watermark(self):
+        """Latest write time in agti_central_bank_summary_reference."""
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user('agti_corp')
+        with dbconnx.connect() as con:
+            watermark = con.execute(text('SELECT MAX(datetime) FROM agti_central_bank_summary_reference')).scalar()
+        dbconnx.dispose()
+        return watermark
+
+    def load_date_published(self, aws_links):
+        """date_published by aws_link, read only for the given links."""
+        file_ids = [aws_link.split('/')[-1].split('.')[0] for aws_link in aws_links]
+        query = text('''
+        SELECT file_id, country_code_alpha_3, date_published
+        FROM central_banks_g10
+        WHERE file_id IN :file_ids
+        ''').bindparams(sqlalchemy.bindparam('file_ids', expanding=True))
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user('agti_corp')
+        g10_data = pd.read_sql(query, dbconnx, params={'file_ids': file_ids})
+        dbconnx.dispose()
+        g10_data['aws_link'] = (
+            "https://agti-central-banks.s3.us-east-1.amazonaws.com/" + g10_data['country_code_alpha_3'] + "/"
+            + g10_data['date_published'].apply(lambda x: str(x.year)) + "/" + g10_data['file_id'] + ".pdf"
+        )
+        return g10_data.sort_values('date_published').groupby('aws_link').first()['date_published']
+
+    def write_qanda_snapshot(self, qanda_filings, watermark):
+        """Write qanda_filings with the summary watermark it is current up to."""
+        snapshot = qanda_filings.drop(columns=['pipe_parser'], errors='ignore')
+        path = self.get_qanda_snapshot_path()
+        tmp_path = path.with_suffix('.tmp')
+        snapshot.to_parquet(tmp_path)
+        # readers never see a partially written snapshot
+        tmp_path.replace(path)
+        metadata = {
+            'version': QANDA_SNAPSHOT_VERSION,
+            'summary_watermark': None if watermark is None else pd.Timestamp(watermark).isoformat(),
+            'rows': len(snapshot),
+            'written_at': datetime.datetime.now().isoformat(),
+        }
+        path.with_suffix('.json').write_text(json.dumps(metadata))
+        return snapshot
+
+    def update_qanda_snapshot(self, qanda_filings, since):
+        """Re-parse only documents summarized after since and merge them into qanda_filings."""
+        query = text('''
+        SELECT * FROM agti_central_bank_summary_reference
+        WHERE document IN (
+            SELECT DISTINCT document FROM agti_central_bank_summary_reference WHERE datetime > :since
+        )
+        ''')
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user('agti_corp')
+        new_history = pd.read_sql(query, dbconnx, params={'since': since.to_pydatetime()})
+        dbconnx.dispose()
+        if new_history.empty:
+            return qanda_filings
+        augmented_filings = self.parse_augmented_filings(new_history)
+        date_published = self.load_date_published(list(augmented_filings.index))
+        updated_filings = self.build_q_and_a_filings(augmented_filings, date_published)
+        updated_filings = updated_filings.drop(columns=['pipe_parser'], errors='ignore')
+        # refs returned by earlier queries stay valid: re-summarized documents keep their ref
+        # and only documents new to the snapshot are numbered after the current maximum
+        previous_refs = qanda_filings['article_ref']
+        next_ref = int(previous_refs.max()) + 1 if len(previous_refs) > 0 else 0
+        updated_refs = updated_filings.index.to_series().map(previous_refs)
+        new_documents = updated_refs.isna()
+        updated_refs[new_documents] = range(next_ref, next_ref + int(new_documents.sum()))
+        updated_filings['article_ref'] = updated_refs.astype(int)
+        # re-summarized documents are replaced, the others keep their parsed rows
+        qanda_filings = qanda_filings[~qanda_filings.index.isin(augmented_filings.index)]
+        qanda_filings = pd.concat([qanda_filings, updated_filings]).sort_index()
+        print(f"Updated {len(augmented_filings)} documents in qanda_filings snapshot")
+        return qanda_filings
+
+    def load_qanda_filings(self, refresh=True):
+        """
+        Load qanda_filings from the on-disk snapshot.
+        
+        The snapshot is built once with output_highly_relevant_q_and_a_filings, afterwards only
+        documents summarized since the snapshot watermark are parsed and merged in.
+        Bump QANDA_SNAPSHOT_VERSION when the parsed columns change.
+        """
+        path = self.get_qanda_snapshot_path()
+        metadata_path = path.with_suffix('.json')
+        if not path.exists() or not metadata_path.exists():
+            # taken before the build, summaries written meanwhile are merged on the next refresh
+            watermark = self.load_summary_watermark()
+            return self.write_qanda_snapshot(self.output_highly_relevant_q_and_a_filings(), watermark)
+
+        qanda_filings = pd.read_parquet(path, memory_map=True)
+        if not refresh:
+            return qanda_filings
+        since = json.loads(metadata_path.read_text())['summary_watermark']
+        watermark = self.load_summary_watermark()
+        if since is None or watermark is None:
+            return qanda_filings
+        since = pd.Timestamp(since)
+        if pd.Timestamp(watermark) <= since:
+            return qanda_filings
+        qanda_filings = self.update_qanda_snapshot(qanda_filings, since)
+        return self.write_qanda_snapshot(qanda_filings, watermark)
+
+    def refresh_filing_index(self):
+        """Sync the retrieval index with qanda_filings, re-indexing only filings whose text changed."""
+        vector_info = self.qanda_filings['vector_info']
+        dropped_filings = [document for document in self.filing_index.doc_lengths if document not in vector_info.index]
+        removed = self.filing_index.remove_documents(dropped_filings)
+        indexed = self.filing_index.update_documents(vector_info.to_dict())
+        if indexed > 0 or removed > 0:
+            print(f"Indexed {indexed} filings, removed {removed}, {len(self.filing_index)} in retrieval index")
+        return indexed
+
+    def refresh_qanda_filings(self):
+        """Merge newly written summaries into qanda_filings and index only the new or changed filings."""
+        self.qanda_filings = self.load_qanda_filings(refresh=True)
+        return self.refresh_filing_index()
+
+    def select_retrieval_candidates(self, filings, user_query, top_k=40, recent_per_country=0):
+        """
+        Keep the top_k filings by BM25 relevance to the user query.
+        
+        Parameters:
+        -----------
+        filings : pd.DataFrame
+            Slice of qanda_filings indexed by document
+        user_query : str
+            The query used for ranking
+        top_k : int, default=40
+            Number of best scoring filings to keep
+        recent_per_country : int, default=0
+            Also keep this many most recent filings per country, so bulk questions see every bank
+        
+        Returns:
+        --------
+        pd.DataFrame
+            Candidate filings with a retrieval_score column
+        """
+        scores = pd.Series(self.filing_index.score(user_query, candidate_ids=filings.index), dtype=float)
+        filings = filings.copy()
+        filings['retrieval_score'] = scores.reindex(filings.index).fillna(0.0)
+        candidates = filings.sort_values(['retrieval_score', 'date_published'], ascending=False).head(top_k)
+        if recent_per_country > 0:
+            recent = filings.sort_values('date_published', ascending=False).groupby('country').head(recent_per_country)
+            candidates = pd.concat([candidates, recent[~recent.index.isin(candidates.index)]])
+        return candidates
 
     def output_100_benchmark_questions(self):
         """
@@ -722,13 +900,19 @@ class CentralBankPDFProcessor:
 
 
 
-    async def power_query_step_1__reduce_filings(self, user_query):
+    async def power_query_step_1__reduce_filings(self, user_query, top_k=40, bulk_top_k=150, bulk_recent_per_country=2):
 
         xfilter = await self.output_key_query_info(user_query)
         slice1 = self.qanda_filings[(self.qanda_filings['date_published'] >= xfilter['start_date']) & (self.qanda_filings['date_published'] <= xfilter['end_date'])]
         reduced_filings = slice1[slice1['country'].apply(lambda x: x in xfilter['countr_list'])].copy()
         
         bulk_summary_filter = xfilter['bulk_summary']
+        # only the best lexical matches go to the filter model
+        if bulk_summary_filter == 'YES':
+            reduced_filings = self.select_retrieval_candidates(reduced_filings, user_query, top_k=bulk_top_k,
+                                                               recent_per_country=bulk_recent_per_country)
+        else:
+            reduced_filings = self.select_retrieval_candidates(reduced_filings, user_query, top_k=top_k)
         def create_user_index(vector_info_string, article_ref_string):
             op = f"""<<<ARTICLE REF {article_ref_string} STARTS HERE>>>
             {vector_info_string}
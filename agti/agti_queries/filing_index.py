@@ -0,0 +1,117 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOP_WORDS = frozenset("""
+a an and are as at be by for from has have how in is it its of on or that the their this to was were what when
+which who why will with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stop words."""
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOP_WORDS]
+
+
+class BM25FilingIndex:
+    """
+    In-memory BM25 index over filing summaries.
+
+    Documents are added incrementally, so new summaries can be indexed without a rebuild,
+    and replaced in place when their text changes.
+
+    Example:
+        index = BM25FilingIndex()
+        index.add_documents(qanda_filings['vector_info'].to_dict())
+        index.search('BOJ yield curve control', top_k=20)
+        index.update_documents(resummarized_filings['vector_info'].to_dict())
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.doc_terms = {}  # doc_id -> indexed terms, needed to remove the document again
+        self.doc_text_hashes = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def add_documents(self, documents: Dict[str, str]) -> int:
+        """Index {doc_id: text}, skipping documents already indexed. Returns the number added."""
+        added = 0
+        for doc_id, doc_text in documents.items():
+            if doc_id in self.doc_lengths:
+                continue
+            self._index_document(doc_id, doc_text)
+            added += 1
+        return added
+
+    def remove_documents(self, doc_ids: Iterable[str]) -> int:
+        """Drop documents from the index. Unknown ids are ignored. Returns the number removed."""
+        removed = 0
+        for doc_id in doc_ids:
+            if doc_id not in self.doc_lengths:
+                continue
+            for term in self.doc_terms.pop(doc_id):
+                term_postings = self.postings[term]
+                del term_postings[doc_id]
+                if not term_postings:
+                    del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            del self.doc_text_hashes[doc_id]
+            removed += 1
+        return removed
+
+    def update_documents(self, documents: Dict[str, str]) -> int:
+        """Index new documents and re-index those whose text changed. Returns the number indexed."""
+        indexed = 0
+        for doc_id, doc_text in documents.items():
+            if self.doc_text_hashes.get(doc_id) == hash(str(doc_text)):
+                continue
+            self.remove_documents([doc_id])
+            self._index_document(doc_id, doc_text)
+            indexed += 1
+        return indexed
+
+    def _index_document(self, doc_id, doc_text):
+        term_counts = Counter(tokenize(doc_text))
+        for term, term_frequency in term_counts.items():
+            self.postings[term][doc_id] = term_frequency
+        doc_length = sum(term_counts.values())
+        self.doc_lengths[doc_id] = doc_length
+        self.doc_terms[doc_id] = tuple(term_counts)
+        self.doc_text_hashes[doc_id] = hash(str(doc_text))
+        self.total_length += doc_length
+
+    def score(self, query: str, candidate_ids: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """BM25 score of every document matching at least one query term."""
+        if not self.doc_lengths:
+            return {}
+        candidates = set(candidate_ids) if candidate_ids is not None else None
+        doc_count = len(self.doc_lengths)
+        avg_length = self.total_length / doc_count
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (doc_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_id, term_frequency in term_postings.items():
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * term_frequency * (self.k1 + 1) / (term_frequency + length_norm)
+        return dict(scores)
+
+    def search(self, query: str, top_k: int = 50,
+               candidate_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top k (doc_id, score) pairs for the query, best first."""
+        scores = self.score(query, candidate_ids=candidate_ids)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
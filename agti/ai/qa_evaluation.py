@@ -1,3 +1,5 @@
+import hashlib
+import json
 import pandas as pd
 from typing import Dict, Any, Optional, List
 import asyncio
@@ -238,10 +240,18 @@ Elements in scoring:
             "temperature": 0
         }
     
+    def get_scoring_job_key(self, question: str, formal_answer: str, provided_answer: str) -> str:
+        """Stable job name for one scoring prompt, identical prompts share a key."""
+        scoring_inputs = json.dumps([str(question), str(formal_answer), str(provided_answer)])
+        return hashlib.sha1(scoring_inputs.encode()).hexdigest()
+    
     async def score_responses(self, df: pd.DataFrame, response_columns: List[str]) -> pd.DataFrame:
         """
         Score all responses against ground truth answers.
         
+        Every response column is scored in a single concurrent batch, so the
+        OpenRouter concurrency budget is shared across models.
+        
         Args:
             df: DataFrame with questions, answers, and responses
             response_columns: List of column names containing responses to score
@@ -249,48 +259,50 @@ Elements in scoring:
         Returns:
             DataFrame with scores added
         """
+        # Build every (question, column) scoring job up front so all columns share one concurrent batch.
+        # Identical question / answer / response triples are only scored once
+        scored_columns = []
+        column_jobs = {}
+        scoring_api_args = {}
         for col in response_columns:
             # Skip if column doesn't exist or has no data
             if col not in df.columns or df[col].isna().all():
                 print(f"Skipping {col} - no data available")
                 continue
-                
-            # Create scoring API arguments
-            df[f'{col}_scoring_api_args'] = df.apply(
-                lambda x: self.create_scoring_prompt(x['question'], x['answer'], x[col]) if pd.notna(x[col]) else None,
-                axis=1
-            )
-            
-            # Filter out None values for API call
-            valid_scoring = df[df[f'{col}_scoring_api_args'].notna()]
-            
-            if len(valid_scoring) == 0:
-                print(f"No valid data to score for {col}")
-                continue
-                
-            # Run scoring
+            valid_rows = df[df[col].notna()]
+            job_keys = []
+            for question, answer, provided_answer in zip(valid_rows['question'], valid_rows['answer'], valid_rows[col]):
+                job_key = self.get_scoring_job_key(question, answer, provided_answer)
+                if job_key not in scoring_api_args:
+                    scoring_api_args[job_key] = self.create_scoring_prompt(question, answer, provided_answer)
+                job_keys.append(job_key)
+            column_jobs[col] = pd.Series(job_keys, index=valid_rows.index, dtype=object).reindex(df.index)
+            scored_columns.append(col)
+        
+        scoring_results = {}
+        if len(scoring_api_args) > 0:
+            print(f"Scoring {len(scoring_api_args)} unique responses across {len(scored_columns)} columns")
+            # keep the per column time budget the sequential batches had
             scoring_results = await self.openrouter_tool.run_async_chat_completions_with_error_handling(
-                valid_scoring.set_index('question')[f'{col}_scoring_api_args'].to_dict()
-            )
-            
-            # Extract results
-            df[f'{col}__score__full_api'] = df['question'].map(scoring_results)
-            
-            # Parse scores
-            df[f'{col}__score_string'] = df[f'{col}__score__full_api'].apply(
-                lambda x: x.choices[0].message.content if hasattr(x, 'choices') else ''
-            )
-            
-            df[f'{col}__score'] = df[f'{col}__score_string'].apply(
-                lambda x: x.split('ACTUAL SCORE |')[-1:][0].replace('|', '').strip() if x else '0'
+                scoring_api_args, timeout=360 * len(scored_columns)
             )
+        score_strings = {
+            job_key: result.choices[0].message.content if hasattr(result, 'choices') else ''
+            for job_key, result in scoring_results.items()
+        }
+        
+        # Scatter results back into the per column fields
+        for col in scored_columns:
+            df[f'{col}__score__full_api'] = column_jobs[col].map(scoring_results)
+            score_string = column_jobs[col].map(score_strings).fillna('')
+            df[f'{col}__score_string'] = score_string
+            has_score_string = score_string != ''
             
-            df[f'{col}__score_justification'] = df[f'{col}__score_string'].apply(
-                lambda x: x.split('SCORE JUSTIFICATION |')[-1:][0].split('|')[0] if x else ''
-            )
+            df[f'{col}__score'] = score_string.str.split('ACTUAL SCORE |', regex=False).str[-1] \
+                .str.replace('|', '', regex=False).str.strip().where(has_score_string, '0')
             
-            # Clean up temporary column
-            df = df.drop(columns=[f'{col}_scoring_api_args'])
+            df[f'{col}__score_justification'] = score_string.str.split('SCORE JUSTIFICATION |', regex=False).str[-1] \
+                .str.split('|', regex=False).str[0].where(has_score_string, '')
         
         # Convert scores to numeric
         for col in response_columns:
@@ -2,9 +2,11 @@
 import datetime
 import itertools
 import string
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 from agti.utilities.db_manager import DBConnectionManager
+from agti.utilities.rate_limiter import TokenBucket
 from basic_utilities import regression as reg
 # Third-Party Imports
 import numpy as np
@@ -28,6 +30,14 @@ from basic_utilities.regression import *
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from agti.data.fmp.market_data import FMPMarketDataRetriever
 
+# E*Trade order endpoints quota per account; preview and place each count as a request
+ETRADE_ORDER_REQUESTS_PER_SECOND = 4
+ORDER_BATCH_MAX_WORKERS = 16
+# preview has no side effects so any transient failure is retried. A place request is only
+# retried when E*Trade rejected it before processing (throttled / unavailable)
+PREVIEW_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+PLACE_RETRYABLE_STATUS_CODES = {429, 503}
+
 
 class ETradeUXDriver:
     def __init__(self,pw_map,driver_type):
@@ -632,6 +642,8 @@ class EtradeTool:
             return account
 
         self.account_map = given_session_generate_account_map(session=self.session)
+        self.order_rate_limiters = {}
+        self.order_rate_limiter_lock = threading.Lock()
         
     def id_generator(self):
         chars=[i for i in string.ascii_uppercase]
@@ -1056,6 +1068,200 @@ class EtradeTool:
             print('failed placing LIMIT ON CLOSE UX SHORT order on '+symbol)
             pass
 
+    def get_order_rate_limiter(self, requests_per_second=ETRADE_ORDER_REQUESTS_PER_SECOND):
+        ''' one token bucket per account so every order path shares the same quota '''
+        account_id_key = self.account_map["accountIdKey"]
+        with self.order_rate_limiter_lock:
+            if account_id_key not in self.order_rate_limiters:
+                self.order_rate_limiters[account_id_key] = TokenBucket(rate=requests_per_second)
+            return self.order_rate_limiters[account_id_key]
+
+    def generate_client_order_id(self, symbol, order_action, parent_strategy, price_type):
+        dir_conv={'BUY':'b',
+                'SELL':'s',
+                'BUY_TO_COVER':'bc',
+                'SELL_SHORT':'ss'}
+        ''' options for time of trade c: Close, o: Open, i: intraday'''
+        time_of_trade = 'c' if price_type == 'MARKET_ON_CLOSE' else 'o'
+        date_string = datetime.datetime.now().strftime('%m%d%y')
+        return f'{self.id_generator()}{parent_strategy}{symbol}{date_string}{dir_conv[order_action]}{time_of_trade}'
+
+    def generate_order_payload(self, request_type, client_order_id, symbol, order_action, quantity,
+                               price_type, order_term='GOOD_FOR_DAY', preview_id=None):
+        ''' request_type is PreviewOrderRequest or PlaceOrderRequest '''
+        preview_ids = f'<PreviewIds><previewId>{preview_id}</previewId></PreviewIds>' if preview_id is not None else ''
+        return f"""<{request_type}>
+                    <orderType>EQ</orderType>
+                    <clientOrderId>{client_order_id}</clientOrderId>
+                    {preview_ids}
+                    <Order>
+                        <allOrNone>false</allOrNone>
+                        <priceType>{price_type}</priceType>
+                        <orderTerm>{order_term}</orderTerm>
+                        <marketSession>REGULAR</marketSession>
+                        <Instrument>
+                            <Product>
+                                <securityType>EQ</securityType>
+                                <symbol>{symbol}</symbol>
+                            </Product>
+                            <orderAction>{order_action}</orderAction>
+                            <quantityType>QUANTITY</quantityType>
+                            <quantity>{quantity}</quantity>
+                        </Instrument>
+                    </Order>
+                </{request_type}>"""
+
+    def post_order_request(self, url, payload, retryable_status_codes, retry_connection_errors,
+                           rate_limiter, max_retries=2, backoff_seconds=.5):
+        '''
+        throttled POST against the order API. Returns (response, attempts, error).
+        retry_connection_errors should only be True for requests without side effects
+        '''
+        headers = {"Content-Type": "application/xml", "consumerKey": self.consumer_key}
+        response = None
+        error = None
+        attempts = 0
+        while attempts <= max_retries:
+            attempts += 1
+            rate_limiter.acquire()
+            try:
+                response = self.session.post(url, header_auth=True, headers=headers, data=payload)
+                error = None
+            except requests.exceptions.ConnectTimeout as e:
+                # the request never reached E*Trade so it is safe to resend
+                response, error = None, str(e)
+                time.sleep(backoff_seconds * attempts)
+                continue
+            except requests.exceptions.RequestException as e:
+                response, error = None, str(e)
+                if retry_connection_errors:
+                    time.sleep(backoff_seconds * attempts)
+                    continue
+                break
+            if response.status_code in retryable_status_codes:
+                error = response.text[:500]
+                time.sleep(backoff_seconds * attempts)
+                continue
+            break
+        return response, attempts, error
+
+    def preview_and_place_order(self, symbol, order_action, quantity, price_type='MARKET_ON_CLOSE',
+                                parent_strategy='flw', client_order_id=None, rate_limiter=None, max_retries=2):
+        '''
+        preview then place a single equity order through the API without printing or sleeping.
+        Returns a result record rather than raising so it can run inside a worker pool
+
+        example
+        symbol='UGLD', order_action='BUY', quantity=1, price_type='MARKET_ON_CLOSE'
+        '''
+        start_time = time.monotonic()
+        rate_limiter = rate_limiter or self.get_order_rate_limiter()
+        if client_order_id is None:
+            client_order_id = self.generate_client_order_id(symbol=symbol, order_action=order_action,
+                                                            parent_strategy=parent_strategy, price_type=price_type)
+        record = {'symbol': symbol, 'order_action': order_action, 'quantity': quantity,
+                  'price_type': price_type, 'client_order_id': client_order_id,
+                  'preview_id': None, 'order_id': None, 'status': 'FAILED', 'stage': 'preview',
+                  'http_status': None, 'attempts': 0, 'error': None}
+        accountIdKey = self.account_map["accountIdKey"]
+        order_kwargs = {'client_order_id': client_order_id, 'symbol': symbol, 'order_action': order_action,
+                        'quantity': quantity, 'price_type': price_type}
+        try:
+            preview_url = f'{self.base_url}/v1/accounts/{accountIdKey}/orders/preview.json'
+            response, attempts, error = self.post_order_request(
+                url=preview_url,
+                payload=self.generate_order_payload(request_type='PreviewOrderRequest', **order_kwargs),
+                retryable_status_codes=PREVIEW_RETRYABLE_STATUS_CODES, retry_connection_errors=True,
+                rate_limiter=rate_limiter, max_retries=max_retries)
+            record['attempts'] += attempts
+            record['error'] = error
+            if response is None or response.status_code != 200:
+                if response is not None:
+                    record['http_status'] = response.status_code
+                    record['error'] = response.text[:500]
+                return record
+            record['preview_id'] = response.json()['PreviewOrderResponse']['PreviewIds'][0]['previewId']
+
+            record['stage'] = 'place'
+            place_url = f'{self.base_url}/v1/accounts/{accountIdKey}/orders/place.json'
+            response, attempts, error = self.post_order_request(
+                url=place_url,
+                payload=self.generate_order_payload(request_type='PlaceOrderRequest',
+                                                    preview_id=record['preview_id'], **order_kwargs),
+                retryable_status_codes=PLACE_RETRYABLE_STATUS_CODES, retry_connection_errors=False,
+                rate_limiter=rate_limiter, max_retries=max_retries)
+            record['attempts'] += attempts
+            record['error'] = error
+            if response is None:
+                # the place request may have reached E*Trade, check open orders before resending
+                record['status'] = 'UNKNOWN'
+                return record
+            record['http_status'] = response.status_code
+            if response.status_code != 200:
+                record['error'] = response.text[:500]
+                return record
+            record['order_id'] = response.json()['PlaceOrderResponse']['OrderIds'][0]['orderId']
+            record['status'] = 'PLACED'
+            record['error'] = None
+        except Exception as e:
+            record['error'] = str(e)
+            if record['stage'] == 'place':
+                record['status'] = 'UNKNOWN'
+        finally:
+            record['seconds'] = time.monotonic() - start_time
+        return record
+
+    def execute_order_batch(self, order_frame, price_type='MARKET_ON_CLOSE', parent_strategy='flw',
+                            max_workers=ORDER_BATCH_MAX_WORKERS, requests_per_second=ETRADE_ORDER_REQUESTS_PER_SECOND,
+                            max_retries=2, respect_priority=True):
+        '''
+        Concurrently preview and place every row of an order frame through the API.
+
+        order_frame is the order_frame_to_execute from
+        generate_production_realignment_order_frame_and_outstanding_orders (symbol, order_action,
+        orders_to_work and optionally priority). All calls share the per account token bucket.
+        With respect_priority each priority level (sells before buys) finishes before the next starts.
+
+        Returns one frame with a row per order: client_order_id, preview_id, order_id,
+        status (PLACED, FAILED or UNKNOWN), stage, http_status, attempts, error, seconds
+        '''
+        orders = order_frame[order_frame['orders_to_work']!=0].copy()
+        if len(orders) == 0:
+            return pd.DataFrame()
+        rate_limiter = self.get_order_rate_limiter(requests_per_second=requests_per_second)
+        orders['client_order_id'] = orders.apply(lambda x: self.generate_client_order_id(
+            symbol=x['symbol'], order_action=x['order_action'],
+            parent_strategy=parent_strategy, price_type=price_type), 1)
+        # the random prefix is only three letters so make sure ids are unique within the batch
+        while orders['client_order_id'].duplicated().any():
+            duplicated = orders['client_order_id'].duplicated()
+            orders.loc[duplicated, 'client_order_id'] = orders[duplicated].apply(
+                lambda x: self.generate_client_order_id(symbol=x['symbol'], order_action=x['order_action'],
+                                                        parent_strategy=parent_strategy, price_type=price_type), 1)
+        if respect_priority and 'priority' in orders.columns:
+            waves = [wave for _, wave in orders.groupby('priority', sort=True)]
+        else:
+            waves = [orders]
+
+        start_time = time.monotonic()
+        records = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for wave in waves:
+                futures = [executor.submit(self.preview_and_place_order,
+                                           symbol=x['symbol'], order_action=x['order_action'],
+                                           quantity=int(x['orders_to_work']), price_type=price_type,
+                                           parent_strategy=parent_strategy,
+                                           client_order_id=x['client_order_id'],
+                                           rate_limiter=rate_limiter, max_retries=max_retries)
+                           for _, x in wave.iterrows()]
+                records.extend(future.result() for future in futures)
+        result_frame = pd.DataFrame(records)
+        status_counts = result_frame['status'].value_counts().to_dict()
+        print(f'{price_type} batch of {len(result_frame)} orders in {time.monotonic() - start_time:.1f}s {status_counts}')
+        for _, failed in result_frame[result_frame['status']!='PLACED'].iterrows():
+            print(f"failed {failed['stage']} {failed['symbol']} {failed['order_action']} {failed['quantity']}: {failed['error']}")
+        return result_frame
+
     def generate_production_realignment_order_frame_and_outstanding_orders(self,session_to_realign_to='nt'):
         #session_to_realign_to='nt'
         try:
@@ -1068,7 +1274,8 @@ class EtradeTool:
             pass
         current_posis= self.get_current_position_df()
         current_values = current_posis.groupby('symbolDescription').sum(numeric_only=True)['quantity']
-        target_values=self.google_sheet_manager.load_google_sheet_as_df(workbook='odv', worksheet='etrade_target')
+        target_values=self.google_sheet_manager.load_google_sheet_as_df(workbook='odv', worksheet='etrade_target',
+                                                                    max_age_seconds=0)
         target_values=target_values[target_values['session']==session_to_realign_to].copy()
 
         tquantity=target_values.groupby('localSymbol').first()['position']
@@ -1137,22 +1344,20 @@ class EtradeTool:
 
 
         non_zero_orders = op['order_frame_to_execute'][op['order_frame_to_execute']['orders_to_work']!=0].copy()
-        non_zero_orders.apply(lambda x: self.try_place_market_on_close_order(symbol=x['symbol'],
-                                                                                     order_action=x['order_action'], quantity=x['orders_to_work'], 
-                                                                                              parent_strategy='flw'),1)
+        order_results = self.execute_order_batch(non_zero_orders, price_type='MARKET_ON_CLOSE', parent_strategy='flw')
 
         non_zero_orders_ux = op['order_frame_to_execute_via_UX'][op['order_frame_to_execute_via_UX']['orders_to_work']!=0].copy()
         non_zero_orders_ux.apply(lambda x: self.try_place_limit_on_close_short_order(symbol=x['symbol'],
                                                                                      quantity=x['orders_to_work'],
                                                                                      discount_to_work=.04),1)
+        return order_results
+
     def execute_market_on_open_realignment(self):
         session_to_realign_to='dt'
         self.cancel_all_detritus_orders(session_to_realign_to=session_to_realign_to)
         op= self.generate_production_realignment_order_frame_and_outstanding_orders(session_to_realign_to=session_to_realign_to)
         non_zero_orders = op['order_frame_to_execute'][op['order_frame_to_execute']['orders_to_work']!=0].copy()
-        non_zero_orders.apply(lambda x: self.try_place_market_on_open_order(symbol=x['symbol'],
-                                                                                     order_action=x['order_action'], quantity=x['orders_to_work'], 
-                                                                                              parent_strategy='flw'),1)
+        return self.execute_order_batch(non_zero_orders, price_type='MARKET', parent_strategy='flw')
         
 
     def place_aggressor_moc_orders(self):
@@ -1173,13 +1378,6 @@ class EtradeTool:
         sell_short = oframe[oframe['order_action'] == 'SELL_SHORT'].copy()
         session_to_realign_to='nt'
         self.cancel_all_detritus_orders(session_to_realign_to=session_to_realign_to)
-        def try_place_moc_buy_api(ticker_to_work,share_count):
-            try:
-                self.try_place_market_on_close_order(symbol=ticker_to_work, order_action='BUY',
-                                                    quantity=share_count,parent_strategy='flw',sleep_time=0)
-            except:
-                pass
-        
         def try_place_moc_buy__ux(ticker_to_work='NHS',share_count=5):
             try:
                 self.etrade_ux_driver.place_market_on_close_buy_order(ticker_to_work=ticker_to_work, share_count=share_count)
@@ -1214,7 +1412,7 @@ class EtradeTool:
         
         def parallel_execution_moc_buy_and_loc_short(moc_buy_df, moc_short_df):
             with ThreadPoolExecutor() as executor:
-                future1 = executor.submit(moc_buy_df.apply, lambda x: try_place_moc_buy_api(x['symbol'], x['orders_to_work']), 1)
+                future1 = executor.submit(self.execute_order_batch, moc_buy_df, price_type='MARKET_ON_CLOSE', parent_strategy='flw')
                 future2 = executor.submit(moc_short_df.apply, lambda x: try_place_loc_short__ux(x['symbol'], x['orders_to_work']), 1)
                 return future1.result(), future2.result()#,future3.result(),future4.result()
         buy_below_102.apply(lambda x: try_place_loc_buy__ux(ticker_to_work=x['symbol'], share_count=x['orders_to_work']),1)
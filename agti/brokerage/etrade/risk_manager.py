@@ -73,7 +73,8 @@ class ETradeRiskTool:
         return this_mornings_fills
 
     def output_failed_order_df(self):
-        full_df = self.google_sheet_manger.load_google_sheet_as_df(workbook='odv',worksheet='etrade_target')
+        full_df = self.google_sheet_manger.load_google_sheet_as_df(workbook='odv',worksheet='etrade_target',
+                                                                   max_age_seconds=0)
         target_positions = full_df.groupby('localSymbol').first()[['notional_usd','position']].astype(float)
         etrade_positions = self.etrade_tool.get_current_position_df()#.groupby('symbol').first()#['quantity']
         etrade_positions['directional_quantity']=etrade_positions['positionType'].map({'LONG':1,'SHORT':-1})*etrade_positions['quantity']
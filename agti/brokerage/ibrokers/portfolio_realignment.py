@@ -33,7 +33,9 @@ class IBEquityRealignment:
 
     DEFAULT_STRATEGY = "nst"  # Default 3-letter strategy code
     DEFAULT_METATAG = "closing"  # Default metatag
-    ORDER_TIMEOUT = 10  # seconds to wait for order acknowledgment
+    ORDER_TIMEOUT = 30  # seconds from submission for an order to be acknowledged, matches the old per-order wait
+    MAX_IN_FLIGHT_ORDERS = 50  # unacknowledged orders allowed at once
+    ACKNOWLEDGED_STATUSES = ['Submitted', 'Filled', 'Cancelled']
 
     def __init__(self, pw_map, client_id=5, session='dt'):
         """
@@ -49,6 +51,7 @@ class IBEquityRealignment:
         self.google_sheet_manager = GoogleSheetManager(prod_trading=True)
         self.ib_connection = None
         self.async_manager = None
+        self.last_order_status = None
 
     def connect_ibkr(self):
         """
@@ -100,7 +103,8 @@ class IBEquityRealignment:
         """
         target_df = self.google_sheet_manager.load_google_sheet_as_df(
             workbook=self.pw_map['production_trading_gsheet_workbook_name'],
-            worksheet='ibkr_target'
+            worksheet='ibkr_target',
+            max_age_seconds=0  # always read the sheet values before trading, never the cache
         )
 
         if target_df.empty:
@@ -332,82 +336,140 @@ class IBEquityRealignment:
 
         return orders_df
 
-    def place_orders_from_preview(self, orders_df):
-            """
-            Places orders based on the provided orders DataFrame with enhanced error handling.
-            """
-            placed_orders = []
-            try:
-                for _, row in orders_df.iterrows():
-                    # Create the order
+    def place_orders_from_preview(self, orders_df, max_in_flight=None, cancel_on_failure=True):
+        """
+        Submits all orders from the preview without waiting on each acknowledgment.
+
+        Orders are placed back to back while at most max_in_flight are unacknowledged,
+        status transitions are tracked from orderStatusEvent. Each order has ORDER_TIMEOUT
+        seconds from submission to reach an acknowledged status.
+
+        :param orders_df: DataFrame produced by generate_order_preview.
+        :param max_in_flight: Maximum number of unacknowledged orders, defaults to MAX_IN_FLIGHT_ORDERS.
+        :param cancel_on_failure: If True, cancel all working orders and raise when any order fails.
+        :return: DataFrame with the final status of every order, also kept in self.last_order_status.
+        """
+        max_in_flight = max_in_flight or self.MAX_IN_FLIGHT_ORDERS
+        records = {}  # orderId -> status record
+        trades = {}  # orderId -> Trade
+
+        def on_order_status(trade):
+            record = records.get(trade.order.orderId)
+            if record is None:
+                return
+            status = trade.orderStatus.status
+            record['status'] = status
+            record['status_history'].append(status)
+            if status in self.ACKNOWLEDGED_STATUSES and record['acknowledged_at'] is None:
+                record['acknowledged_at'] = datetime.datetime.now()
+            if status == 'Inactive':
+                record['error'] = 'Order became inactive'
+
+        def is_pending(record):
+            return record['acknowledged_at'] is None and record['error'] is None
+
+        self.ib_connection.orderStatusEvent += on_order_status
+        try:
+            rows = list(orders_df.itertuples(index=False))
+            next_row = 0
+            while next_row < len(rows) or any(is_pending(record) for record in records.values()):
+                if cancel_on_failure and any(record['error'] is not None for record in records.values()):
+                    # no new orders once the realignment is going to be unwound
+                    break
+                # submit while there is room in the in-flight window
+                in_flight = sum(is_pending(record) for record in records.values())
+                while next_row < len(rows) and in_flight < max_in_flight:
+                    row = rows[next_row]
+                    next_row += 1
                     order = self.construct_order(
-                        action=row['action'],
-                        quantity=row['quantity'],
-                        order_type=row['order_type'],
-                        order_ref=row['order_ref']
+                        action=row.action,
+                        quantity=row.quantity,
+                        order_type=row.order_type,
+                        order_ref=row.order_ref
                     )
-    
-                    # Place the order
-                    trade = self.ib_connection.placeOrder(row['qualified_contract'], order)
-                    placed_orders.append((trade, row['localSymbol']))
-                    
-                    # Wait for order to be acknowledged with extended timeout
-                    start_time = datetime.datetime.now()
-                    max_wait = 30  # Extended timeout to 30 seconds
-    
-                    while True:
-                        self.ib_connection.sleep(0.1)  # Small sleep to prevent CPU spin
-                        
-                        current_status = trade.orderStatus.status
-                        if current_status in ['Submitted', 'Filled', 'Cancelled']:
-                            print(f"Order for {row['localSymbol']} reached status: {current_status}")
-                            break
-                            
-                        if current_status == 'Inactive':
-                            raise ValueError(f"Order for {row['localSymbol']} became inactive")
-                            
-                        elapsed = (datetime.datetime.now() - start_time).seconds
-                        if elapsed > max_wait:
-                            raise TimeoutError(f"Order timeout for {row['localSymbol']} after {max_wait}s in status: {current_status}")
-    
-                    print(f"Placed {row['order_type'].upper()} {row['action']} order for {row['quantity']} shares of {row['localSymbol']}")
-                    
-                    # Add delay between orders
-                    self.ib_connection.sleep(1.0)  # Increased delay between orders
-    
-            except Exception as e:
-                print(f"Error during order placement: {str(e)}")
-                print("Attempting to cancel all placed orders...")
-                
-                cancellation_errors = []
-                for trade, symbol in placed_orders:
-                    try:
-                        if trade.orderStatus.status not in ['Cancelled', 'Filled']:
-                            self.ib_connection.cancelOrder(trade.order)
-                            
-                            # Wait for cancellation to be acknowledged
-                            cancel_start = datetime.datetime.now()
-                            while True:
-                                self.ib_connection.sleep(0.1)
-                                if trade.orderStatus.status in ['Cancelled']:
-                                    print(f"Successfully cancelled order for {symbol}")
-                                    break
-                                if (datetime.datetime.now() - cancel_start).seconds > 10:
-                                    raise TimeoutError(f"Cancellation timeout for {symbol}")
-                                    
-                    except Exception as cancel_error:
-                        error_msg = f"Error cancelling order for {symbol}: {str(cancel_error)}"
-                        print(error_msg)
-                        cancellation_errors.append(error_msg)
-                
-                # Raise final error with details
-                error_msg = f"Order placement failed: {str(e)}. "
-                if not cancellation_errors:
-                    error_msg += "All placed orders have been cancelled."
-                else:
-                    error_msg += f"Some cancellations failed: {'; '.join(cancellation_errors)}"
-                
-                raise RuntimeError(error_msg) from e
+                    trade = self.ib_connection.placeOrder(row.qualified_contract, order)
+                    trades[trade.order.orderId] = trade
+                    records[trade.order.orderId] = {
+                        'localSymbol': row.localSymbol,
+                        'orderId': trade.order.orderId,
+                        'action': row.action,
+                        'quantity': row.quantity,
+                        'order_type': row.order_type,
+                        'order_ref': row.order_ref,
+                        'status': trade.orderStatus.status,
+                        'status_history': [],
+                        'submitted_at': datetime.datetime.now(),
+                        'acknowledged_at': None,
+                        'error': None,
+                    }
+                    # status may already be known when the client answers synchronously
+                    on_order_status(trade)
+                    in_flight += 1
+
+                self.ib_connection.sleep(0.05)  # lets ib_insync process incoming events
+
+                now = datetime.datetime.now()
+                for record in records.values():
+                    if is_pending(record) and (now - record['submitted_at']).total_seconds() > self.ORDER_TIMEOUT:
+                        record['error'] = f"Order timeout after {self.ORDER_TIMEOUT}s in status: {record['status']}"
+
+            failed = [record for record in records.values() if record['error'] is not None]
+            if failed and cancel_on_failure:
+                print(f"{len(failed)} orders failed, cancelling all working orders...")
+                self.cancel_trades(list(trades.values()), records)
+        except Exception as e:
+            print(f"Error during order placement: {str(e)}")
+            print("Attempting to cancel all placed orders...")
+            self.cancel_trades(list(trades.values()), records)
+            self.last_order_status = pd.DataFrame(list(records.values()))
+            raise RuntimeError(f"Order placement failed: {str(e)}. See last_order_status for cancellations.") from e
+        finally:
+            self.ib_connection.orderStatusEvent -= on_order_status
+
+        status_df = pd.DataFrame(list(records.values()))
+        if not status_df.empty:
+            status_df['ack_seconds'] = (
+                pd.to_datetime(status_df['acknowledged_at']) - pd.to_datetime(status_df['submitted_at'])
+            ).dt.total_seconds()
+        self.last_order_status = status_df
+
+        for record in records.values():
+            if record['error'] is None:
+                print(f"Placed {record['order_type'].upper()} {record['action']} order for {record['quantity']} shares of {record['localSymbol']}, status: {record['status']}")
+            else:
+                print(f"Order for {record['localSymbol']} failed: {record['error']}")
+
+        if failed and cancel_on_failure:
+            failed_symbols = [record['localSymbol'] for record in failed]
+            raise RuntimeError(f"Order placement failed for {failed_symbols}. Working orders were cancelled, see last_order_status.")
+        return status_df
+
+    def cancel_trades(self, trades, records, timeout=10):
+        """
+        Cancels all trades that are not final and waits for the cancellations together.
+
+        :param trades: List of ib_insync Trade objects.
+        :param records: orderId -> status record, updated in place.
+        :param timeout: Seconds to wait for all cancellations.
+        """
+        to_cancel = [trade for trade in trades if trade.orderStatus.status not in ['Cancelled', 'Filled']]
+        for trade in to_cancel:
+            self.ib_connection.cancelOrder(trade.order)
+
+        start_time = datetime.datetime.now()
+        while any(trade.orderStatus.status != 'Cancelled' for trade in to_cancel):
+            if (datetime.datetime.now() - start_time).total_seconds() > timeout:
+                break
+            self.ib_connection.sleep(0.1)
+
+        for trade in to_cancel:
+            record = records[trade.order.orderId]
+            record['status'] = trade.orderStatus.status
+            if trade.orderStatus.status == 'Cancelled':
+                print(f"Successfully cancelled order for {record['localSymbol']}")
+            else:
+                record['error'] = record['error'] or f"Cancellation timeout in status: {trade.orderStatus.status}"
+                print(f"Error cancelling order for {record['localSymbol']}: cancellation timeout")
 
     def construct_order(self, action, quantity, order_type, order_ref):
         """
@@ -497,9 +559,13 @@ class IBEquityRealignment:
                 raise RuntimeError("Account not ready for trading")
 
             # Step 8: Place orders
-            self.place_orders_from_preview(orders_df)
+            status_df = self.place_orders_from_preview(orders_df)
 
-            return orders_df
+            return orders_df.merge(
+                status_df[['order_ref', 'orderId', 'status', 'ack_seconds']],
+                on='order_ref',
+                how='left'
+            )
 
         except Exception as e:
             print(f"Error during realignment: {str(e)}")
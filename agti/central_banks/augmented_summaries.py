@@ -12,16 +12,24 @@ from agti.utilities.db_manager import DBConnectionManager
 from agti.utilities.settings import PasswordMapLoader
 from agti.utilities.settings import CredentialManager
 from agti.ai.openrouter import OpenRouterTool
+from agti.central_banks.table_names import DEFAULT_CENTRAL_BANKS_TABLE_NAME, get_content_hash_table_name
 import datetime
+import asyncio
+import nest_asyncio
 import pandas as pd
 import numpy as np
 
 class CentralBankPDFProcessor:
-    def __init__(self, pw_map: Dict, user_name: str = 'agti_corp'):
-        """Initialize with password map and user."""
+    # columns derived from the scraper content hash index, never persisted
+    CONTENT_HASH_COLUMNS = ['content_hash', 'canonical_aws_link']
+
+    def __init__(self, pw_map: Dict, user_name: str = 'agti_corp',
+                 scraper_table_name: str = DEFAULT_CENTRAL_BANKS_TABLE_NAME):
+        """Initialize with password map and user. scraper_table_name is the scrapers' sql_config.TABLE_NAME."""
         self.pw_map = pw_map
         self.user_name = user_name
         self.db_conn_manager = DBConnectionManager(pw_map)
+        self.content_hash_table_name = get_content_hash_table_name(scraper_table_name)
         self.dbconn = None
         self.data = None
         
@@ -38,18 +46,35 @@ class CentralBankPDFProcessor:
             self.dbconn.dispose()
             
     @staticmethod
-    def extract_pdf_text(url: str) -> str:
-        """Extract text from a PDF URL."""
+    def download_pdf(url: str, session: Optional[requests.Session] = None) -> Optional[bytes]:
+        """Download a PDF, None if it is not available."""
         try:
-            resp = requests.get(url, timeout=10)
+            resp = (session or requests).get(url, timeout=10)
             if resp.status_code == 200:
-                reader = PdfReader(BytesIO(resp.content))
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text()
-                return text
+                return resp.content
+        except:
+            return None
+        return None
+
+    @staticmethod
+    def parse_pdf_bytes(content: bytes) -> str:
+        """Extract text from PDF bytes."""
+        try:
+            reader = PdfReader(BytesIO(content))
+            text = ""
+            for page in reader.pages:
+                text += page.extract_text()
+            return text
         except:
             return ""
+
+    @staticmethod
+    def extract_pdf_text(url: str) -> str:
+        """Extract text from a PDF URL."""
+        content = CentralBankPDFProcessor.download_pdf(url)
+        if content is None:
+            return None
+        return CentralBankPDFProcessor.parse_pdf_bytes(content)
     
     def load_g10_data(self, start_date: str = '2020-01-01') -> pd.DataFrame:
         """Load G10 central bank data from database."""
@@ -62,22 +87,67 @@ class CentralBankPDFProcessor:
             lambda x: f"https://agti-central-banks.s3.us-east-1.amazonaws.com/{x['country_code_alpha_3']}/{x['year']}/{x['file_id']}.pdf",
             axis=1
         )
+        self.add_canonical_links(g10_snapshot)
         
         self.data = g10_snapshot
         return g10_snapshot
+
+    def load_content_hash_index(self, content_hash_table: Optional[str] = None) -> pd.Series:
+        """Load file_id -> content hash mapping written by the scrapers."""
+        if content_hash_table is None:
+            content_hash_table = self.content_hash_table_name
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        try:
+            if not sqlalchemy.inspect(dbconnx).has_table(content_hash_table):
+                print(f"Table '{content_hash_table}' not found. Documents will not be deduplicated by content.")
+                return pd.Series(dtype=object)
+            index = pd.read_sql(f"SELECT DISTINCT file_id, content_hash FROM {content_hash_table}", dbconnx)
+        finally:
+            dbconnx.dispose()
+        return index.drop_duplicates('file_id').set_index('file_id')['content_hash']
+
+    def add_canonical_links(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Add content_hash and canonical_aws_link, the first link holding the same content."""
+        content_hashes = self.load_content_hash_index()
+        df['content_hash'] = df['file_id'].map(content_hashes)
+        # documents without a known hash are only identical to themselves
+        dedup_key = df['content_hash'].fillna(df['aws_link'])
+        df['canonical_aws_link'] = df.groupby(dedup_key)['aws_link'].transform('first')
+        return df
+
+    def load_extracted_text(self, aws_links: List[str],
+                            table_name: str = 'all_central_bank_filings') -> Dict[str, str]:
+        """Load already extracted text for the given links."""
+        if not aws_links:
+            return {}
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        query = text(f"SELECT aws_link, extracted_text FROM {table_name} WHERE aws_link IN :aws_links")
+        query = query.bindparams(sqlalchemy.bindparam('aws_links', expanding=True))
+        try:
+            existing = pd.read_sql(query, dbconnx, params={'aws_links': list(aws_links)})
+        except:
+            return {}
+        finally:
+            dbconnx.dispose()
+        return existing.groupby('aws_link')['extracted_text'].last().to_dict()
     
-    def identify_unextracted_pdfs(self) -> List[str]:
-        """Identify PDFs that haven't been extracted yet."""
+    def load_extracted_links(self, table_name: str = 'all_central_bank_filings') -> set:
+        """Load the set of links already present in the extraction table."""
         dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
         try:
-            existing_pdf_table = pd.read_sql('all_central_bank_filings', dbconnx)
-            existing_in_table = list(existing_pdf_table['aws_link'].unique())
+            with dbconnx.connect() as con:
+                rs = con.execute(text(f"SELECT DISTINCT aws_link FROM {table_name}"))
+                return {row[0] for row in rs}
         except:
             # Table doesn't exist, all PDFs need extraction
-            existing_in_table = []
-            print("Table 'all_central_bank_filings' not found. Will extract all PDFs.")
+            print(f"Table '{table_name}' not found. Will extract all PDFs.")
+            return set()
         finally:
             dbconnx.dispose()
+
+    def identify_unextracted_pdfs(self, table_name: str = 'all_central_bank_filings') -> List[str]:
+        """Identify PDFs that haven't been extracted yet."""
+        existing_in_table = self.load_extracted_links(table_name)
         
         # Get all possible PDFs
         if self.data is None:
@@ -97,24 +167,31 @@ class CentralBankPDFProcessor:
             raise ValueError("No data loaded. Call load_g10_data() first.")
             
         start_time = time.time()
-        urls = self.data['aws_link'].tolist()
-        results = [None] * len(urls)
+        if 'canonical_aws_link' not in self.data.columns:
+            self.add_canonical_links(self.data)
+        # Identical documents are extracted once, under their canonical link
+        canonical_links = self.data['canonical_aws_link']
+        reused = self.load_extracted_text(list(set(canonical_links) - set(self.data['aws_link'])))
+        urls = [url for url in canonical_links.unique() if url not in reused]
+        results = dict(reused)
         
         # Use processes for CPU-bound PDF parsing
         with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            future_to_index = {
-                executor.submit(self.extract_pdf_text, url): i 
-                for i, url in enumerate(urls)
+            future_to_url = {
+                executor.submit(self.extract_pdf_text, url): url 
+                for url in urls
             }
             
-            for future in tqdm(as_completed(future_to_index), total=len(urls), 
+            for future in tqdm(as_completed(future_to_url), total=len(urls), 
                              desc="Extracting PDFs", unit="pdf"):
-                index = future_to_index[future]
-                results[index] = future.result()
+                results[future_to_url[future]] = future.result()
         
         # Add extracted text to data
-        self.data['extracted_text'] = results
+        self.data['extracted_text'] = canonical_links.map(results)
         self.data['extracted_text'] = self.data['extracted_text'].str.replace('\x00', '', regex=False)
+        reused_count = len(self.data) - len(urls)
+        if reused_count > 0:
+            print(f"Reused text for {reused_count} PDFs with identical content")
         
         elapsed = time.time() - start_time
         print(f"\nExtracted {len(urls)} PDFs in {elapsed:.1f} seconds ({len(urls)/elapsed:.1f} PDFs/sec)")
@@ -136,6 +213,96 @@ class CentralBankPDFProcessor:
         
         # Use the regular extract_pdfs method on the filtered data
         self.extract_pdfs(max_workers)
+
+    def write_extracted_batch(self, batch: pd.DataFrame, table_name: str = 'all_central_bank_filings',
+                              chunksize: int = 5000) -> None:
+        """Append a batch of extracted filings, the table is created by the first batch."""
+        batch = batch.drop(columns=self.CONTENT_HASH_COLUMNS, errors='ignore')
+        string_cols = batch.select_dtypes(include=['object']).columns
+        for col in string_cols:
+            batch[col] = batch[col].astype(str).str.replace('\x00', '', regex=False)
+        dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name=self.user_name)
+        try:
+            batch.to_sql(
+                table_name,
+                dbconnx,
+                if_exists='append',
+                index=False,
+                method='multi',
+                chunksize=chunksize
+            )
+        finally:
+            dbconnx.dispose()
+
+    async def stream_extract_pdfs(self, max_workers: int = 8,
+                                  max_in_flight: int = 32,
+                                  batch_size: int = 200,
+                                  table_name: str = 'all_central_bank_filings') -> int:
+        """
+        Extract the PDFs in self.data and append them to table_name in batches as they finish.
+        
+        Downloads run on threads, parsing on a process pool. Text is not kept in self.data,
+        an interrupted run resumes from the links already written to table_name.
+        Returns the number of rows written.
+        """
+        if self.data is None:
+            raise ValueError("No data loaded. Call load_g10_data() first.")
+        if len(self.data) == 0:
+            return 0
+
+        start_time = time.time()
+        if 'canonical_aws_link' not in self.data.columns:
+            self.add_canonical_links(self.data)
+        canonical_links = self.data['canonical_aws_link']
+        rows_by_link = self.data.groupby('canonical_aws_link').indices
+
+        rows_written = 0
+        def flush(results: Dict[str, str]) -> int:
+            positions = np.concatenate([rows_by_link[url] for url in results])
+            batch = self.data.iloc[positions].copy()
+            batch['extracted_text'] = batch['canonical_aws_link'].map(results)
+            self.write_extracted_batch(batch, table_name)
+            return len(batch)
+
+        # Identical documents extracted in earlier runs are copied, not downloaded
+        reused = self.load_extracted_text(list(set(canonical_links) - set(self.data['aws_link'])), table_name)
+        if reused:
+            rows_written += flush(reused)
+            print(f"Reused text for {len(reused)} PDFs with identical content")
+        urls = [url for url in canonical_links.unique() if url not in reused]
+
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(max_in_flight)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_in_flight, pool_maxsize=max_in_flight)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            async def extract(url):
+                async with in_flight:
+                    content = await asyncio.to_thread(self.download_pdf, url, session)
+                    if content is None:
+                        return url, None
+                    # Use processes for CPU-bound PDF parsing
+                    return url, await loop.run_in_executor(executor, self.parse_pdf_bytes, content)
+
+            tasks = [asyncio.create_task(extract(url)) for url in urls]
+            results = {}
+            for next_done in tqdm(asyncio.as_completed(tasks), total=len(tasks),
+                                  desc="Extracting PDFs", unit="pdf"):
+                url, extracted_text = await next_done
+                results[url] = extracted_text
+                if len(results) >= batch_size:
+                    rows_written += flush(results)
+                    results = {}
+            if results:
+                rows_written += flush(results)
+        session.close()
+
+        elapsed = time.time() - start_time
+        print(f"\nExtracted {len(urls)} PDFs in {elapsed:.1f} seconds, wrote {rows_written} rows to {table_name}")
+        return rows_written
     
     def save_to_database(self, table_name: str = 'all_central_bank_filings', 
                         if_exists: str = 'replace', 
@@ -144,6 +311,8 @@ class CentralBankPDFProcessor:
         if self.data is None:
             raise ValueError("No data to save. Process data first.")
             
+        self.data = self.data.drop(columns=self.CONTENT_HASH_COLUMNS, errors='ignore')
+
         # Drop table if replacing
         if if_exists == 'replace':
             with self.dbconn.begin() as conn:
@@ -172,6 +341,7 @@ class CentralBankPDFProcessor:
         if self.data is None or len(self.data) == 0:
             print("No data to save.")
             return
+        self.data = self.data.drop(columns=self.CONTENT_HASH_COLUMNS, errors='ignore')
         
         # Clean string columns
         string_cols = self.data.select_dtypes(include=['object']).columns
@@ -208,16 +378,31 @@ class CentralBankPDFProcessor:
     
     def process_incremental(self, start_date: str = '2020-01-01', 
                           max_workers: int = 8,
-                          table_name: str = 'all_central_bank_filings') -> pd.DataFrame:
-        """Complete incremental pipeline: identify new PDFs, extract, and save."""
+                          table_name: str = 'all_central_bank_filings',
+                          max_in_flight: int = 32,
+                          batch_size: int = 200) -> pd.DataFrame:
+        """Complete incremental pipeline: identify new PDFs, extract and save them in batches."""
         # Load all data
         self.load_g10_data(start_date)
         
         # Extract only new PDFs
-        self.extract_incremental_pdfs(max_workers)
+        unextracted_pdfs = set(self.identify_unextracted_pdfs(table_name))
+        self.data = self.data[self.data['aws_link'].isin(unextracted_pdfs)].copy()
+        if len(self.data) == 0:
+            print("No new PDFs to extract.")
+            return self.data
         
-        # Save to database incrementally
-        self.save_incremental_to_database(table_name)
+        # Results are saved to the database batch by batch
+        nest_asyncio.apply()
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(
+            self.stream_extract_pdfs(
+                max_workers=max_workers,
+                max_in_flight=max_in_flight,
+                batch_size=batch_size,
+                table_name=table_name
+            )
+        )
         
         return self.data
     
@@ -285,16 +470,43 @@ class CentralBankPDFProcessor:
             """Split dataframe into chunks using list comprehension"""
             chunks = [df[i:i+chunk_size] for i in range(0, len(df), chunk_size)]
             return chunks
-        all_unique_docs = []
-        try:
-            dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-            all_documents =pd.read_sql('agti_central_bank_summary_reference', dbconnx)
-            all_unique_docs = list(all_documents['document'].unique())
-            dbconnx.dispose()
-        except:
-            pass
+        def load_summary_reference():
+            try:
+                dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+                all_documents = pd.read_sql('agti_central_bank_summary_reference', dbconnx)
+                dbconnx.dispose()
+                return all_documents
+            except:
+                return pd.DataFrame(columns=['document', 'extracted_info', 'datetime', 'model'])
+
         central_bank_dexed = all_central_bank_filings.groupby('aws_link').first()
+        link_hashes = central_bank_dexed['file_id'].map(self.load_content_hash_index()).dropna()
+
+        def reuse_summaries_with_identical_content(df_to_work):
+            """Copy existing summaries to documents with the same content hash, return the rest."""
+            all_documents = load_summary_reference()
+            summarized = all_documents.assign(content_hash=all_documents['document'].map(link_hashes))
+            summarized = summarized.dropna(subset=['content_hash']).groupby('content_hash').last()
+            work_hashes = df_to_work['aws_link'].map(link_hashes)
+            reusable = work_hashes.isin(summarized.index)
+            if reusable.any():
+                args_to_write = summarized.loc[work_hashes[reusable], ['extracted_info', 'model']].reset_index(drop=True)
+                args_to_write.insert(0, 'document', df_to_work.loc[reusable, 'aws_link'].values)
+                args_to_write['datetime'] = datetime.datetime.now()
+                dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+                args_to_write.to_sql('agti_central_bank_summary_reference', dbconnx, if_exists='append', index=False)
+                dbconnx.dispose()
+                print(f"Reused {len(args_to_write)} summaries for documents with identical content")
+            return df_to_work[~reusable]
+
+        all_unique_docs = list(load_summary_reference()['document'].unique())
         central_bank_df_to_work = central_bank_dexed[~central_bank_dexed.index.isin(all_unique_docs)].reset_index()
+        central_bank_df_to_work = reuse_summaries_with_identical_content(central_bank_df_to_work)
+        # only one document per content hash goes to the model, the others copy its summary afterwards
+        work_hashes = central_bank_df_to_work['aws_link'].map(link_hashes)
+        duplicated_content = work_hashes.notna() & work_hashes.duplicated()
+        pending_duplicates = central_bank_df_to_work[duplicated_content]
+        central_bank_df_to_work = central_bank_df_to_work[~duplicated_content]
         all_df_chunks = chunk_dataframe_method1(central_bank_df_to_work,300)
 
         for dfchunkx in all_df_chunks:
@@ -314,6 +526,9 @@ class CentralBankPDFProcessor:
             args_to_write.to_sql('agti_central_bank_summary_reference', dbconnx, if_exists='append',index=False)
             dbconnx.dispose()
 
+        if len(pending_duplicates) > 0:
+            reuse_summaries_with_identical_content(pending_duplicates)
+
     def output_augmented_filings(self):
         dbconnx = self.db_conn_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
         full_extracted_history =pd.read_sql('agti_central_bank_summary_reference', dbconnx)
@@ -12,10 +12,12 @@ import hashlib
 import pandas as pd
 import requests
 from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 from selenium.webdriver.support import expected_conditions as EC
 import urllib3
-from agti.agti.central_banks.utils import classify_extension, get_hash_for_url, get_status
+from agti.agti.central_banks.utils import classify_extension, get_hash_for_file, get_document_status, get_hash_for_url
 from agti.agti.central_banks.common import clean_text
+from agti.agti.central_banks.table_names import get_content_hash_table_name
 from agti.utilities.settings import CredentialManager
 from botocore.exceptions import ClientError
 from agti.agti.central_banks.types import DYNAMIC_PAGE_EXTENSIONS, SCRAPERCONFIG, SQLDBCONFIG, STATIC_PAGE_EXTENSIONS, BotoS3Config, CountryCB, ExtensionType, LinkMetadata, MainMetadata, SupportedScrapers, URLType
@@ -105,6 +107,8 @@ class BaseBankScraper:
             raise ValueError(f"Failed to create or access S3 bucket: {boto3_config.BUCKET_NAME}")
 
         self.cookies = None
+        # one entry per driver.get, see get_page_load_stats
+        self.page_loads = []
         self.initialize_cookies(go_to_url=True)
 
 
@@ -185,9 +189,12 @@ class BaseBankScraper:
                 new_headers = self.driver_manager.headers
                 logger.debug("Refreshing headers", extra={"new_headers": new_headers})
             try:
+                self.driver_manager.reset_document_responses()
+                start = time.perf_counter()
                 self.driver_manager.driver.get(url)
-                logs = self.driver_manager.driver.get_log("performance")
-                response = get_status(logs, url)
+                load_seconds = time.perf_counter() - start
+                response, response_seconds = get_document_status(self.driver_manager.document_responses, url)
+                self.record_page_load(url, response, load_seconds, response_seconds)
             except (urllib3.exceptions.ReadTimeoutError, TimeoutError) as e:
                 logger.exception(f"TimeoutError for url: {url}, ERROR: {e}", extra={"url": url})
                 # we have to wait for a while
@@ -232,6 +239,40 @@ class BaseBankScraper:
             self.session_counter += 1
         return True
 
+    def record_page_load(self, url, status, load_seconds, response_seconds):
+        """Record timing of a single page load."""
+        self.page_loads.append({
+            "url": url,
+            "netloc": urlparse(url).netloc,
+            "status": status,
+            "load_seconds": load_seconds,
+            "response_seconds": response_seconds,
+            "timestamp": pd.Timestamp.now(tz="UTC"),
+        })
+        logger.debug(f"Loaded {url} in {load_seconds:.2f}s, response code: {status}", extra={
+            "url": url,
+            "status": status,
+            "load_seconds": load_seconds,
+            "response_seconds": response_seconds,
+        })
+
+    def get_page_load_stats(self):
+        """
+        Summarize page load timings per site.
+
+        Returns:
+            pd.DataFrame: count, mean, median and max load seconds and mean document response seconds per netloc, slowest first.
+        """
+        df = pd.DataFrame(self.page_loads, columns=["url", "netloc", "status", "load_seconds", "response_seconds", "timestamp"])
+        stats = df.groupby("netloc").agg(
+            page_loads=("url", "count"),
+            mean_load_seconds=("load_seconds", "mean"),
+            median_load_seconds=("load_seconds", "median"),
+            max_load_seconds=("load_seconds", "max"),
+            mean_response_seconds=("response_seconds", "mean"),
+        )
+        return stats.sort_values("mean_load_seconds", ascending=False)
+
     def get_headers(self):
         return self.driver_manager.headers
     
@@ -261,6 +302,9 @@ class BaseBankScraper:
     def get_links_table_name(self):
         return f"{self.sql_config.TABLE_NAME}_links"
 
+    def get_content_hash_table_name(self):
+        return get_content_hash_table_name(self.sql_config.TABLE_NAME)
+
     def get_all_db_urls(self):
         """Retrieve all URLs already stored in the database."""
         dbconnx = self.sql_config.CONNECTION_MANAGER.spawn_sqlalchemy_db_connection_for_user(self.sql_config.USER_NAME)
@@ -299,6 +343,43 @@ class BaseBankScraper:
         return output
     
 
+    def get_db_content_hash_entry(self, content_hash):
+        """
+        Retrieve the stored object for the given content hash.
+
+        Returns:
+            tuple | None: (file_id, s3_key) of the first upload with the same content, None if unknown.
+        """
+        dbconnx = self.sql_config.CONNECTION_MANAGER.spawn_sqlalchemy_db_connection_for_user(self.sql_config.USER_NAME)
+        table_name = self.get_content_hash_table_name()
+        query = text(f"SELECT file_id, s3_key FROM {table_name} WHERE content_hash = :content_hash ORDER BY created_at LIMIT 1")
+        params = {"content_hash": content_hash}
+        try:
+            with dbconnx.connect() as con:
+                row = con.execute(query, params).fetchone()
+        except SQLAlchemyError:
+            # table is created with the first insert
+            logger.debug(f"Unable to read content hash table {table_name}", exc_info=True)
+            return None
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def add_to_content_hashes(self, url, content_hash, file_id, s3_key, dbconnx=None):
+        """Store url -> content hash mapping with the S3 object holding the content."""
+        df = pd.DataFrame([{
+            "url": url,
+            "content_hash": content_hash,
+            "file_id": file_id,
+            "s3_key": s3_key,
+            "country_code_alpha_3": self.bank_config.COUNTRY_CODE_ALPHA_3,
+            "created_at": pd.Timestamp.now(tz="UTC"),
+        }])
+        if dbconnx is None:
+            dbconnx = self.sql_config.CONNECTION_MANAGER.spawn_sqlalchemy_db_connection_for_user(self.sql_config.USER_NAME)
+        table_name = self.get_content_hash_table_name()
+        df.to_sql(table_name, con=dbconnx, if_exists="append", index=False)
+
     def add_to_db(self, data, dbconnx=None):
         """Store scraped data into the database."""
         df = pd.DataFrame(data)
@@ -552,9 +633,9 @@ class BaseBankScraper:
         """
         filepath = self.download_file(url, extension)
         if filepath is not None:
-            done = self.upload_file_to_s3(filepath, metadata, year=year)
-            if done:
-                return filepath.stem
+            file_id = self.upload_file_to_s3(filepath, metadata, year=year)
+            if file_id is not None:
+                return file_id
             else:
                 logger.error(f"Failed to upload file to S3: {filepath}", extra={
                     "url": url,
@@ -589,23 +670,44 @@ class BaseBankScraper:
             remove_file (bool): Whether to remove the local file after upload.
             
         Returns:
-            bool: True if the file was uploaded successfully, False otherwise.
+            str | None: The file id of the S3 object holding the content, None otherwise.
         1. Upload the file to S3 bucket.
         path: /country_code_alpha_3/{year}/
+        2. If the same content was already uploaded under the same path,
+        the existing object is reused and its file id is returned.
         """
         # create key
         filename = filepath.name
         if year is None:
             year = "unknown"
         key = f"{self.bank_config.COUNTRY_CODE_ALPHA_3}/{year}/{filename}"
+        url = metadata.url
+
+        # check if the same content is already stored
+        content_hash = get_hash_for_file(filepath)
+        entry = self.get_db_content_hash_entry(content_hash)
+        if entry is not None:
+            existing_file_id, existing_key = entry
+            # the object is addressed by country/year/file_id, so we can only reuse it within the same path
+            if existing_key == f"{self.bank_config.COUNTRY_CODE_ALPHA_3}/{year}/{existing_file_id}{filepath.suffix}":
+                logger.info(f"Content of {url} already stored in S3: {existing_key}", extra={
+                    "url": url,
+                    "content_hash": content_hash,
+                    "existing_key": existing_key,
+                })
+                self.add_to_content_hashes(url, content_hash, existing_file_id, existing_key)
+                if remove_file:
+                    os.remove(filepath)
+                return existing_file_id
 
         # check if file exists in S3
         try:
             self.bucket.Object(key).load()
             logger.info(f"File already exists in S3: {key}")
+            self.add_to_content_hashes(url, content_hash, filepath.stem, key)
             if remove_file:
                 os.remove(filepath)
-            return True
+            return filepath.stem
         except ClientError as e:
             error_code = e.response["Error"]["Code"]
             if error_code != "404":
@@ -625,19 +727,21 @@ class BaseBankScraper:
             key,
             ExtraArgs=extra_args,
         )
+        self.add_to_content_hashes(url, content_hash, filepath.stem, key)
         # Remove local file if specified
         if remove_file:
             os.remove(filepath)
         
         logger.info(f"Uploaded {filename} to S3 bucket {self.bucket.name} at path {self.bank_config.COUNTRY_CODE_ALPHA_3}/{year}/")
-        return True
+        return filepath.stem
     
 
     def process_html_page(self, metadata: MainMetadata | LinkMetadata, year):
         filepath = self.save_page_as_pdf()
         if filepath is not None:
-            if self.upload_file_to_s3(filepath, metadata, year=year):
-                return filepath.stem
+            file_id = self.upload_file_to_s3(filepath, metadata, year=year)
+            if file_id is not None:
+                return file_id
             logger.error(f"Failed to upload file to S3: {filepath}", extra={
                 "year": year,
                 "filepath": filepath,
@@ -855,8 +959,9 @@ class BaseBankScraper:
                 url=link,
             )
             if filepath is not None:
-                if self.upload_file_to_s3(filepath, metadata, year=year):
-                    result.append((link, link_text, filepath.stem))
+                file_id = self.upload_file_to_s3(filepath, metadata, year=year)
+                if file_id is not None:
+                    result.append((link, link_text, file_id))
                 else:
                     logger.error(f"Failed to upload file to S3: {filepath}", extra={
                         "link": link,
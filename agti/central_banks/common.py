@@ -37,6 +37,8 @@ class DriverManager:
         self.generator = None
         self.headers = None
         self.driver = None
+        # url -> status of main document responses since the last reset_document_responses
+        self.document_responses = {}
 
     def new_headers(self):
         if self.generator is None:
@@ -73,7 +75,6 @@ class DriverManager:
                 }
             }
         options = Options()
-        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
         if self.run_headless:
             options.add_argument("--headless")
             options.add_argument("--disable-gpu")
@@ -89,7 +90,7 @@ class DriverManager:
         
         self.new_headers()
         self.driver.request_interceptor = self.intercept_headers
-
+        self.driver.response_interceptor = self.intercept_document_response
 
         return self
     
@@ -98,13 +99,28 @@ class DriverManager:
         self.headers = None
         self.generator = None
         self.driver = None
+        self.document_responses = {}
         time.sleep(0.1)
 
     def intercept_headers(self,request):
         for my_header,header_value in self.headers.items():
             del request.headers[my_header]
             request.headers[my_header] = header_value
-        
+
+    def intercept_document_response(self, request, response):
+        # only top level navigations, subresources are ignored
+        if request.headers.get("Sec-Fetch-Dest") != "document":
+            return
+        self.document_responses[request.url] = {
+            "status": response.status_code,
+            "location": response.headers.get("Location"),
+            "response_seconds": (response.date - request.date).total_seconds(),
+        }
+
+    def reset_document_responses(self):
+        self.document_responses = {}
+        # selenium-wire keeps every captured request, we do not need them
+        del self.driver.requests
 
 
 
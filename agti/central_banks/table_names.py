@@ -0,0 +1,6 @@
+# shared by the scrapers (writers) and the pdf processor (reader) so both agree on table names
+DEFAULT_CENTRAL_BANKS_TABLE_NAME = "central_banks"
+
+
+def get_content_hash_table_name(table_name):
+    return f"{table_name}_content_hashes"
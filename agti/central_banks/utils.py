@@ -1,12 +1,11 @@
 import os
 import logging
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 import requests
 import hashlib
 import time
 import enum
-import json
 import re
 
 from agti.agti.central_banks.types import DYNAMIC_PAGE_EXTENSIONS, STATIC_PAGE_EXTENSIONS, ExtensionType
@@ -32,6 +31,16 @@ def get_hash_for_url(url):
     """
     return hashlib.sha1(url.encode()).hexdigest()
 
+def get_hash_for_file(filepath, chunk_size=8192):
+    """
+    Get the SHA-256 hash of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
 def classify_extension(ext):
     """
     Classify the file extension into static or dynamic.
@@ -76,11 +85,11 @@ def scroll_to_page_bottom(driver):
         time.sleep(0.001)
         scroll_position+=5
 
-def get_status(logs, target_url):
+def get_possible_urls(target_url):
     parsed_target_url = urlparse(target_url)
     # get clean url without fragment
     without_fragment_target_url = parsed_target_url._replace(fragment="").geturl()
-    possible_urls = [
+    return [
         target_url,
         without_fragment_target_url,
         without_fragment_target_url + "?",
@@ -89,18 +98,31 @@ def get_status(logs, target_url):
         parsed_target_url._replace(path=parsed_target_url.path + "/").geturl(),
         parsed_target_url._replace(path=parsed_target_url.path.rstrip("/")).geturl(),
     ]
-    target_url_req_id = -1
-    for log in logs:
-        msg = json.loads(log["message"])["message"]
-        method = msg.get("method")
-        params = msg.get("params", {})
-        if method == "Network.requestWillBeSent" and params.get("request", {}).get("url") in possible_urls:
-            target_url_req_id = params.get("requestId")
-        elif method == "Network.responseReceived":
-            req_id = params.get("requestId")
-            resp = params.get("response", {})
-            if req_id == target_url_req_id:
-                status = resp.get("status")
-                if status:
-                    return status
-    return None
\ No newline at end of file
+
+def get_document_status(document_responses, target_url, max_redirects=10):
+    """
+    Get the final status of the main document request for target_url.
+
+    Args:
+        document_responses (dict): url -> {"status", "location", "response_seconds"} captured by DriverManager
+        target_url (str): the url passed to driver.get
+
+    Returns:
+        tuple: (status, response_seconds) of the final response after redirects, (None, None) if not captured.
+    """
+    url = target_url
+    response_seconds = 0.0
+    for _ in range(max_redirects + 1):
+        response = next(
+            (document_responses[u] for u in get_possible_urls(url) if u in document_responses),
+            None
+        )
+        if response is None:
+            return None, None
+        response_seconds += response["response_seconds"]
+        status = response["status"]
+        if 300 <= status < 400 and response["location"]:
+            url = urljoin(url, response["location"])
+            continue
+        return status, response_seconds
+    return None, None
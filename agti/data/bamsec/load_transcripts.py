@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import itertools
 import string
 import time
@@ -7,6 +8,7 @@ import numpy as np
 import pandas as pd
 import requests
 import selenium
+import sqlalchemy
 from rauth import OAuth1Service
 from selenium import webdriver
 from selenium.webdriver.common.action_chains import ActionChains
@@ -20,15 +22,58 @@ from selenium.webdriver.edge.options import Options
 import time
 from PyPDF2 import PdfReader
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from agti.utilities.db_manager import DBConnectionManager
 
+BAMSEC_TRANSCRIPT_TABLE = 'bamsec___full_transcripts_raw'
+# PDF text extraction is CPU bound so it runs in worker processes, the browser stays on the main thread
+BAMSEC_PDF_MAX_WORKERS = min(8, os.cpu_count() or 1)
+BAMSEC_DB_WRITE_CHUNKSIZE = 200
+
+
+def hash_pdf_file(pdf_file_path):
+    """sha256 of the file contents, used to key the extracted text cache"""
+    sha = hashlib.sha256()
+    with open(pdf_file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def extract_pdf_text(pdf_file_path):
+    """Concatenated text of every page. Module level so it can be shipped to a process pool"""
+    with open(pdf_file_path, 'rb') as file:
+        reader = PdfReader(file)
+        return ''.join(page.extract_text() for page in reader.pages)
+
+
+def parse_earnings_transcript_text(pdf_text):
+    """Strips the S&P boilerplate from a transcript and returns a one row frame of its details"""
+    sp_global_copyright = 'Copyright © 2023 S&P Global Market Intelligence, a division of S&P Global Inc.'
+    sp_global_copyright2 = 'S&P Global Market  Intelligence, a division of S&P Global  Inc. All rights reserved'
+    sp_global_copyright3 = 'S&P Global Inc.'
+    sp_global_copyright4= 'All rights reserved'
+    account_manager_bullshit= 'Capability needed to view  estimates data. Please  contact your account \nmanager'
+    full_text_resource = pdf_text.split('These materials have been prepared solely for information purposes')[0].replace(sp_global_copyright,'').replace(sp_global_copyright2,'').replace(account_manager_bullshit,'').replace(sp_global_copyright4,'').replace(sp_global_copyright3,'').replace('All Rights reserved','')
+    imputed_ticker = full_text_resource.split('\nEarnings Call\n')[0].split(':')[-1:][0]
+    date_string = full_text_resource.split('\nEarnings Call\n')[1].split('\n')[0]
+    precise_upload_time = pd.to_datetime(date_string)
+    quarter = int(full_text_resource.split('FQ')[1].split(' ')[0])
+    year = int(full_text_resource.split(f'FQ{quarter}')[1].split(' EARNINGS CALL')[0].strip())
+    xdfx= pd.DataFrame({'ticker':imputed_ticker,'upload_time__utc':precise_upload_time,
+     'quarter':quarter,'year':year,'raw_transcript':full_text_resource},index=[0])
+    return xdfx
+
+
 class BamSecUXDriver:
     def __init__(self,pw_map,driver_type):
         self.pw_map= pw_map
         self.local_folder = self.pw_map['local_data_dump']+'bamsec/'
+        # extracted text keyed by pdf sha256 so an unchanged transcript is never parsed twice
+        self.text_cache_folder = os.path.join(self.local_folder, 'pdf_text_cache')
         self.db_connection_manager = DBConnectionManager(pw_map=pw_map)
-        if not os.path.exists(self.local_folder):
-            os.makedirs(self.local_folder)
+        if not os.path.exists(self.text_cache_folder):
+            os.makedirs(self.text_cache_folder)
         
                 #options = Options()
         #options = Options()
@@ -173,75 +218,140 @@ class BamSecUXDriver:
     # Your existing folder
     #local_folder = self.pw_map['local_data_dump'] + 'bamsec/'
     def process_pdf_file_path_to_output_df(self, pdf_file_path):
-    # File path
-        
-        
-        # Initialize an empty string to store text
-        pdf_text = ""
-        
-        # Initialize PdfReader object
-        with open(pdf_file_path, 'rb') as file:
-            reader = PdfReader(file)
-        
-            # Loop through each page
-            for i in range(len(reader.pages)):
-                # Get each page
-                page = reader.pages[i]
-                
-                # Extract text from the page
-                page_text = page.extract_text()
-                
-                # Append the text to the final string
-                pdf_text += page_text
-        
-        # Now pdf_text contains all the text from the PDF
-        sp_global_copyright = 'Copyright © 2023 S&P Global Market Intelligence, a division of S&P Global Inc.'
-        sp_global_copyright2 = 'S&P Global Market  Intelligence, a division of S&P Global  Inc. All rights reserved'
-        sp_global_copyright3 = 'S&P Global Inc.'
-        sp_global_copyright4= 'All rights reserved'
-        account_manager_bullshit= 'Capability needed to view  estimates data. Please  contact your account \nmanager'
-        full_text_resource = pdf_text.split('These materials have been prepared solely for information purposes')[0].replace(sp_global_copyright,'').replace(sp_global_copyright2,'').replace(account_manager_bullshit,'').replace(sp_global_copyright4,'').replace(sp_global_copyright3,'').replace('All Rights reserved','')
-        imputed_ticker = full_text_resource.split('\nEarnings Call\n')[0].split(':')[-1:][0]
-        date_string = full_text_resource.split('\nEarnings Call\n')[1].split('\n')[0]
-        precise_upload_time = pd.to_datetime(date_string)
-        quarter = int(full_text_resource.split('FQ')[1].split(' ')[0])
-        year = int(full_text_resource.split(f'FQ{quarter}')[1].split(' EARNINGS CALL')[0].strip())
-        xdfx= pd.DataFrame({'ticker':imputed_ticker,'upload_time__utc':precise_upload_time,
-         'quarter':quarter,'year':year,'raw_transcript':full_text_resource},index=[0])
-        return xdfx
+        pdf_text = self.extract_pdf_texts([pdf_file_path], raise_errors=True)[pdf_file_path]
+        return parse_earnings_transcript_text(pdf_text)
 
-    def output_tickers_most_recent_eps_transcript_df(self,ticker_to_work = 'UAL'):
-        
+    def get_cached_pdf_text(self, pdf_hash):
+        cache_path = os.path.join(self.text_cache_folder, f'{pdf_hash}.txt')
+        if not os.path.isfile(cache_path):
+            return None
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def write_cached_pdf_text(self, pdf_hash, pdf_text):
+        cache_path = os.path.join(self.text_cache_folder, f'{pdf_hash}.txt')
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(pdf_text)
+        os.replace(temp_path, cache_path)
+
+    def extract_pdf_texts(self, pdf_file_paths, max_workers=BAMSEC_PDF_MAX_WORKERS, raise_errors=False):
+        '''
+        Returns {pdf_file_path: text}. PDFs whose hash is already in the text cache are read
+        from disk, the rest are extracted in a process pool and cached. Files that fail to
+        parse are left out of the output, or the PyPDF2 error is raised with raise_errors
+        '''
+        pdf_file_paths = list(dict.fromkeys(pdf_file_paths))
+        output_map = {}
+        paths_by_hash = {}
+        for pdf_file_path in pdf_file_paths:
+            pdf_hash = hash_pdf_file(pdf_file_path)
+            cached_text = self.get_cached_pdf_text(pdf_hash)
+            if cached_text is not None:
+                output_map[pdf_file_path] = cached_text
+            else:
+                paths_by_hash.setdefault(pdf_hash, []).append(pdf_file_path)
+        if len(paths_by_hash) == 0:
+            return output_map
+        print(f'EXTRACTING {len(paths_by_hash)} PDFS, {len(output_map)} UNCHANGED')
+        if len(paths_by_hash) == 1 or max_workers <= 1:
+            extracted = {}
+            for pdf_hash, paths in paths_by_hash.items():
+                try:
+                    extracted[pdf_hash] = extract_pdf_text(paths[0])
+                except Exception as e:
+                    if raise_errors:
+                        raise
+                    print(f'FAILED EXTRACTING {paths[0]}: {e}')
+        else:
+            extracted = {}
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(paths_by_hash))) as executor:
+                future_to_hash = {executor.submit(extract_pdf_text, paths[0]): pdf_hash
+                                  for pdf_hash, paths in paths_by_hash.items()}
+                for future in as_completed(future_to_hash):
+                    pdf_hash = future_to_hash[future]
+                    try:
+                        extracted[pdf_hash] = future.result()
+                    except Exception as e:
+                        if raise_errors:
+                            raise
+                        print(f'FAILED EXTRACTING {paths_by_hash[pdf_hash][0]}: {e}')
+        for pdf_hash, pdf_text in extracted.items():
+            self.write_cached_pdf_text(pdf_hash, pdf_text)
+            for pdf_file_path in paths_by_hash[pdf_hash]:
+                output_map[pdf_file_path] = pdf_text
+        return output_map
+
+    def download_tickers_most_recent_eps_transcript_pdf(self, ticker_to_work='UAL'):
+        ''' browser half of the pipeline, returns the local pdf path of the latest earnings call '''
         self.navigate_to_ticker_homepage(ticker_to_work=ticker_to_work)
         self.navigate_to_transcript_page()
-        earnings_df = self.go_to_first_earnings_page()
-        earnings_event_string = pd.to_datetime(list(earnings_df.head(1)['event_date'])[0]).strftime('%Y-%m-%d')
+        self.go_to_first_earnings_page()
         pdf_details = self.get_pdf_details()
         self.write_pdf_per_detail_format_and_go_back(pdf_details=pdf_details)
-        pdf_full_file_path = self.local_folder+pdf_details['pdf_file_name']
-        output_df = self.process_pdf_file_path_to_output_df(pdf_file_path=pdf_full_file_path)
-        output_df['as_of_time'] = datetime.datetime.now()
+        return self.local_folder+pdf_details['pdf_file_name']
 
-        
+    def format_transcript_output_df(self, pdf_text):
+        output_df = parse_earnings_transcript_text(pdf_text)
+        output_df['as_of_time'] = datetime.datetime.now()
         output_df['upload_time'] = output_df['upload_time__utc'].dt.tz_convert('US/Eastern')
-        output_df['resource_unique_identifier']=output_df['ticker']+'_Earnings_Call_Transcript_'+output_df['upload_time'].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'))
+        output_df['resource_unique_identifier']=output_df['ticker']+'_Earnings_Call_Transcript_'+output_df['upload_time'].dt.strftime('%Y-%m-%d %H:%M:%S')
         output_df['document_type']='Earnings_Call_Transcript'
         return output_df
 
-    def write_tickers_most_recent_eps_transcript_df(self,ticker_to_work='BAC'):
-        output_df = self.output_tickers_most_recent_eps_transcript_df(ticker_to_work=ticker_to_work)
+    def output_tickers_most_recent_eps_transcript_df(self,ticker_to_work = 'UAL'):
+        pdf_full_file_path = self.download_tickers_most_recent_eps_transcript_pdf(ticker_to_work=ticker_to_work)
+        pdf_text = self.extract_pdf_texts([pdf_full_file_path], raise_errors=True)[pdf_full_file_path]
+        return self.format_transcript_output_df(pdf_text)
+
+    def write_transcript_output_dfs(self, output_dfs):
+        '''
+        Writes transcript frames in one batch, skipping resource_unique_identifiers already
+        in the table so re-running a refresh only inserts new transcripts. Skipped transcripts
+        get their as_of_time bumped, which records that the ticker was checked for the
+        days_stale_since_update_max gate
+        '''
+        output_dfs = [i for i in output_dfs if i is not None and len(i) > 0]
+        if len(output_dfs) == 0:
+            print('NO TRANSCRIPTS TO WRITE')
+            return 0
+        full_output_df = pd.concat(output_dfs, ignore_index=True).drop_duplicates('resource_unique_identifier')
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-        output_df.to_sql('bamsec___full_transcripts_raw',dbconnx, if_exists='append', index=False)
+        existing_identifiers = set()
+        # on the first write the table does not exist yet, any other read error propagates
+        if sqlalchemy.inspect(dbconnx).has_table(BAMSEC_TRANSCRIPT_TABLE):
+            existing_identifiers = set(pd.read_sql(f'select resource_unique_identifier from {BAMSEC_TRANSCRIPT_TABLE};',
+                                                   dbconnx)['resource_unique_identifier'])
+        new_output_df = full_output_df[~full_output_df['resource_unique_identifier'].isin(existing_identifiers)]
+        if len(new_output_df) > 0:
+            new_output_df.to_sql(BAMSEC_TRANSCRIPT_TABLE, dbconnx, if_exists='append', index=False,
+                                 method='multi', chunksize=BAMSEC_DB_WRITE_CHUNKSIZE)
+        checked_identifiers = list(set(full_output_df['resource_unique_identifier']) & existing_identifiers)
+        if len(checked_identifiers) > 0:
+            query = sqlalchemy.text(f'UPDATE {BAMSEC_TRANSCRIPT_TABLE} SET as_of_time = :as_of_time '
+                                    'WHERE resource_unique_identifier IN :identifiers')
+            query = query.bindparams(sqlalchemy.bindparam('identifiers', expanding=True))
+            with dbconnx.begin() as conn:
+                conn.execute(query, {'as_of_time': datetime.datetime.now(), 'identifiers': checked_identifiers})
         dbconnx.dispose()
+        print(f'WROTE {len(new_output_df)} TRANSCRIPTS, SKIPPED {len(full_output_df)-len(new_output_df)} ALREADY STORED')
+        return len(new_output_df)
+
+    def write_tickers_most_recent_eps_transcript_df(self,ticker_to_work='BAC'):
+        output_df = self.output_tickers_most_recent_eps_transcript_df(ticker_to_work=ticker_to_work)
+        self.write_transcript_output_dfs([output_df])
 
     def write_bamsec_earnings_filings_for_ticker_list(self,tickers_to_update = ['JPM','V','NFLX','UAL','SSTK','PANW','TWLO','SEDG','ENPH','C','JNJ'],
                                                       force=False,
                                                       days_stale_since_transcript_max=14,
-                                                      days_stale_since_update_max=0):
+                                                      days_stale_since_update_max=0,
+                                                      max_workers=BAMSEC_PDF_MAX_WORKERS):
     
         '''
         days_stale_since_transcript_max references the upload date of the actual transcript
         whereas days_stale_since_update references the update date on our side 
+        PDFs are downloaded ticker by ticker in the browser, then extracted together in a
+        process pool and written in one batch
         EXAMPLE:
         tickers_to_update = ['JPM','V','NFLX','UAL','SSTK','PANW','TWLO','SEDG','ENPH','C','JNJ'],
                                                       force=False,
@@ -251,49 +361,38 @@ class BamSecUXDriver:
         '''
         
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-        updated_as_of_df = pd.read_sql('select * from bamsec___full_transcripts_raw;',dbconnx)
+        updated_as_of_df = pd.read_sql(f'select ticker, as_of_time, upload_time from {BAMSEC_TRANSCRIPT_TABLE};',dbconnx)
         dbconnx.dispose()
-        updated_as_of_df['days_stale_from_update_time']=(datetime.datetime.now()
-                                                         -updated_as_of_df['as_of_time']).apply(lambda x: x.days)
-        updated_as_of_df['days_stale_from_transcript_date'] = (datetime.datetime.now() 
-                                                               - updated_as_of_df['upload_time'].dt.tz_localize(None)).apply(lambda x: x.days)
-        #recently_updated = updated_as_of_df[updated_as_of_df['days_stale']<days_stale_max]
-        #recently_updated_tickers = list(recently_updated['ticker'])
+        now = datetime.datetime.now()
+        updated_as_of_df['days_stale_from_update_time']=(now-updated_as_of_df['as_of_time']).dt.days
+        updated_as_of_df['days_stale_from_transcript_date'] = (now - updated_as_of_df['upload_time'].dt.tz_localize(None)).dt.days
         recently_updated_per_transcript = updated_as_of_df[updated_as_of_df.days_stale_from_transcript_date <= days_stale_since_transcript_max]
-        recently_updated_per_update = updated_as_of_df[updated_as_of_df.days_stale_from_update_time <= days_stale_since_update_max].copy()
-        all_updated_tickers = list(set(list(recently_updated_per_transcript['ticker'])+list(recently_updated_per_update['ticker'])))
+        recently_updated_per_update = updated_as_of_df[updated_as_of_df.days_stale_from_update_time <= days_stale_since_update_max]
+        all_updated_tickers = set(recently_updated_per_transcript['ticker']) | set(recently_updated_per_update['ticker'])
         remaining_tickers_to_update=tickers_to_update
         if force == False:
             remaining_tickers_to_update = [i for i in tickers_to_update if i not in all_updated_tickers]
-            for xticker in remaining_tickers_to_update:
-                try:
-                    self.write_tickers_most_recent_eps_transcript_df(xticker)
-                except:
-                    print(f'FAILED WRITING {xticker}')
-                    pass
+
+        pdf_paths_by_ticker = {}
+        for xticker in remaining_tickers_to_update:
+            try:
+                pdf_paths_by_ticker[xticker] = self.download_tickers_most_recent_eps_transcript_pdf(xticker)
+            except:
+                print(f'FAILED DOWNLOADING {xticker}')
+                pass
+
+        pdf_text_map = self.extract_pdf_texts(list(pdf_paths_by_ticker.values()), max_workers=max_workers)
+        output_dfs = []
+        for xticker, pdf_path in pdf_paths_by_ticker.items():
+            try:
+                output_dfs.append(self.format_transcript_output_df(pdf_text_map[pdf_path]))
+            except:
+                print(f'FAILED WRITING {xticker}')
+                pass
+        return self.write_transcript_output_dfs(output_dfs)
 
     def process_pdf_file_path_to_raw_pdf_text(self, pdf_file_path):
-    # File path
-        
-        
-        # Initialize an empty string to store text
-        pdf_text = ""
-        
-        # Initialize PdfReader object
-        with open(pdf_file_path, 'rb') as file:
-            reader = PdfReader(file)
-        
-            # Loop through each page
-            for i in range(len(reader.pages)):
-                # Get each page
-                page = reader.pages[i]
-                
-                # Extract text from the page
-                page_text = page.extract_text()
-                
-                # Append the text to the final string
-                pdf_text += page_text
-        return pdf_text
+        return self.extract_pdf_texts([pdf_file_path], raise_errors=True)[pdf_file_path]
 
     def generate_recent_update_for_ticker(self,ticker_to_work='NFLX',last_x_days=1):
         self.navigate_to_ticker_homepage(ticker_to_work=ticker_to_work)
@@ -318,8 +417,9 @@ class BamSecUXDriver:
             update_df=update_df.copy()
             update_df['ticker']=ticker_to_work
             update_df['pdf_file_name']=pdf_file_name
-            update_df['local_file_path']= update_df['pdf_file_name'].apply(lambda x: os.path.join(self.local_folder, pdf_file_name))
-            update_df['full_transcript_text']=update_df['local_file_path'].apply(lambda x: self.process_pdf_file_path_to_raw_pdf_text(x))
+            update_df['local_file_path']= os.path.join(self.local_folder, pdf_file_name)
+            pdf_text_map = self.extract_pdf_texts(update_df['local_file_path'], raise_errors=True)
+            update_df['full_transcript_text']=update_df['local_file_path'].map(pdf_text_map)
             upload_time = pd.to_datetime(list(update_df['full_transcript_text'])[0].split('GMT\n  \n')[0].split('\n')[-1:][0].strip())
             update_df['upload_time']=upload_time
             update_df['internal_resource_type']= type_string
@@ -14,6 +14,8 @@ import datetime
 import pytz
 import sqlalchemy
 import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from blpapi.exception import InvalidArgumentException
 
 
@@ -366,8 +368,18 @@ def processMessage(msg):
                     
 
 class IntradayBloombergTool:
-    def __init__(self):
+    def __init__(self, max_sessions=4):
         self.in_load=Pybbg()
+        # IntradayBarRequest takes one security, so concurrent pulls each need their own session
+        self.max_sessions = max_sessions
+        self.session_pool = queue.Queue()
+        self.session_pool.put(self.in_load)
+        self.session_count = 1
+
+    def ensure_session_pool(self, size):
+        while self.session_count < min(size, self.max_sessions):
+            self.session_pool.put(Pybbg())
+            self.session_count += 1
     def get_intraday_history__legacy(self,ticker, 
                              field_name, 
                              interval, 
@@ -397,7 +409,7 @@ class IntradayBloombergTool:
         return op_df
 
 
-    def get_intraday_history(self, ticker, field_name, interval, startDateTime, endDateTime):
+    def get_intraday_history(self, ticker, field_name, interval, startDateTime, endDateTime, in_load=None):
         """
         Fetch intraday historical data from Bloomberg for a given ticker.
 
@@ -407,14 +419,16 @@ class IntradayBloombergTool:
             interval (int): Time interval in minutes.
             startDateTime (datetime): Start of data period.
             endDateTime (datetime): End of data period.
+            in_load (Pybbg): Session to use, defaults to the tool's own session.
 
         Returns:
             pd.DataFrame: Historical data with all fields, or an empty DataFrame if fetch fails.
         """
         fld_list = [field_name]
+        in_load = in_load or self.in_load
         try:
             # Retrieve intraday bar data
-            op_df = self.in_load.bdib(
+            op_df = in_load.bdib(
                 ticker,
                 fld_list,
                 startDateTime=startDateTime,
@@ -452,13 +466,14 @@ class IntradayBloombergTool:
 
     def get_intraday_history_for_ticker_list(self, tickers, field_name, interval, startDateTime, endDateTime):
         """
-        Fetch intraday historical data for a list of tickers from Bloomberg.
+        Fetch intraday historical data for a list of tickers from Bloomberg, several at a time
+        over a pool of up to max_sessions sessions.
 
         Args:
             tickers (list): List of Bloomberg ticker symbols.
             field_name (str): Field to fetch (e.g., 'close').
             interval (int): Time interval in minutes.
-            startDateTime (datetime): Start of data period.
+            startDateTime (datetime or dict): Start of data period, or {ticker: start} for per ticker starts.
             endDateTime (datetime): End of data period.
 
         Returns:
@@ -468,31 +483,46 @@ class IntradayBloombergTool:
         results = {}
         failed_tickers = []
 
-        for ticker in tickers:
+        def fetch(ticker):
+            in_load = self.session_pool.get()
             try:
                 logging.info(f"Fetching data for ticker: {ticker}")
-                data = self.get_intraday_history(
+                ticker_start = startDateTime.get(ticker) if isinstance(startDateTime, dict) else startDateTime
+                return ticker, self.get_intraday_history(
                     ticker=ticker,
                     field_name=field_name,
                     interval=interval,
-                    startDateTime=startDateTime,
-                    endDateTime=endDateTime
+                    startDateTime=ticker_start,
+                    endDateTime=endDateTime,
+                    in_load=in_load
                 )
+            except Exception as e:
+                logging.error(f"Unexpected error for ticker: {ticker}. Error: {e}")
+                return ticker, None
+            finally:
+                self.session_pool.put(in_load)
+
+        tickers = list(tickers)
+        if len(tickers) == 0:
+            return results
+        self.ensure_session_pool(len(tickers))
+        with ThreadPoolExecutor(max_workers=self.session_count) as executor:
+            for ticker, data in executor.map(fetch, tickers):
                 if data is not None:
                     results[ticker] = data
                 else:
                     failed_tickers.append(ticker)
 
-            except Exception as e:
-                logging.error(f"Unexpected error for ticker: {ticker}. Error: {e}")
-                failed_tickers.append(ticker)
-
         # Log any failures
         if failed_tickers:
             logging.warning(f"Failed to fetch data for the following tickers: {', '.join(failed_tickers)}")
 
         return results
 
-
-
-                
\ No newline at end of file
+    def get_intraday_history_frame(self, tickers, field_name, interval, startDateTime, endDateTime):
+        """Long frame (date, value, field_name, ticker, timezone, unique_identifier) for a list of tickers"""
+        results = self.get_intraday_history_for_ticker_list(tickers=tickers, field_name=field_name, interval=interval,
+                                                            startDateTime=startDateTime, endDateTime=endDateTime)
+        if not results:
+            return pd.DataFrame(columns=['date', 'value', 'field_name', 'ticker', 'timezone', 'unique_identifier'])
+        return pd.concat(results.values(), ignore_index=True)
@@ -200,6 +200,103 @@ class BloombergDailyDataTool:
                     break
         except:
             pass
+    def ProcessBDHBatch(self, msg, fields):
+        '''
+        Converts one HistoricalDataRequest message (a single security) into long records
+        (date, bbgTicker, field, value). Securities with a securityError yield no records.
+        '''
+        secData = msg.getElement("securityData")
+        bbgTicker = secData.getElementAsString("security")
+        if secData.hasElement("securityError"):
+            print(f'BDH security error for {bbgTicker}')
+            return []
+        fieldDataArray = secData.getElement("fieldData")
+        records = []
+        for i in range(fieldDataArray.numValues()):
+            fieldData = fieldDataArray.getValueAsElement(i)
+            date = fieldData.getElementAsString("date").split('+')[0]
+            for field in fields:
+                if fieldData.hasElement(field):
+                    records.append((date, bbgTicker, field, fieldData.getElementAsString(field)))
+        return records
+
+    def BDH_BATCH(self, bbgTickers, field, startDate, endDate, periodicity='DAILY', overrides=None,
+                  max_securities_per_request=50, timeout_seconds=300):
+        '''
+        Multi security BDH. Packs up to max_securities_per_request tickers and every field into each
+        HistoricalDataRequest, sends all requests at once on the session and parses messages as they
+        stream in, instead of one request/response round trip per ticker.
+
+        Args:
+            bbgTickers = list of bloomberg tickers
+            field = a bbg field or list of fields
+            startDate / endDate / periodicity / overrides: as BDH
+        Returns:
+            Long DataFrame indexed by date with columns value, bbgTicker, field, overrides, update_code,
+            the same layout as concatenating BDH frames for each ticker and field
+
+        EXAMPLE
+        bloomberg_daily_tool.BDH_BATCH(bbgTickers=['msft us equity', 'aapl us equity'], field='px_last',
+            startDate='2001-01-01', endDate='2002-01-01')
+        '''
+        fields = [field] if type(field) == str else list(field)
+        bbgTickers = list(dict.fromkeys([i for i in bbgTickers if isinstance(i, str) and i.strip() not in ('', 'nan')]))
+        output_columns = ['value', 'bbgTicker', 'overrides', 'field', 'update_code']
+        if(type(startDate) == str):
+            startDate = datetime.datetime.strptime(startDate, "%Y-%m-%d")
+        if(type(endDate) == str):
+            endDate = datetime.datetime.strptime(endDate, "%Y-%m-%d")
+        if(startDate > endDate):
+            print("Start date needs be before the end date")
+            return pd.DataFrame(columns=output_columns)
+
+        session = self.session
+        refDataService = session.getService("//blp/refdata")
+        pending = set()
+        for start in range(0, len(bbgTickers), max_securities_per_request):
+            request = refDataService.createRequest("HistoricalDataRequest")
+            for bbgTicker in bbgTickers[start:start + max_securities_per_request]:
+                request.getElement("securities").appendValue(bbgTicker)
+            for xfield in fields:
+                request.getElement("fields").appendValue(xfield)
+            if(overrides is not None):
+                overrideBBGCollection = request.getElement("overrides")
+                for overrideField in list(overrides.keys()):
+                    overrideObj = overrideBBGCollection.appendElement()
+                    overrideObj.setElement("fieldId", overrideField)
+                    overrideObj.setElement("value", overrides[overrideField])
+            request.set("periodicityAdjustment", "ACTUAL")
+            request.set("periodicitySelection", periodicity)
+            request.set("startDate", startDate.strftime("%Y%m%d"))
+            request.set("endDate", endDate.strftime("%Y%m%d"))
+            pending.add(session.sendRequest(request))
+
+        records = []
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=timeout_seconds)
+        while pending and datetime.datetime.now() < deadline:
+            # We provide timeout to give the chance to Ctrl+C handling:
+            ev = session.nextEvent(500)
+            for msg in ev:
+                msg_cids = [cid for cid in msg.correlationIds() if cid in pending]
+                if not msg_cids:
+                    continue
+                if msg.hasElement("responseError"):
+                    print(f'BDH request error: {msg.getElement("responseError")}')
+                elif msg.hasElement("securityData"):
+                    records.extend(self.ProcessBDHBatch(msg, fields))
+                # Response completely received for this request
+                if ev.eventType() == blpapi.Event.RESPONSE:
+                    pending.difference_update(msg_cids)
+        if pending:
+            print(f'BDH_BATCH timed out with {len(pending)} requests outstanding')
+
+        op_df = pd.DataFrame(records, columns=['date', 'bbgTicker', 'field', 'value'])
+        op_df['date'] = pd.to_datetime(op_df['date'])
+        op_df = op_df.set_index('date')
+        op_df['overrides'] = json.dumps(overrides)
+        op_df['update_code'] = op_df['bbgTicker'] + '__' + op_df['field'] + '__' + op_df['overrides']
+        return op_df[output_columns]
+
     def ProcessBDP(self, msg, request):
         """
         Processes incoming event messages from the BLPAPI interface
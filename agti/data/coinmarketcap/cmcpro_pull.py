@@ -1,9 +1,75 @@
 from requests import Session
+from requests.adapters import HTTPAdapter
+import math
 import pandas as pd
+import sqlalchemy
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from agti.data.coinmarketcap.scrape_and_cache import CoinMarketCapDataTool
-from sqlalchemy import text
+from agti.utilities.db_manager import ensure_unique_index, insert_on_conflict_do_nothing
+from agti.utilities.rate_limiter import TokenBucket
+
+CMC_REQUESTS_PER_MINUTE = 60
+CMC_MAX_WORKERS = 8
+CMC_PRICE_HISTORY_TABLE = 'coinmarketcap__price_history'
+# historical quotes are charged 1 credit per 100 data points
+CMC_POINTS_PER_CREDIT = 100
+CMC_RATE_LIMIT_PAUSE_SECONDS = 61
+
+
+class CMCCreditBudgetExceeded(RuntimeError):
+    pass
+
+
+class CMCRateLimiter:
+    """
+    Shared limiter for one api key: calls per minute through a TokenBucket plus a credit budget.
+
+    acquire charges the credits a call is expected to cost before it is sent and raises
+    CMCCreditBudgetExceeded instead of spending past the budget. pause holds every worker,
+    used when CMC answers 429.
+    """
+    def __init__(self, requests_per_minute, credit_budget=None):
+        self.call_bucket = TokenBucket(rate=requests_per_minute / 60)
+        self.credit_budget = credit_budget  # credits left to spend, None until synced from the key info
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def set_credit_budget(self, credit_budget):
+        with self.lock:
+            self.credit_budget = credit_budget
+
+    def refund(self, credits):
+        """Returns credits charged up front but not spent, negative when a call cost more than expected"""
+        with self.lock:
+            if self.credit_budget is not None:
+                self.credit_budget += credits
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _wait_for_pause(self):
+        while True:
+            with self.lock:
+                wait_seconds = self.paused_until - time.monotonic()
+            if wait_seconds <= 0:
+                return
+            time.sleep(wait_seconds)
+
+    def acquire(self, credits=1):
+        with self.lock:
+            if self.credit_budget is not None:
+                if credits > self.credit_budget:
+                    raise CMCCreditBudgetExceeded(f'{credits} credits needed, {self.credit_budget} left in the plan')
+                self.credit_budget -= credits
+        self._wait_for_pause()
+        self.call_bucket.acquire()
+
+
+# every call against the api key goes through one limiter, however many CoinMarketCapAPI objects exist
+_CMC_RATE_LIMITER = CMCRateLimiter(requests_per_minute=CMC_REQUESTS_PER_MINUTE)
 
 class CoinMarketCapAPI:
     """
@@ -13,37 +79,54 @@ class CoinMarketCapAPI:
     """ 
     def __init__(self, pw_map):
         self.session = Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=CMC_MAX_WORKERS))
         self.session.headers.update({
             'Accepts': 'application/json',
             'X-CMC_PRO_API_KEY': pw_map['coinmarketcap_api']
         })
         self.data_tool = CoinMarketCapDataTool(pw_map)
+        self.rate_limiter = _CMC_RATE_LIMITER
+        self.usage_lock = threading.Lock()
         self.request_count = 0
-        self.last_request_time = datetime.now()
-        self.RATE_LIMIT = 60  # requests per minute
+        self.credit_count = 0
 
-    def _wait_for_rate_limit(self):
-        """Ensure we don't exceed rate limits"""
-        current_time = datetime.now()
-        elapsed = (current_time - self.last_request_time).total_seconds()
-        
-        # Reset counter if a minute has passed
-        if elapsed >= 60:
-            self.request_count = 0
-            self.last_request_time = current_time
-        
-        # If we're at the rate limit, wait until the minute is up
-        if self.request_count >= self.RATE_LIMIT:
-            sleep_time = 60 - elapsed
-            if sleep_time > 0:
-                print(f"Rate limit reached, waiting {sleep_time:.1f} seconds...")
-                time.sleep(sleep_time)
-                self.request_count = 0
-                self.last_request_time = datetime.now()
-
-    def get_dataframe(self, symbol, interval='1d', count=30, convert='USD', max_retries=3):
+    def _wait_for_rate_limit(self, credits=1):
+        """Block this thread until the shared limiter has room for a request and charge its expected credits"""
+        self.rate_limiter.acquire(credits)
+
+    def _record_usage(self, response, expected_credits=1):
+        """Counts requests and the api credits CMC reports having charged, refunding any overestimate"""
+        try:
+            credits = response.json()['status']['credit_count']
+        except Exception:
+            credits = 0
+        self.rate_limiter.refund(expected_credits - credits)
+        with self.usage_lock:
+            self.request_count += 1
+            self.credit_count += credits
+
+    def sync_credit_budget(self):
         """
-        Fetch historical data and return as pandas DataFrame with rate limit handling
+        Sets the shared credit budget to what is left of the plan today and this month.
+        /v1/key/info costs no credits. Returns the budget, None if it could not be read
+        """
+        try:
+            response = self.session.get('https://pro-api.coinmarketcap.com/v1/key/info')
+            response.raise_for_status()
+            usage = response.json()['data']['usage']
+            credits_left = [usage[period]['credits_left'] for period in ('current_day', 'current_month')
+                            if usage.get(period, {}).get('credits_left') is not None]
+        except Exception as e:
+            print(f"Could not read credit usage: {str(e)}")
+            return None
+        credit_budget = min(credits_left) if credits_left else None
+        self.rate_limiter.set_credit_budget(credit_budget)
+        return credit_budget
+
+    def get_dataframe(self, symbol, interval='1d', count=30, convert='USD', max_retries=3, time_start=None):
+        """
+        Fetch historical data and return as pandas DataFrame with rate limit handling.
+        With time_start the quotes start there, otherwise the latest count quotes are returned
         """
         url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/historical'
         params = {
@@ -53,12 +136,20 @@ class CoinMarketCapAPI:
             'convert': convert,
             'aux': 'price,volume,market_cap,circulating_supply,quote_timestamp'
         }
+        if time_start is not None:
+            params['time_start'] = pd.Timestamp(time_start).isoformat()
 
+        expected_credits = max(1, math.ceil(params['count'] / CMC_POINTS_PER_CREDIT))
         for attempt in range(max_retries):
+            response = None
+            try:
+                self._wait_for_rate_limit(expected_credits)
+            except CMCCreditBudgetExceeded as e:
+                print(f"Skipping {symbol}: {str(e)}")
+                return pd.DataFrame()
             try:
-                self._wait_for_rate_limit()
                 response = self.session.get(url, params=params)
-                self.request_count += 1
+                self._record_usage(response, expected_credits)
                 
                 response.raise_for_status()
                 data = response.json()
@@ -81,13 +172,15 @@ class CoinMarketCapAPI:
                 return df
                 
             except Exception as e:
-                if response.status_code == 429:  # Rate limit exceeded
+                if response is None:
+                    self.rate_limiter.refund(expected_credits)
+                if response is not None and response.status_code == 429:  # Rate limit exceeded
                     if attempt < max_retries - 1:
-                        print("Rate limit hit, waiting for reset...")
-                        time.sleep(61)  # Wait for rate limit reset
+                        print("Rate limit hit, pausing every worker until reset...")
+                        self.rate_limiter.pause(CMC_RATE_LIMIT_PAUSE_SECONDS)
                         continue
                 print(f"Error fetching data: {str(e)}")
-                if 'response' in locals():
+                if response is not None:
                     print(f"Response status code: {response.status_code}")
                     print(f"Response text: {response.text}")
                 return pd.DataFrame()
@@ -118,7 +211,7 @@ class CoinMarketCapAPI:
         try:
             self._wait_for_rate_limit()
             response = self.session.get(url, params=params)
-            self.request_count += 1
+            self._record_usage(response)
             
             response.raise_for_status()
             data = response.json()
@@ -148,75 +241,104 @@ class CoinMarketCapAPI:
                 print(f"Response text: {response.text}")
             return pd.DataFrame()
 
-    def write_full_history(self, months=60):
+    def ensure_price_history_table(self, dbconnx):
+        """Creates the price history table if needed and makes (ticker, timestamp) unique"""
+        if not sqlalchemy.inspect(dbconnx).has_table(CMC_PRICE_HISTORY_TABLE):
+            empty_history = pd.DataFrame({
+                'timestamp': pd.Series(dtype='datetime64[ns, UTC]'),
+                'price': pd.Series(dtype=float),
+                'volume': pd.Series(dtype=float),
+                'market_cap': pd.Series(dtype=float),
+                'supply': pd.Series(dtype=float),
+                'ticker': pd.Series(dtype=object)
+            })
+            empty_history.to_sql(CMC_PRICE_HISTORY_TABLE, dbconnx, index=False)
+        ensure_unique_index(dbconnx, CMC_PRICE_HISTORY_TABLE, ['ticker', 'timestamp'])
+
+    def load_ticker_watermarks(self, dbconnx):
+        """Latest stored timestamp per ticker"""
+        watermarks = pd.read_sql(
+            f'SELECT ticker, MAX(timestamp) AS last_timestamp FROM {CMC_PRICE_HISTORY_TABLE} GROUP BY ticker',
+            dbconnx)
+        return dict(zip(watermarks['ticker'], pd.to_datetime(watermarks['last_timestamp'], utc=True)))
+
+    def get_ticker_history(self, ticker, total_days, last_timestamp=None):
+        """History to write for one ticker, only the quotes from last_timestamp on if it is known"""
+        if last_timestamp is None:
+            history = self.get_dataframe(symbol=ticker, interval='1d', count=total_days)
+        else:
+            days_missing = (pd.Timestamp.now(tz='UTC') - last_timestamp).days + 1
+            history = self.get_dataframe(symbol=ticker, interval='1d', count=days_missing,
+                                         time_start=last_timestamp)
+        if history.empty:
+            return history
+        history = history.reset_index()
+        history['ticker'] = ticker
+        if last_timestamp is not None:
+            history = history[history['timestamp'] > last_timestamp]
+        return history
+
+    def write_full_history(self, months=60, incremental=True, max_workers=CMC_MAX_WORKERS):
         """
         Write full price history for all currencies in cmc_details_df
         
         Parameters:
         - months (int): Number of months of history to fetch (max 60)
+        - incremental (bool): only request quotes after each ticker's latest stored row
+        - max_workers (int): tickers fetched at once, all of them share the per minute rate limit
+          and the plan's remaining credits
+
+        Each ticker is inserted as soon as it arrives, rows already stored on (ticker, timestamp)
+        are skipped
         """
         if months > 60:
             print("Warning: Maximum historical data access is 60 months. Setting to 60 months.")
             months = 60
         
-        days_per_request = 2000  # Maximum days per request
-        total_days = months * 30
-        requests_needed = (total_days + days_per_request - 1) // days_per_request
+        total_days = min(months * 30, 2000)  # Maximum days per request
         
         # Get all tickers from cmc_details_df
-        tickers = self.data_tool.cmc_details_df['coin_ticker'].tolist()
+        tickers = list(dict.fromkeys(self.data_tool.cmc_details_df['coin_ticker'].tolist()))
         
         # Initialize database connection
         dbconnx = self.data_tool.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        self.ensure_price_history_table(dbconnx)
+        watermarks = self.load_ticker_watermarks(dbconnx) if incremental else {}
         
         print(f"Starting historical data collection for {len(tickers)} tickers")
-        print(f"Total days: {total_days}, Requests per ticker: {requests_needed}")
+        print(f"Total days: {total_days}, {len(watermarks)} tickers already stored")
         
-        for ticker in tickers:
-            try:
-                full_history = []
-                
-                for i in range(requests_needed):
-                    start_day = i * days_per_request
-                    days = min(days_per_request, total_days - start_day)
-                    
-                    history = self.get_dataframe(
-                        symbol=ticker,
-                        interval='1d',
-                        count=days
-                    )
-                    
-                    if not history.empty:
-                        history['ticker'] = ticker
-                        full_history.append(history)
-                        
-                if full_history:
-                    ticker_df = pd.concat(full_history)
+        credit_budget = self.sync_credit_budget()
+        if credit_budget is not None:
+            print(f"{credit_budget} credits left in the plan, requests stop before spending past them")
+        requests_before, credits_before = self.request_count, self.credit_count
+        rows_written = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.get_ticker_history, ticker, total_days, watermarks.get(ticker)): ticker
+                       for ticker in tickers}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    ticker_df = future.result()
+                    if ticker_df.empty:
+                        continue
                     ticker_df.to_sql(
-                        'coinmarketcap__price_history_temp',
+                        CMC_PRICE_HISTORY_TABLE,
                         dbconnx,
-                        if_exists='append'
+                        if_exists='append',
+                        index=False,
+                        method=insert_on_conflict_do_nothing(['ticker', 'timestamp'])
                     )
+                    rows_written += len(ticker_df)
                     print(f"Saved {len(ticker_df)} days of history for {ticker}")
-                
-            except Exception as e:
-                print(f"Error processing {ticker}: {str(e)}")
-                continue
+                    
+                except Exception as e:
+                    print(f"Error processing {ticker}: {str(e)}")
+                    continue
         
-        try:
-            # Combine all saved data into final table
-            full_df = pd.read_sql('coinmarketcap__price_history_temp', dbconnx)
-            full_df.to_sql('coinmarketcap__price_history', dbconnx, if_exists='replace')
-            
-            # Drop temporary table using SQLAlchemy text()
-            with dbconnx.connect() as connection:
-                connection.execute(text('DROP TABLE IF EXISTS coinmarketcap__price_history_temp'))
-                connection.commit()
-            
-            print(f"Successfully wrote full price history to database")
-        except Exception as e:
-            print(f"Error writing final data: {str(e)}")
+        print(f"Wrote {rows_written} rows of price history using {self.request_count - requests_before} "
+              f"requests and {self.credit_count - credits_before} credits")
 
 # Usage example:
 # api = CoinMarketCapAPI(pw_map)
-# api.write_full_history(months=60)  # Get maximum allowed history
+# api.write_full_history(months=60)  # Get maximum allowed history, later runs only top up new days
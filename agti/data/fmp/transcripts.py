@@ -3,14 +3,26 @@ from agti.utilities.db_manager import DBConnectionManager
 from agti.utilities.settings import CredentialManager
 from agti.utilities.settings import PasswordMapLoader
 from agti.utilities.db_manager import DBConnectionManager
+from agti.utilities.rate_limiter import TokenBucket
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import requests 
 import datetime 
+
+# FMP quotas are per minute and depend on the plan, 10/s stays inside 750 calls a minute
+FMP_REQUESTS_PER_SECOND = 10
+FMP_MAX_WORKERS = 16
+TRANSCRIPT_WRITE_BATCH_SIZE = 100
+
 class FMPDataTool:
-    def __init__(self,pw_map):
+    def __init__(self,pw_map, requests_per_second=FMP_REQUESTS_PER_SECOND, max_workers=FMP_MAX_WORKERS):
         self.pw_map= pw_map
         self.db_connection_manager= DBConnectionManager(pw_map=self.pw_map)
         self.fmp_api_key=self.pw_map['financialmodelingprep']
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max_workers))
+        self.rate_limiter = TokenBucket(rate=requests_per_second)
+        self.max_workers = max_workers
         db_query = """ SELECT * FROM sharadar__daily
         WHERE CAST(date AS date) > CURRENT_DATE - INTERVAL '7 days';
         """ 
@@ -38,7 +50,8 @@ class FMPDataTool:
         Gets a list of transcripts available for a company
         '''
         url = f'https://financialmodelingprep.com/api/v4/earning_call_transcript?symbol={ticker}&apikey={self.fmp_api_key}'
-        response = requests.get(url)
+        self.rate_limiter.acquire()
+        response = self.session.get(url)
         op_json= response.json()
         earnings_df = pd.DataFrame(op_json)
         earnings_df.columns=['quarter','year','upload_time']
@@ -53,15 +66,24 @@ class FMPDataTool:
         ev_calcs = self.output_full_fmp_universe_with_ev_calcs()
         active_df = ev_calcs[ev_calcs['daily_enterprise_value']>minimum_enterprise_value_for_active_universe].copy()
         all_tickers_to_work = list(set(active_df['symbol']))
-        yarr=[]
-        for ticker in all_tickers_to_work:
+        full_transcript_code = self.get_earnings_call_transcript_lists(all_tickers_to_work)
+        return full_transcript_code
+
+    def get_earnings_call_transcript_lists(self, tickers):
+        '''
+        Transcript lists for many tickers fetched concurrently under the rate limit
+        '''
+        def try_get_list(ticker):
             try:
-                yarr.append(self.get_earnings_call_transcript_list(ticker))
+                return self.get_earnings_call_transcript_list(ticker)
             except:
                 print(ticker)
-                pass
-        full_transcript_code = pd.concat(yarr)
-        return full_transcript_code
+                return None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yarr = [i for i in executor.map(try_get_list, tickers) if i is not None]
+        if len(yarr) == 0:
+            return pd.DataFrame(columns=['quarter','year','upload_time','upload_date','ticker','transcript_code'])
+        return pd.concat(yarr)
 
     def get_earnings_call_transcript(self,ticker,quarter,year):
         '''
@@ -72,7 +94,8 @@ class FMPDataTool:
         output =[{'content':''}]
         try:
             url = f'https://financialmodelingprep.com/api/v3/earning_call_transcript/{ticker}?quarter={quarter}&year={year}&apikey={self.fmp_api_key}'
-            response = requests.get(url)
+            self.rate_limiter.acquire()
+            response = self.session.get(url)
             output = response.json()
         except:
             print('failed to get transcript for ' + ticker + ' quarter is ' + str(quarter) + ' year is ' + str(year))
@@ -95,11 +118,71 @@ class FMPDataTool:
         return simplified_df
 
     def get_all_loaded_transcript_codes(self):
+        ''' set of transcript codes already written, empty if the table does not exist yet '''
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-        loaded_transcripts = list(pd.read_sql('select transcript_code from fmp___earnings_call_transcripts;', 
-                                              dbconnx)['transcript_code'].unique())
+        try:
+            loaded_transcripts = set(pd.read_sql('select distinct transcript_code from fmp___earnings_call_transcripts;', 
+                                                 dbconnx)['transcript_code'])
+        except Exception as e:
+            print(f'No loaded transcripts: {e}')
+            loaded_transcripts = set()
+        dbconnx.dispose()
         return loaded_transcripts
 
+    def write_transcripts_for_codes(self, transcript_codes, batch_size=TRANSCRIPT_WRITE_BATCH_SIZE):
+        """
+        Fetches transcripts concurrently under the rate limit and appends them to
+        fmp___earnings_call_transcripts batch_size transcripts per insert.
+        Returns the transcript codes written
+        """
+        written_codes = []
+        if len(transcript_codes) == 0:
+            return written_codes
+        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
+        pending_frames = []
+        pending_codes = []
+
+        def write_frames(frames):
+            pd.concat(frames).to_sql('fmp___earnings_call_transcripts', dbconnx, if_exists='append',
+                                     index=False, method='multi', chunksize=50)
+
+        def flush():
+            if len(pending_frames) == 0:
+                return
+            try:
+                write_frames(pending_frames)
+                written_codes.extend(pending_codes)
+            except Exception as e:
+                # the batch insert is one transaction, retry transcript by transcript so only the bad one is skipped
+                print(f'Failed writing batch starting {pending_codes[0]}, retrying one by one: {str(e)}')
+                for xcode, ydfx in zip(pending_codes, pending_frames):
+                    try:
+                        write_frames([ydfx])
+                        written_codes.append(xcode)
+                    except Exception as e:
+                        print(f'Failed writing {xcode}: {str(e)}')
+            print(f'Wrote {len(written_codes)} of {len(transcript_codes)} transcripts')
+            pending_frames.clear()
+            pending_codes.clear()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.output_information_dataframe_for_transcript_code, transcript_code=xcode): xcode
+                       for xcode in transcript_codes}
+            for future in as_completed(futures):
+                xcode = futures[future]
+                try:
+                    ydfx = future.result()
+                except Exception as e:
+                    print(f'Failed to load {xcode}: {str(e)}')
+                    continue
+                pending_frames.append(ydfx)
+                pending_codes.append(xcode)
+                if len(pending_codes) >= batch_size:
+                    flush()
+        flush()
+        dbconnx.dispose()
+        return written_codes
+
     def write_full_fmp_history_for_x_years(self,years_to_work=6):
         start_date = datetime.datetime.now()-datetime.timedelta(365*years_to_work)
         # the following generates a dataframe of transcript codes that need to be updated
@@ -111,15 +194,7 @@ class FMPDataTool:
         total_codes_loaded = len(all_codes_loaded)
         print(f"Total Codes Loaded: {total_codes_loaded}")
         all_codes_to_load =[i for i in full_list_of_transcript_codes if i not in all_codes_loaded]
-        for xcode in all_codes_to_load:
-            try:
-                ydfx = self.output_information_dataframe_for_transcript_code(transcript_code=xcode)
-                dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-                ydfx.to_sql('fmp___earnings_call_transcripts', dbconnx,if_exists='append')
-                dbconnx.dispose()
-            except:
-                print(f'Failed {xcode}')
-                pass
+        self.write_transcripts_for_codes(all_codes_to_load)
 
     def write_full_fmp_history_for_tickers(self, tickers, years_to_work=6):
         """
@@ -134,25 +209,13 @@ class FMPDataTool:
         """
         start_date = datetime.datetime.now() - datetime.timedelta(365 * years_to_work)
         all_codes_loaded = self.get_all_loaded_transcript_codes()
-        for ticker in tickers:
-            try:
-                ev_history = self.get_earnings_call_transcript_list(ticker)
-                ev_history['upload_date'] = pd.to_datetime(ev_history['upload_date'])
-                full_history_of_transcripts = ev_history[ev_history['upload_date'] > start_date].sort_values('upload_date')
-                full_list_of_transcript_codes = list(full_history_of_transcripts['transcript_code'].unique())
-                codes_to_load = [code for code in full_list_of_transcript_codes if code not in all_codes_loaded]
-                for xcode in codes_to_load:
-                    try:
-                        ydfx = self.output_information_dataframe_for_transcript_code(transcript_code=xcode)
-                        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-                        ydfx.to_sql('fmp___earnings_call_transcripts', dbconnx, if_exists='append', index=False)
-                        dbconnx.dispose()
-                        all_codes_loaded.append(xcode)  # Update the list of loaded codes
-                    except Exception as e:
-                        print(f'Failed to load {xcode}: {str(e)}')
-                print(f"Completed processing for {ticker}")
-            except Exception as e:
-                print(f"Failed to process {ticker}: {str(e)}")
+        ev_history = self.get_earnings_call_transcript_lists(tickers)
+        ev_history['upload_date'] = pd.to_datetime(ev_history['upload_date'])
+        full_history_of_transcripts = ev_history[ev_history['upload_date'] > start_date].sort_values('upload_date')
+        full_list_of_transcript_codes = list(full_history_of_transcripts['transcript_code'].unique())
+        codes_to_load = [code for code in full_list_of_transcript_codes if code not in all_codes_loaded]
+        self.write_transcripts_for_codes(codes_to_load)
+        print(f"Completed processing for {len(tickers)} tickers")
 
     def get_loaded_transcripts_for_tickers(self, tickers, force_update=False):
         """
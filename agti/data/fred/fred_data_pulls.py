@@ -2,12 +2,37 @@ import pandas as pd
 import requests
 from typing import Union, List, Dict
 from datetime import datetime, timedelta
+import threading
 import time
-import pandas as pd
-import requests
-from typing import Union, List, Dict
-from datetime import datetime, timedelta
-import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from agti.utilities.rate_limiter import TokenBucket
+from agti.utilities.settings import CredentialManager
+
+# FRED allows 120 requests per minute per api key. The bucket refills slowly enough that
+# a full burst plus a minute of refill stays inside the quota
+FRED_REQUESTS_PER_MINUTE = 120
+FRED_REQUEST_BURST = 20
+FRED_MAX_WORKERS = 8
+
+_FRED_RATE_LIMITER = TokenBucket(rate=(FRED_REQUESTS_PER_MINUTE - FRED_REQUEST_BURST) / 60,
+                                 capacity=FRED_REQUEST_BURST)
+_FRED_SESSION = None
+_FRED_SESSION_LOCK = threading.Lock()
+
+
+def get_shared_fred_session():
+    """One pooled session for every FREDDataFetcher in the process"""
+    global _FRED_SESSION
+    with _FRED_SESSION_LOCK:
+        if _FRED_SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=FRED_MAX_WORKERS)
+            session.mount('https://', adapter)
+            _FRED_SESSION = session
+        return _FRED_SESSION
+
 
 class FREDDataFetcher:
     """
@@ -44,20 +69,73 @@ class FREDDataFetcher:
         )
         print("Multiple series data:")
         print(multi_df.head())
-        
+
+    Observations are cached on disk under datadump/fred_cache, one pickle per series and
+    frequency. Later calls only request observations from the last cached date onward and
+    fall back to the cache if FRED cannot be reached. Pass use_cache=False to re-download
+    the full history, which also picks up revisions to older observations.
     """
     
-    def __init__(self, pw_map):
+    def __init__(self, pw_map, cache_directory=None):
         """Initialize with FRED API key"""
         self.api_key = pw_map['fred_api_key']
         self.base_url = "https://api.stlouisfed.org/fred"
+        self.session = get_shared_fred_session()
+        self.rate_limiter = _FRED_RATE_LIMITER
+        if cache_directory is None:
+            cache_directory = CredentialManager().get_datadump_directory_path() / 'fred_cache'
+        self.cache_directory = Path(cache_directory)
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+        self.cache_locks = {}
+        self.cache_locks_lock = threading.Lock()
+
+    def get_cache_lock(self, cache_path: Path) -> threading.Lock:
+        with self.cache_locks_lock:
+            if cache_path not in self.cache_locks:
+                self.cache_locks[cache_path] = threading.Lock()
+            return self.cache_locks[cache_path]
+
+    def get_cache_path(self, series_id: str, frequency: str = None) -> Path:
+        return self.cache_directory / f"{series_id}_{frequency or 'native'}.pkl"
+
+    def load_cached_series(self, cache_path: Path) -> Dict:
+        """Returns {'observation_start': str or None, 'observations': DataFrame} or None"""
+        try:
+            return pd.read_pickle(cache_path)
+        except Exception:
+            return None
+
+    def write_cached_series(self, cache_path: Path, cached: Dict):
+        temp_path = cache_path.with_name(f'{cache_path.name}.{threading.get_ident()}.tmp')
+        pd.to_pickle(cached, temp_path)
+        temp_path.replace(cache_path)
+
+    def request_observations(self, params: Dict) -> pd.DataFrame:
+        """One rate limited call to series/observations, returned as a date indexed value frame"""
+        self.rate_limiter.acquire()
+        response = self.session.get(
+            f"{self.base_url}/series/observations",
+            params=params
+        )
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        if 'observations' not in data:
+            raise ValueError(f"No data found for series {params['series_id']}")
+            
+        df = pd.DataFrame(data['observations'], columns=['date', 'value'])
+        df['date'] = pd.to_datetime(df['date'])
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        return df.set_index('date')[['value']]
         
     def get_series(self, 
                    series_id: str, 
                    start_date: Union[str, datetime] = None,
                    end_date: Union[str, datetime] = None,
-                   frequency: str = None) -> pd.DataFrame:
-        """Fetch a single time series from FRED."""
+                   frequency: str = None,
+                   use_cache: bool = True) -> pd.DataFrame:
+        """Fetch a single time series from FRED, topping up the on disk cache."""
         # Format dates if provided
         if start_date:
             if isinstance(start_date, datetime):
@@ -72,58 +150,76 @@ class FREDDataFetcher:
             'api_key': self.api_key,
             'file_type': 'json'
         }
-        
-        if start_date:
-            params['observation_start'] = start_date
-        if end_date:
-            params['observation_end'] = end_date
         if frequency:
             params['frequency'] = frequency
-            
-        try:
-            # Get series data using correct endpoint
-            response = requests.get(
-                f"{self.base_url}/series/observations",
-                params=params
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if 'observations' not in data:
-                raise ValueError(f"No data found for series {series_id}")
-                
-            df = pd.DataFrame(data['observations'])
-            df['date'] = pd.to_datetime(df['date'])
-            df['value'] = pd.to_numeric(df['value'], errors='coerce')
-            df = df.set_index('date')[['value']]
-            df.columns = [series_id]
-            
-            return df
-            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error fetching data from FRED: {str(e)}")
+
+        cache_path = self.get_cache_path(series_id, frequency)
+        with self.get_cache_lock(cache_path):
+            cached = self.load_cached_series(cache_path) if use_cache else None
+            # the cache only helps if it already reaches back to the requested start
+            if cached is not None and cached['observation_start'] is not None:
+                if not start_date or pd.Timestamp(start_date) < pd.Timestamp(cached['observation_start']):
+                    cached = None
+            if cached is not None and len(cached['observations']) == 0:
+                cached = None
+
+            if cached is not None:
+                # refetch the last cached observation as well, it is often revised or a partial period
+                params['observation_start'] = cached['observations'].index[-1].strftime('%Y-%m-%d')
+            elif start_date:
+                params['observation_start'] = start_date
+
+            try:
+                fetched = self.request_observations(params)
+                if cached is not None:
+                    observations = pd.concat([cached['observations'], fetched])
+                    observations = observations[~observations.index.duplicated(keep='last')].sort_index()
+                    cached = {'observation_start': cached['observation_start'], 'observations': observations}
+                else:
+                    cached = {'observation_start': start_date or None, 'observations': fetched}
+                self.write_cached_series(cache_path, cached)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if cached is None:
+                    cached = self.load_cached_series(cache_path)
+                if cached is None:
+                    raise Exception(f"Error fetching data from FRED: {str(e)}")
+                print(f"Warning: FRED request for {series_id} failed, using cached observations: {str(e)}")
+
+        df = cached['observations']
+        if start_date:
+            df = df[df.index >= pd.Timestamp(start_date)]
+        if end_date:
+            df = df[df.index <= pd.Timestamp(end_date)]
+        df = df.copy()
+        df.columns = [series_id]
+        
+        return df
             
     def get_multiple_series(self, 
                            series_ids: List[str],
                            start_date: Union[str, datetime] = None,
                            end_date: Union[str, datetime] = None,
-                           frequency: str = None) -> pd.DataFrame:
-        """Fetch multiple time series from FRED."""
-        all_series = []
-        for series_id in series_ids:
+                           frequency: str = None,
+                           use_cache: bool = True,
+                           max_workers: int = FRED_MAX_WORKERS) -> pd.DataFrame:
+        """Fetch multiple time series from FRED concurrently, within the shared rate limit."""
+        series_ids = list(dict.fromkeys(series_ids))
+
+        def fetch_series(series_id):
             try:
-                df = self.get_series(
+                return self.get_series(
                     series_id=series_id,
                     start_date=start_date,
                     end_date=end_date,
-                    frequency=frequency
+                    frequency=frequency,
+                    use_cache=use_cache
                 )
-                all_series.append(df)
-                time.sleep(0.5)  # Rate limiting
             except Exception as e:
                 print(f"Warning: Error fetching series {series_id}: {str(e)}")
-                continue
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(series_ids)))) as executor:
+            all_series = [df for df in executor.map(fetch_series, series_ids) if df is not None]
                 
         if not all_series:
             raise ValueError("No data was successfully retrieved")
@@ -140,7 +236,8 @@ class FREDDataFetcher:
         
         try:
             # Use correct endpoint for series info
-            response = requests.get(
+            self.rate_limiter.acquire()
+            response = self.session.get(
                 f"{self.base_url}/series",
                 params=params
             )
@@ -1,4 +1,7 @@
 import hashlib
+import json
+import queue
+import threading
 import time
 from glob import glob
 import shutil 
@@ -24,14 +27,90 @@ from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
 from webdriver_manager.firefox import GeckoDriverManager
 from urllib.parse import quote_plus
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+GOOGLE_TRENDS_EXPLORE_URL = "https://trends.google.com/trends/explore"
+GOOGLE_TRENDS_MAX_TERMS = 5
+PARTIAL_DOWNLOAD_SUFFIXES = ('.part', '.crdownload', '.tmp')
+
+
+class DownloadWatcher(FileSystemEventHandler):
+    """
+    Watches a download directory through filesystem notifications and records finished files.
+
+    Browsers write to a .part / .crdownload file and rename it when the download is done,
+    so a rename (or a non empty close on platforms that report it) onto a matching name marks completion.
+
+    Example:
+        with DownloadWatcher(download_dir, 'Timeline') as watcher:
+            scraper.click_export_csv()
+            downloaded_file_path = watcher.wait(timeout=30)
+    """
+    def __init__(self, download_dir, expected_filename_contains):
+        super().__init__()
+        self.download_dir = download_dir
+        self.expected_filename_contains = expected_filename_contains
+        self.completed_paths = []
+        self.download_finished = threading.Event()
+        self.observer = None
+
+    def record_if_complete(self, path):
+        file_name = os.path.basename(path)
+        if self.expected_filename_contains in file_name and not file_name.endswith(PARTIAL_DOWNLOAD_SUFFIXES):
+            self.completed_paths.append(path)
+            self.download_finished.set()
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.record_if_complete(event.dest_path)
+
+    def on_closed(self, event):
+        # firefox creates an empty placeholder under the final name when the download starts
+        if not event.is_directory and os.path.exists(event.src_path) and os.path.getsize(event.src_path) > 0:
+            self.record_if_complete(event.src_path)
+
+    def start(self):
+        self.observer = Observer()
+        self.observer.schedule(self, self.download_dir, recursive=False)
+        self.observer.start()
+        return self
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def wait(self, timeout=30):
+        """Blocks until a matching download lands and returns its path"""
+        if not self.download_finished.wait(timeout):
+            raise Exception("Timeout waiting for download to complete")
+        most_recent_file = self.completed_paths[-1]
+        print(f"Download detected: {most_recent_file}")
+        return most_recent_file
 
 
 class GoogleTrendsScraper:
-    def __init__(self, pw_map):
+    def __init__(self, pw_map, download_dir=None, trends_base_url=GOOGLE_TRENDS_EXPLORE_URL):
+        """
+        download_dir defaults to the profile's own ~/Downloads. Give each concurrent scraper its own
+        download_dir so their exports cannot be confused. trends_base_url can point at a local page
+        serving trends CSVs for testing
+        """
         self.pw_map = pw_map
         scraper = self.pw_map['gtrends_firefox_scraper']
         self.profile_path =scraper
-        self.download_dir = os.path.join(os.path.expanduser('~'), 'Downloads')
+        self.custom_download_dir = download_dir is not None
+        self.download_dir = download_dir or os.path.join(os.path.expanduser('~'), 'Downloads')
+        os.makedirs(self.download_dir, exist_ok=True)
+        self.trends_base_url = trends_base_url
         self.driver = self._setup_driver()
         self.target_path = self.pw_map['local_data_dump']
         
@@ -39,10 +118,11 @@ class GoogleTrendsScraper:
     def _setup_driver(self):
         firefox_profile = webdriver.FirefoxProfile(self.profile_path)
         # Set preferences for file download
-        #firefox_profile.set_preference("browser.download.folderList", 2) # Use custom download directory (2)
-        #firefox_profile.set_preference("browser.download.manager.showWhenStarting", False)
-        #firefox_profile.set_preference("browser.download.dir", self.download_dir)
-        #firefox_profile.set_preference("browser.helperApps.neverAsk.saveToDisk", "text/csv")
+        if self.custom_download_dir:
+            firefox_profile.set_preference("browser.download.folderList", 2) # Use custom download directory (2)
+            firefox_profile.set_preference("browser.download.manager.showWhenStarting", False)
+            firefox_profile.set_preference("browser.download.dir", self.download_dir)
+            firefox_profile.set_preference("browser.helperApps.neverAsk.saveToDisk", "text/csv")
 
         firefox_options = Options()
         firefox_options.profile = firefox_profile
@@ -52,7 +132,7 @@ class GoogleTrendsScraper:
 
     
     def construct_url(self, terms, country='US', time_frame='today 3-m'):
-        base_url = "https://trends.google.com/trends/explore"
+        base_url = self.trends_base_url
         encoded_terms = ','.join([quote_plus(term.lower()) for term in terms])
         geo_param = '' if country.lower() == 'worldwide' else f"&geo={country}"
         url = f"{base_url}?date={quote_plus(time_frame)}{geo_param}&q={encoded_terms}&hl=en-US"
@@ -94,41 +174,39 @@ class GoogleTrendsScraper:
             print(f"Error clicking the 'Export CSV' button: {e}")
             
 
-    def wait_for_download_complete(self, expected_filename_contains, timeout=30):
+    def wait_for_download_complete(self, expected_filename_contains, timeout=30, watcher=None):
         """
-        Waits for the download to complete by checking for the most recent file that contains
-        the expected filename substring in the default download directory. Assumes that the newest
-        file matching the criteria is the desired download.
+        Waits for the download to complete. Completion is signalled by filesystem notifications
+        on the download directory rather than polling it.
     
         Args:
         - expected_filename_contains (str): Substring to identify the relevant file.
         - timeout (int): Maximum time to wait for the download to complete, in seconds.
+        - watcher (DownloadWatcher): a watcher started before the download was triggered. Without
+          one, a matching file already in the download directory is returned if there is one.
     
         Returns:
         - str: Path to the most recently downloaded file that matches the criteria.
         """
         print(f"Waiting for file containing '{expected_filename_contains}' to download...")
-        end_time = time.time() + timeout
-        most_recent_file = None
-        while True:
-            if time.time() > end_time:
-                if most_recent_file:
-                    return most_recent_file  # Return the most recent file if found
-                else:
-                    raise Exception("Timeout waiting for download to complete")
-            downloaded_files = [f for f in glob(os.path.join(self.download_dir, '*')) if expected_filename_contains in f and not f.endswith(('.part', '.crdownload'))]
+        if watcher is not None:
+            return watcher.wait(timeout)
+        with DownloadWatcher(self.download_dir, expected_filename_contains) as new_watcher:
+            downloaded_files = [f for f in glob(os.path.join(self.download_dir, '*'))
+                                if expected_filename_contains in os.path.basename(f) and not f.endswith(PARTIAL_DOWNLOAD_SUFFIXES)]
             if downloaded_files:
-                # Sort files by modification time in descending order; newest first
-                downloaded_files.sort(key=lambda f: os.path.getmtime(f), reverse=True)
-                most_recent_file = downloaded_files[0]  # Pick the newest file
-                if os.path.exists(most_recent_file):
-                    print(f"Download detected: {most_recent_file}")
-                    # Wait a bit longer to ensure the file is fully written and released
-                    time.sleep(2)
-                    return most_recent_file
-            time.sleep(1)  # Wait and retry if no matching files found yet
+                return max(downloaded_files, key=os.path.getmtime)
+            return new_watcher.wait(timeout)
 
-    
+    def clear_download_dir(self, expected_filename_contains='Timeline'):
+        """Removes earlier exports from a private download directory so the next one is unambiguous"""
+        if not self.custom_download_dir:
+            return
+        for old_file in glob(os.path.join(self.download_dir, f'*{expected_filename_contains}*')):
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
     
     def rename_and_move_download(self, downloaded_file_path, new_path, retries=5, delay=2):
         """
@@ -190,21 +268,21 @@ class GoogleTrendsScraper:
         """
         # Example terms and setup
         
-        self.navigate_to_trends(terms, country, time_frame)
-        
-        # Allow some time for the page to load before clicking the export button
-        # time.sleep(2.5)  # Adjust based on your connection speed and response time
-        
-        # Click the 'Export CSV' button to start the download
-        self.click_export_csv()
-        
         # The expected filename part could be tricky since Google Trends names its downloads in a specific format.
         # You might not know this ahead of time without seeing the format. If you know the pattern or a unique part of it,
         # use that in the next step. Otherwise, you may need to adjust this logic to handle the naming convention used by Google Trends.
         expected_filename_part = 'Timeline'  # This is a placeholder; adjust based on actual filenames downloaded by Google Trends
+        self.clear_download_dir(expected_filename_part)
+        
+        self.navigate_to_trends(terms, country, time_frame)
         
-        # Wait for the download to complete
-        downloaded_file_path = self.wait_for_download_complete(expected_filename_part)
+        # Watch the download directory before clicking so the finished download cannot be missed
+        with DownloadWatcher(self.download_dir, expected_filename_part) as watcher:
+            # Click the 'Export CSV' button to start the download
+            self.click_export_csv()
+            
+            # Wait for the download to complete
+            downloaded_file_path = self.wait_for_download_complete(expected_filename_part, watcher=watcher)
         df_to_write = pd.read_csv(downloaded_file_path,skiprows=1)
         periodicity = df_to_write.columns[0]
         col_converter = {'Time':'datetime_of_trend','Day':'datetime of trend','Week':'datetime_of_trend', 'Month':'datetime_of_trend'}
@@ -285,3 +363,122 @@ class GoogleTrendsScraper:
         # Calculate hours stale (total_seconds() / 3600 to convert seconds to hours)
         recent_updates_df['hours_stale'] = timedelta_stale.dt.total_seconds() / 3600
         return recent_updates_df
+
+
+class GoogleTrendsBatchRunner:
+    """
+    Refreshes a long list of terms across a pool of browser workers.
+
+    Terms are split into groups of 5 (the most Google Trends compares at once). Each worker is a
+    GoogleTrendsScraper with its own firefox profile copy and download directory, and pulls groups
+    off a shared queue. Finished groups are recorded in a checkpoint file under
+    local_data_dump/google_trends_checkpoints, so rerunning the same batch after an interruption
+    only pulls the groups that are left. Checkpoints are scoped to a run_id (default today's date),
+    so the next scheduled refresh of the same terms starts fresh.
+
+    Example:
+        runner = GoogleTrendsBatchRunner(pw_map=password_map_loader.pw_map, workers=4)
+        runner.run(terms=all_terms, country='US', time_frame='today 3-m')
+    """
+    def __init__(self, pw_map, workers=4, group_size=GOOGLE_TRENDS_MAX_TERMS,
+                 trends_base_url=GOOGLE_TRENDS_EXPLORE_URL, write_to_db=True):
+        self.pw_map = pw_map
+        self.workers = workers
+        self.group_size = min(group_size, GOOGLE_TRENDS_MAX_TERMS)
+        self.trends_base_url = trends_base_url
+        self.write_to_db = write_to_db
+        self.checkpoint_dir = os.path.join(self.pw_map['local_data_dump'], 'google_trends_checkpoints')
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.checkpoint_lock = threading.Lock()
+
+    def split_terms(self, terms):
+        terms = list(dict.fromkeys(terms))
+        return [terms[i:i + self.group_size] for i in range(0, len(terms), self.group_size)]
+
+    def get_checkpoint_path(self, term_groups, country, time_frame, run_id):
+        batch_string = json.dumps([term_groups, country, time_frame, run_id])
+        batch_hash = hashlib.md5(batch_string.encode('utf-8')).hexdigest()
+        return os.path.join(self.checkpoint_dir, f'{batch_hash}.json')
+
+    def load_finished_groups(self, checkpoint_path):
+        try:
+            with open(checkpoint_path) as checkpoint_file:
+                return set(json.load(checkpoint_file)['finished'])
+        except (OSError, ValueError, KeyError):
+            return set()
+
+    def record_finished_group(self, checkpoint_path, finished_groups, group_key):
+        with self.checkpoint_lock:
+            finished_groups.add(group_key)
+            temp_path = f'{checkpoint_path}.tmp'
+            with open(temp_path, 'w') as checkpoint_file:
+                json.dump({'finished': sorted(finished_groups), 'updated': datetime.datetime.now().isoformat()},
+                          checkpoint_file)
+            os.replace(temp_path, checkpoint_path)
+
+    def run_worker(self, worker_number, group_queue, country, time_frame, checkpoint_path,
+                   finished_groups, results, max_attempts):
+        download_dir = os.path.join(self.checkpoint_dir, 'downloads', f'worker_{worker_number}')
+        try:
+            scraper = GoogleTrendsScraper(pw_map=self.pw_map, download_dir=download_dir,
+                                          trends_base_url=self.trends_base_url)
+        except Exception as e:
+            print(f"Worker {worker_number} could not start a browser: {e}")
+            return
+        try:
+            while True:
+                try:
+                    terms, attempt = group_queue.get_nowait()
+                except queue.Empty:
+                    return
+                group_key = '|'.join(terms)
+                try:
+                    if self.write_to_db:
+                        trends_df = scraper.write_and_output_google_trends_df_for_terms(
+                            terms=terms, country=country, time_frame=time_frame)
+                    else:
+                        trends_df = scraper.load_google_trends_df_for_terms(
+                            terms=terms, country=country, time_frame=time_frame)
+                    results.append(trends_df)
+                    self.record_finished_group(checkpoint_path, finished_groups, group_key)
+                    print(f"Worker {worker_number} finished {group_key}")
+                except Exception as e:
+                    print(f"Worker {worker_number} failed on {group_key} (attempt {attempt}): {e}")
+                    if attempt < max_attempts:
+                        group_queue.put((terms, attempt + 1))
+        finally:
+            scraper.close()
+
+    def run(self, terms, country='US', time_frame='today 3-m', max_attempts=2, run_id=None):
+        """
+        Pulls every group of terms not finished in an earlier run of the same batch and run_id.
+        run_id defaults to today's date, so resuming works within a day and a daily refresh pulls
+        everything again. Pass an explicit run_id to resume across days or to force a fresh pull.
+        Returns the trends frames pulled by this run concatenated
+        """
+        if run_id is None:
+            run_id = datetime.date.today().isoformat()
+        term_groups = self.split_terms(terms)
+        checkpoint_path = self.get_checkpoint_path(term_groups, country, time_frame, str(run_id))
+        finished_groups = self.load_finished_groups(checkpoint_path)
+        group_queue = queue.Queue()
+        for terms_to_work in term_groups:
+            if '|'.join(terms_to_work) not in finished_groups:
+                group_queue.put((terms_to_work, 1))
+        print(f"{group_queue.qsize()} of {len(term_groups)} term groups to pull, "
+              f"{len(term_groups) - group_queue.qsize()} already finished")
+        results = []
+        worker_threads = [threading.Thread(target=self.run_worker,
+                                           args=(worker_number, group_queue, country, time_frame, checkpoint_path,
+                                                 finished_groups, results, max_attempts))
+                          for worker_number in range(min(self.workers, group_queue.qsize()))]
+        for worker_thread in worker_threads:
+            worker_thread.start()
+        for worker_thread in worker_threads:
+            worker_thread.join()
+        remaining = len(term_groups) - len(finished_groups)
+        if remaining > 0:
+            print(f"{remaining} term groups still unfinished, rerun to resume")
+        if len(results) == 0:
+            return pd.DataFrame()
+        return pd.concat(results, ignore_index=True)
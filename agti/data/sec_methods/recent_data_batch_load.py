@@ -1,10 +1,25 @@
 import re
 import pandas as pd
+import sqlalchemy
 import time
 from agti.data.sec_methods.request_utility import SECRequestUtility
-from agti.utilities.db_manager import DBConnectionManager
+from agti.utilities.db_manager import DBConnectionManager, ensure_unique_index, insert_on_conflict_do_nothing
 import datetime
 
+# One match per filing on the getcurrent page: filer link, [html] and [text] links,
+# description cell and acceptance date time, in page order
+FILING_PATTERN = re.compile(
+    r'action=getcompany&amp;CIK=(?P<cik>\d+)&amp;owner=include&amp;count=100">(?P<company_name>[^<]+) \(Filer\)</a>'
+    r'[\s\S]*?<a href="(?P<html_url>/Archives/edgar/data/\d+/\d+/(?P<accession_number>[^"/]+)-index\.htm)">\[html\]</a>'
+    r'[\s\S]*?<a href="(?P<text_url>/Archives/edgar/data/\d+/[\d\w-]+/[\d\w-]+\.txt)">\[text\]</a>'
+    r'[\s\S]*?<td class="small">(?P<document>[\s\S]*?)</td>'
+    r'[\s\S]*?<td nowrap="nowrap">(?P<acceptance_date>[\d-]+)<br>(?P<acceptance_time>[\d:]+)</td>'
+)
+RECENT_FILINGS_PAGE_SIZE = 100
+# filings are not always disseminated in acceptance order, so keep paging this far past the newest
+# filing already written and dedupe on html_url
+HIGH_WATER_MARK_OVERLAP = datetime.timedelta(minutes=15)
+
 class SECRecentDataBatchLoad:
     def __init__(self, pw_map, user_name):
         self.pw_map = pw_map
@@ -12,111 +27,148 @@ class SECRecentDataBatchLoad:
         self.sec_request_utility = SECRequestUtility(pw_map=self.pw_map)
         self.db_connection_manager = DBConnectionManager(pw_map=self.pw_map)
         self.cache = None
+        # newest acceptance time written and the html_urls accepted within the overlap window before it
+        self.high_water_mark = None
+        self.recent_html_urls = {}
+        self.unique_index_ready = False
 
     def output_text_for_sec_recent_data_given_start(self, start_number):
         """Fetches the raw text of the recent updates SEC page starting from the given number."""
-        url = f"https://www.sec.gov/cgi-bin/browse-edgar?action=getcurrent&datea=&dateb=&company=&type=8-k&SIC=&State=&Country=&CIK=&owner=include&accno=&start={start_number}&count=100"
+        url = f"https://www.sec.gov/cgi-bin/browse-edgar?action=getcurrent&datea=&dateb=&company=&type=8-k&SIC=&State=&Country=&CIK=&owner=include&accno=&start={start_number}&count={RECENT_FILINGS_PAGE_SIZE}"
         xhtml = self.sec_request_utility.compliant_request(url)
         print('Queried URL:', url)
         return xhtml.text
 
-    def output_recent_sec_updates(self):
-        """Gets the recent filings pages and returns a DataFrame of them."""
+    @staticmethod
+    def extract_items_string(document):
+        parts = document.split('item')
+        if len(parts) < 2:
+            return ''
+        return parts[1].split('\n')[0].replace('s ','')
+
+    def parse_recent_filings_page(self, text_block):
+        """Parses every filing on a getcurrent page in a single pass over the html."""
+        rows = []
+        for match in FILING_PATTERN.finditer(text_block):
+            rows.append({
+                'CIK': match.group('cik'),
+                'Date': match.group('acceptance_date'),
+                'Acceptance DateTime': (match.group('acceptance_date'), match.group('acceptance_time')),
+                'URL': 'https://www.sec.gov' + match.group('text_url'),
+                'html_url': 'https://www.sec.gov' + match.group('html_url'),
+                'Company Name': (match.group('cik'), match.group('company_name')),
+                'Document': match.group('document'),
+            })
+        if len(rows) == 0:
+            return pd.DataFrame()
+        recent_sec_updates = pd.DataFrame(rows)
+        recent_sec_updates['Date'] = pd.to_datetime(recent_sec_updates['Date'])
+        recent_sec_updates['full_datetime'] = pd.to_datetime(recent_sec_updates['Acceptance DateTime'].apply(lambda x: ' '.join(x)))
+        recent_sec_updates['raw_date'] = recent_sec_updates['Date']
+        recent_sec_updates['text_url'] = recent_sec_updates['URL']
+        recent_sec_updates['simple_name'] = recent_sec_updates['Company Name'].apply(lambda x: x[1].split('(')[0])
+        recent_sec_updates['cik'] = recent_sec_updates['CIK']
+        recent_sec_updates['items_string'] = recent_sec_updates['Document'].apply(self.extract_items_string)
+        recent_sec_updates['is_eps'] = recent_sec_updates['items_string'].apply(lambda x: ('9.' in x) & ('2.' in x))
+        return recent_sec_updates
+
+    def load_high_water_mark(self, dbconnx):
+        """Loads the newest acceptance time written and the html_urls within the overlap window before it."""
+        self.high_water_mark = None
+        self.recent_html_urls = {}
+        if not sqlalchemy.inspect(dbconnx).has_table('sec__update_recent_filings'):
+            print("Table sec__update_recent_filings does not exist yet, loading the full feed.")
+            return
+        recent_written = pd.read_sql(sqlalchemy.text("""
+            SELECT html_url, full_datetime FROM sec__update_recent_filings
+            WHERE full_datetime >= (SELECT MAX(full_datetime) FROM sec__update_recent_filings) - :overlap
+            """), dbconnx, params={'overlap': HIGH_WATER_MARK_OVERLAP})
+        if recent_written.empty:
+            return
+        self.high_water_mark = recent_written['full_datetime'].max()
+        self.recent_html_urls = dict(zip(recent_written['html_url'], recent_written['full_datetime']))
+        print(f"Loaded SEC high water mark {self.high_water_mark}")
+
+    def advance_high_water_mark(self, written_records):
+        if written_records.empty:
+            return
+        self.recent_html_urls.update(dict(zip(written_records['html_url'], written_records['full_datetime'])))
+        self.high_water_mark = max(self.recent_html_urls.values())
+        cutoff = self.high_water_mark - HIGH_WATER_MARK_OVERLAP
+        self.recent_html_urls = {url: accepted for url, accepted in self.recent_html_urls.items() if accepted >= cutoff}
+
+    def output_recent_sec_updates(self, max_pages=None):
+        """
+        Gets the recent filings pages and returns a DataFrame of the filings not yet written.
+
+        Paging stops at the first page reaching back past the high water mark (less the overlap window),
+        at a short or empty page, or when a page repeats. Without a high water mark the whole feed is read.
+        """
         df_arr = []
         start_number = 0
+        previous_text_block = None
+        cutoff = self.high_water_mark - HIGH_WATER_MARK_OVERLAP if self.high_water_mark is not None else None
         
-        while True:
+        while max_pages is None or start_number < max_pages * RECENT_FILINGS_PAGE_SIZE:
             print('Fetching data from start number:', start_number)
             text_block = self.output_text_for_sec_recent_data_given_start(start_number)
 
-            if self.cache is not None and text_block == self.cache:
+            if previous_text_block is not None and text_block == previous_text_block:
                 print("No new updates found, stopping the loop.")
                 break
-
+            previous_text_block = text_block
             self.cache = text_block
 
-            # Define regex patterns
-            cik_pattern = r'CIK=(\d+)'
-            date_pattern = r'nowrap="nowrap">([\d-]+)<br>'
-            url_pattern = r'<a href="(/Archives/edgar/data/\d+/[\d\w-]+/[\d\w-]+\.txt)">\[text\]</a>'
-            html_pattern = r'<a href="(/Archives/edgar/data/\d+/\d+/[^"]+-index\.htm)">\[html\]</a>'
-            company_name_pattern = r'action=getcompany&amp;CIK=(\d+)&amp;owner=include&amp;count=100">([^<]+) \(Filer\)</a>'
-            report_doc_pattern = r'<td class="small">([\s\S]*?)<\/td>'
-            acceptance_date_time_pattern = r'<td nowrap="nowrap">([\d-]+)<br>([\d:]+)</td>'
-
-            # Find matches
-            cik_matches = re.findall(cik_pattern, text_block)
-            date_matches = re.findall(date_pattern, text_block)
-            url_matches = re.findall(url_pattern, text_block)
-            html_url_matches = re.findall(html_pattern, text_block)
-            company_name_matches = re.findall(company_name_pattern, text_block)
-            report_doc_matches = re.findall(report_doc_pattern, text_block)
-            acceptance_date_time_matches = re.findall(acceptance_date_time_pattern, text_block)
-
-            # Create DataFrame
-            df = pd.DataFrame({
-                'CIK': cik_matches,
-                'Date': date_matches,
-                'Acceptance DateTime': acceptance_date_time_matches,
-                'URL': url_matches,
-                'html_url': html_url_matches,
-                'Company Name': company_name_matches,
-                'Document': report_doc_matches,
-            })
-
-            # Data Cleaning
-            df['Date'] = pd.to_datetime(df['Date'])
-            df['html_url'] = 'https://www.sec.gov' + df['html_url'].astype(str)
-
-            # Append the DataFrame to the list
-            df_arr.append(df)
-
-            start_number += 100
-
-        # Concatenate all DataFrames
-        recent_hist = pd.concat(df_arr)
-        recent_hist['URL'] = 'https://www.sec.gov' + recent_hist['URL'].apply(lambda x: str(x))
-        
-        recent_sec_updates = recent_hist.copy()
-        recent_sec_updates['full_datetime'] = pd.to_datetime(recent_sec_updates['Acceptance DateTime'].apply(lambda x: ' '.join(x)))
-        recent_sec_updates['raw_date'] = pd.to_datetime(recent_sec_updates['Date'])
-        recent_sec_updates['text_url'] = recent_sec_updates['URL']
-        recent_sec_updates['html_url'] = recent_sec_updates['html_url']
-        recent_sec_updates['simple_name'] = recent_sec_updates['Company Name'].apply(lambda x: x[1].split('(')[0])
-        recent_sec_updates['cik'] = recent_sec_updates['CIK']
-        recent_sec_updates['items_string'] = recent_sec_updates['Document'].apply(lambda x: x.split('item')[1].split('\n')[0].replace('s ',''))
-        recent_sec_updates['is_eps'] = recent_sec_updates['items_string'].apply(lambda x: ('9.' in x) & ('2.' in x))
-        
+            page = self.parse_recent_filings_page(text_block)
+            if page.empty:
+                break
+            df_arr.append(page)
+            if cutoff is not None and page['full_datetime'].min() < cutoff:
+                print("Reached filings already written, stopping the loop.")
+                break
+            if len(page) < RECENT_FILINGS_PAGE_SIZE:
+                break
+            start_number += RECENT_FILINGS_PAGE_SIZE
+
+        if not df_arr:
+            return pd.DataFrame()
+        recent_sec_updates = pd.concat(df_arr)
+        # the feed shifts while paging so a filing can show up on two pages
+        recent_sec_updates = recent_sec_updates.drop_duplicates('html_url')
+        recent_sec_updates = recent_sec_updates[~recent_sec_updates['html_url'].isin(self.recent_html_urls)]
+        if cutoff is not None:
+            recent_sec_updates = recent_sec_updates[recent_sec_updates['full_datetime'] >= cutoff]
         return recent_sec_updates
 
+    def ensure_html_url_unique_index(self, dbconnx):
+        """Unique index on html_url so inserts can skip filings already written. Removes legacy duplicates once."""
+        if self.unique_index_ready:
+            return
+        ensure_unique_index(dbconnx, 'sec__update_recent_filings', ['html_url'],
+                            index_name='sec__update_recent_filings_html_url_idx')
+        self.unique_index_ready = True
+
     def write_recent_sec_updates(self):
         """Writes recent SEC updates to the database and returns new records."""
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(self.user_name)
         
-        # Fetch existing records from the database
-        try:
-            existing_updates = pd.read_sql('SELECT * FROM sec__update_recent_filings', dbconnx)
-            print("Fetched existing records from the database.")
-        except Exception as e:
-            if "relation \"sec__update_recent_filings\" does not exist" in str(e):
-                print("Table sec__update_recent_filings does not exist. Creating a new table.")
-                existing_updates = pd.DataFrame()
-            else:
-                raise
+        if self.high_water_mark is None:
+            self.load_high_water_mark(dbconnx)
 
-        recent_sec_updates = self.output_recent_sec_updates()
-        
-        if not existing_updates.empty:
-            # Identify new records
-            new_records = recent_sec_updates[~recent_sec_updates['html_url'].isin(existing_updates['html_url'])]
-            print(f"Identified {len(new_records)} new records.")
-        else:
-            new_records = recent_sec_updates
-            print("No existing records found. All fetched records are new.")
+        new_records = self.output_recent_sec_updates()
+        print(f"Identified {len(new_records)} new records.")
 
         # Write new records to the database
         if not new_records.empty:
-            new_records.to_sql('sec__update_recent_filings', dbconnx, if_exists='append')
+            if sqlalchemy.inspect(dbconnx).has_table('sec__update_recent_filings'):
+                self.ensure_html_url_unique_index(dbconnx)
+                new_records.to_sql('sec__update_recent_filings', dbconnx, if_exists='append',
+                                   method=insert_on_conflict_do_nothing(['html_url']))
+            else:
+                print("Table sec__update_recent_filings does not exist. Creating a new table.")
+                new_records.to_sql('sec__update_recent_filings', dbconnx, if_exists='append')
+                self.ensure_html_url_unique_index(dbconnx)
+            self.advance_high_water_mark(new_records)
             print(f"Wrote {len(new_records)} new records to the database.")
         else:
             print("No new records to write to the database.")
@@ -124,16 +176,20 @@ class SECRecentDataBatchLoad:
         dbconnx.dispose()
         return new_records
 
-    def run_sec_data_batch_loadfor_3_hours(self):
-        """Runs the SEC data batch load every 2 minutes for 3 hours."""
+    def run_sec_data_batch_loadfor_3_hours(self, interval_seconds=30):
+        """Runs the SEC data batch load every interval_seconds for 3 hours.
+        Each cycle after the first is usually a single page fetch, so the interval can be short."""
         start_time = datetime.datetime.now()
         end_time = start_time + datetime.timedelta(hours=3)
 
         while datetime.datetime.now() < end_time:
             print(f"Running update at {datetime.datetime.now()}")
-            self.write_recent_sec_updates()
-            print("Sleeping for 2 minutes...")
-            time.sleep(120)
+            try:
+                self.write_recent_sec_updates()
+            except Exception as e:
+                print(f"SEC update failed: {e}")
+            print(f"Sleeping for {interval_seconds} seconds...")
+            time.sleep(interval_seconds)
                 
     def load_cached_sec_updates(self):
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(self.user_name)
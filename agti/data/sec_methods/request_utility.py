@@ -1,33 +1,149 @@
-import requests
+import hashlib
+import json
+import threading
 import time
-# this was removed ... dont know why it needed to be 
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+# this was removed ... dont know why it needed to be
 # "Accept-Encoding": "gzip, deflate",
 # Host www.sec.gov
 
 import requests
-import time
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from agti.utilities.rate_limiter import TokenBucket
+from agti.utilities.settings import CredentialManager
+
+# SEC fair access allows 10 requests per second per client, shared by every thread in the process
+SEC_REQUESTS_PER_SECOND = 10
+SEC_MAX_IN_FLIGHT = 8
+SEC_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_SEC_RATE_LIMITER = TokenBucket(rate=SEC_REQUESTS_PER_SECOND)
+_SEC_SESSION = None
+_SEC_SESSION_LOCK = threading.Lock()
+
+
+def get_shared_sec_session():
+    """One pooled session for every SECRequestUtility in the process"""
+    global _SEC_SESSION
+    with _SEC_SESSION_LOCK:
+        if _SEC_SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SEC_MAX_IN_FLIGHT * 2)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SEC_SESSION = session
+        return _SEC_SESSION
+
 
 class SECRequestUtility:
-    def __init__(self, pw_map, max_retries=3):
+    """
+    Rate compliant EDGAR client.
+
+    All instances share one pooled session and one 10 request per second token bucket.
+    Responses are cached on disk under datadump/sec_request_cache. Filing archive pages
+    (/Archives/) never change once accepted so they are served from disk, other cacheable
+    urls are revalidated with If-None-Match / If-Modified-Since. The getcurrent feed
+    (/cgi-bin/) is never cached.
+    """
+    def __init__(self, pw_map, max_retries=3, use_cache=True, cache_directory=None):
         self.pw_map = pw_map
         self.max_retries = max_retries
-        
-    def compliant_request(self, url):
+        self.use_cache = use_cache
+        self.session = get_shared_sec_session()
+        self.rate_limiter = _SEC_RATE_LIMITER
+        if cache_directory is None:
+            cache_directory = CredentialManager().get_datadump_directory_path() / 'sec_request_cache'
+        self.cache_directory = Path(cache_directory)
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def is_cacheable_url(url):
+        return '/cgi-bin/' not in url
+
+    @staticmethod
+    def is_immutable_url(url):
+        return '/Archives/edgar/data/' in url
+
+    def get_cache_paths(self, url):
+        url_hash = hashlib.sha1(url.encode()).hexdigest()
+        return self.cache_directory / f'{url_hash}.body', self.cache_directory / f'{url_hash}.json'
+
+    def load_cached_response(self, url):
+        """Returns (response, metadata) from the disk cache or (None, None)"""
+        body_path, meta_path = self.get_cache_paths(url)
+        try:
+            metadata = json.loads(meta_path.read_text())
+            content = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None, None
+        response = requests.Response()
+        response._content = content
+        response.status_code = 200
+        response.url = url
+        response.encoding = metadata.get('encoding')
+        response.headers = CaseInsensitiveDict(metadata.get('headers', {}))
+        return response, metadata
+
+    def write_cached_response(self, url, response):
+        body_path, meta_path = self.get_cache_paths(url)
+        headers = {key: response.headers[key] for key in ('ETag', 'Last-Modified', 'Content-Type')
+                   if key in response.headers}
+        metadata = {'url': url, 'encoding': response.encoding, 'headers': headers, 'fetched_at': time.time()}
+        # write the body first so a metadata file always points at a complete body
+        for path, data in ((body_path, response.content), (meta_path, json.dumps(metadata).encode())):
+            temp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+            temp_path.write_bytes(data)
+            temp_path.replace(path)
+
+    def compliant_request(self, url, use_cache=None):
         """Complies with SEC requirements for pulling down data"""
+        use_cache = self.use_cache if use_cache is None else use_cache
+        use_cache = use_cache and self.is_cacheable_url(url)
         headers = {
             "User-Agent": self.pw_map['sec_request_name']
         }
-        
+        cached_response = None
+        if use_cache:
+            cached_response, metadata = self.load_cached_response(url)
+            if cached_response is not None:
+                if self.is_immutable_url(url):
+                    return cached_response
+                if 'ETag' in cached_response.headers:
+                    headers['If-None-Match'] = cached_response.headers['ETag']
+                if 'Last-Modified' in cached_response.headers:
+                    headers['If-Modified-Since'] = cached_response.headers['Last-Modified']
+
         for attempt in range(self.max_retries):
             try:
                 print(f"Requesting {url}")
-                response = requests.get(url, headers=headers)
+                self.rate_limiter.acquire()
+                response = self.session.get(url, headers=headers)
+                if response.status_code == 304 and cached_response is not None:
+                    return cached_response
                 response.raise_for_status()  # Raises an HTTPError for bad responses
-                time.sleep(0.3)  # Ensures max 10 requests per second
+                if use_cache:
+                    self.write_cached_response(url, response)
                 return response
             except requests.exceptions.RequestException as e:
                 print(f"Attempt {attempt + 1} failed for {url}: {e}")
                 if attempt == self.max_retries - 1:
                     print(f"Max retries reached. Failed to request {url}")
                     return None
-                time.sleep(1)  # Wait for 1 second before retrying
\ No newline at end of file
+                status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status_code is not None and status_code not in SEC_RETRY_STATUS_CODES:
+                    return None
+                # back off harder when the SEC is throttling us
+                time.sleep(10 if status_code == 429 else 1)
+
+    def compliant_request_many(self, urls, max_in_flight=SEC_MAX_IN_FLIGHT, use_cache=None):
+        """
+        Requests several urls concurrently, at most max_in_flight at a time, within the shared rate limit.
+        Returns responses in the order of urls, None where a request failed
+        """
+        urls = list(urls)
+        if len(urls) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_in_flight, len(urls))) as executor:
+            return list(executor.map(lambda url: self.compliant_request(url, use_cache=use_cache), urls))
@@ -94,7 +94,11 @@ class SECFilingUpdateManager:
         existing_eps = existing_eps.loc[non_updated_urls]
         if len(existing_eps)>0:
             ## get all the raw html of the index pages which contain multiple filing urls
-            existing_eps['raw_index_page_html'] = existing_eps['index_url'].apply(lambda x: self.sec_request_utility.compliant_request(x).text)
+            index_page_responses = self.sec_request_utility.compliant_request_many(existing_eps['index_url'])
+            existing_eps['raw_index_page_html'] = [response.text if response is not None else None
+                                                   for response in index_page_responses]
+            # leave failed index pages unwritten so the next run retries them
+            existing_eps = existing_eps[existing_eps['raw_index_page_html'].notnull()].copy()
             existing_eps['99_page_urls'] = existing_eps['raw_index_page_html'].apply( lambda x: self.extract_99_urls_from_index_page_html(x))
             raw_index_page_url_content = existing_eps[['raw_index_page_html', 'index_url','99_page_urls']].copy()
             raw_index_page_url_content['date_of_update'] = datetime.datetime.now()
@@ -148,12 +152,9 @@ class SECFilingUpdateManager:
         final_constructor_pre_html_load = self.create_final_constructor_pre_html_load()
         final_constructor_pre_html_load.set_index('filing_html',inplace=True)
         final_constructor_pre_html_load= final_constructor_pre_html_load[~final_constructor_pre_html_load.index.get_level_values(0).isin(updated_filing_urls)].copy().reset_index()
-        def try_get_text(x):
-            try:
-                return self.sec_request_utility.compliant_request(x).text
-            except:
-                return ''        
-        final_constructor_pre_html_load['filing_full_text']=final_constructor_pre_html_load['filing_html'].apply(lambda x: try_get_text(x))
+        filing_responses = self.sec_request_utility.compliant_request_many(final_constructor_pre_html_load['filing_html'])
+        final_constructor_pre_html_load['filing_full_text']=[response.text if response is not None else ''
+                                                             for response in filing_responses]
         final_constructor_pre_html_load['filing_full_text'] = final_constructor_pre_html_load['filing_full_text'].str.replace('\x00', '')
         dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name=self.user_name)
         final_constructor_pre_html_load.to_sql('sec__full_filing_details', dbconnx, if_exists='append')
@@ -186,10 +187,10 @@ class SECFilingUpdateManager:
         if get_history == True:
             print('filing pages to work through ')
             historical_filings_to_work = historical_filings
-            for historical_filing in historical_filings_to_work:
+            history_responses = self.sec_request_utility.compliant_request_many(
+                ['https://data.sec.gov/submissions/' + historical_filing['name'] for historical_filing in historical_filings_to_work])
+            for htext in history_responses:
                 try:
-                    htext=self.sec_request_utility.compliant_request('https://data.sec.gov/submissions/'
-                                    + historical_filing['name'])
                     df_block = pd.DataFrame(htext.json())
                     dfarr.append(df_block)
                     print('worked a filing')
@@ -1,11 +1,23 @@
 from agti.ai.openai import OpenAIRequestTool
+import asyncio
 import datetime
+import json
+import nest_asyncio
+import pandas as pd
 from agti.utilities.db_manager import DBConnectionManager
+
+CONCEPT_SIMULATOR_MAX_CONCURRENCY = 16
+# chat completions can return several samples per request with n, set to 1 for models without it
+CONCEPT_SIMULATOR_SAMPLES_PER_REQUEST = 10
+CONCEPT_VALUE_PATTERN = r'\|([^|]+)\|$'
+
 class G10FXConceptSimulator:
     def __init__(self,pw_map):
         self.open_ai_request_tool = OpenAIRequestTool(pw_map=pw_map)
         self.db_connection_manager = DBConnectionManager(pw_map=pw_map)
         self.default_model = 'gpt-4o'
+        # (model, concept, fx) -> list of sampled responses, reused across scoring maps
+        self.sample_cache = {}
         self.fx_map = {'EUR':'The Eurozone',
                    'SEK':'Sweden',
                   'NOK':'Norway',
@@ -49,66 +61,63 @@ Follow these examples, provide your reasoning as instructed then output the foll
                 ]}
         return api_arg_make
 
-    def output_full_scoring_frame(self, runs, concept):
-        """ example: runs = 10, concept = 'develop AGI' """ 
-        xdf = pd.DataFrame(list(self.fx_map.keys()))
-        xdf.columns=['fx']
-        xdf['api_args']= xdf['fx'].apply(lambda x: self.assemble_concept_simulator(fx_to_work=x,
-            concept=concept))
-        xdf['concept']=concept
-        #xdf['index_copy']=xdf.index
-        #xdf['unique_string']=xdf['concept'].astype(str)+'_'+xdf['index_copy'].astype(str)+'_'+xdf['fx'].astype(str)
-        # Number of copies
-        n = runs
-        
-        # Create n copies using list comprehension
-        copies = pd.concat([xdf.copy() for _ in range(n)])
-        copies=copies.reset_index()
-        copies['index_copy']=copies.index
-        copies['unique_string']=copies['concept'].astype(str)+'_'+copies['index_copy'].astype(str)+'_'+copies['fx'].astype(str)
-        dict_to_work = copies.set_index('unique_string')['api_args'].to_dict()
-        def split_dict_chunks(input_dict, chunk_size):
-            """
-            Splits a dictionary into chunks of a specified size.
-        
-            Parameters:
-            input_dict (dict): The dictionary to be split.
-            chunk_size (int): The size of each chunk.
-        
-            Returns:
-            List[dict]: A list of dictionaries, each representing a chunk.
-            """
-            # Convert dictionary items to a list of tuples
-            items = list(input_dict.items())
-            
-            # Split the list of items into chunks
-            chunks = [dict(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
-            
-            return chunks
-        all_dicts = split_dict_chunks(input_dict=dict_to_work, chunk_size=10)
-        yarr=[]
-        
-        for block_to_work in all_dicts:
+    async def request_concept_samples(self, semaphore, api_args, samples):
+        """ one request for up to samples responses to the same prompt, failures return no samples """
+        async with semaphore:
             try:
-                async_block = self.open_ai_request_tool.create_writable_df_for_async_chat_completion(block_to_work)
-                yarr.append(async_block)
-            except:
-                print('failed')
-                pass
-        raw_extraction = pd.concat(yarr).groupby('internal_name').last()[['choices__message__content']]
-        pattern = r'\|([^|]+)\|$'
-        
-        def extract_value(text):
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
-            else:
-                return None
-        xdf = open_ai_request.create_writable_df_for_chat_completion(api_args=api_arg_make)
-        raw_extraction['value']=pd.to_numeric(raw_extraction['choices__message__content'].apply(lambda x: extract_value(x)),errors='coerce')
-        raw_extraction=raw_extraction.reset_index()
-        raw_extraction['fx']=raw_extraction['internal_name'].apply(lambda x: x.split('_')[-1:][0])
-        return raw_extraction
+                response = await self.open_ai_request_tool.async_client.chat.completions.create(n=samples, **api_args)
+                return [choice.message.content or '' for choice in response.choices]
+            except Exception as e:
+                print(f'failed: {str(e)}')
+                return []
+
+    async def fill_sample_cache(self, concepts, runs, max_concurrency, samples_per_request):
+        """ requests every missing (concept, fx) sample as one bounded concurrency stream """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        jobs = []
+        job_keys = []
+        for concept in concepts:
+            for fx_to_work in self.fx_map.keys():
+                cache_key = (self.default_model, concept, fx_to_work)
+                missing = runs - len(self.sample_cache.setdefault(cache_key, []))
+                api_args = self.assemble_concept_simulator(fx_to_work=fx_to_work, concept=concept)
+                while missing > 0:
+                    samples = min(missing, samples_per_request)
+                    jobs.append(self.request_concept_samples(semaphore, api_args, samples))
+                    job_keys.append(cache_key)
+                    missing -= samples
+        if len(jobs) == 0:
+            return
+        print(f'Requesting {len(jobs)} concept simulations')
+        for cache_key, contents in zip(job_keys, await asyncio.gather(*jobs)):
+            self.sample_cache[cache_key].extend(contents)
+
+    def simulate_concepts(self, concepts, runs, max_concurrency=CONCEPT_SIMULATOR_MAX_CONCURRENCY,
+                          samples_per_request=CONCEPT_SIMULATOR_SAMPLES_PER_REQUEST):
+        """ makes sure runs samples are cached for every concept and fx, only requesting the ones missing """
+        nest_asyncio.apply()
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.fill_sample_cache(concepts=list(dict.fromkeys(concepts)), runs=runs,
+                                                       max_concurrency=max_concurrency,
+                                                       samples_per_request=samples_per_request))
+
+    def clear_sample_cache(self):
+        self.sample_cache = {}
+
+    def output_full_scoring_frame(self, runs, concept):
+        """ example: runs = 10, concept = 'develop AGI' 
+        samples come from the sample cache, which is topped up to runs per fx first """ 
+        self.simulate_concepts(concepts=[concept], runs=runs)
+        xarr = []
+        for fx_to_work in self.fx_map.keys():
+            contents = self.sample_cache[(self.default_model, concept, fx_to_work)][:runs]
+            xarr.append(pd.DataFrame({'choices__message__content': contents, 'fx': fx_to_work}))
+        raw_extraction = pd.concat(xarr, ignore_index=True)
+        raw_extraction['internal_name'] = concept+'_'+raw_extraction.index.astype(str)+'_'+raw_extraction['fx']
+        raw_extraction['value'] = pd.to_numeric(
+            raw_extraction['choices__message__content'].str.extract(CONCEPT_VALUE_PATTERN, expand=False).str.strip(),
+            errors='coerce')
+        return raw_extraction[['internal_name','choices__message__content','value','fx']]
 
     def generate_score_df(self,concept_score = 'develop AGI', runs=20):
         concept_df = self.output_full_scoring_frame(runs=runs, concept=concept_score)
@@ -129,7 +138,8 @@ Follow these examples, provide your reasoning as instructed then output the foll
 
 
         """
-        # Generate score DataFrames for each concept
+        # Sample every concept in one pass, the per concept frames below then read from the cache
+        self.simulate_concepts(concepts=list(score_map.keys()), runs=runs)
         concept_dfs = {concept: self.generate_score_df(concept_score=concept, runs=runs) 
                        for concept in score_map.keys()}
         
@@ -148,7 +158,7 @@ Follow these examples, provide your reasoning as instructed then output the foll
         # Add the overall score to the score_frame
         score_frame['score'] = score['overall_score']
         score_frame = score_frame.sort_values('score')
-        score_frame['score_map'] = score_map.to_json()
-        score_map['number_of_runs']= runs
-        score_map['run_time']= datetime.datetime.now()
+        score_frame['score_map'] = json.dumps(score_map)
+        score_frame['number_of_runs']= runs
+        score_frame['run_time']= datetime.datetime.now()
         return score_frame
\ No newline at end of file
@@ -1,5 +1,5 @@
 from agti.data.bloomberg.intraday_pulls import *
-from agti.utilities.db_manager import DBConnectionManager
+from agti.utilities.db_manager import DBConnectionManager, ensure_unique_index, insert_on_conflict_do_nothing
 from agti.data.tiingo.forex import TiingoFXTool
 from agti.utilities.settings import PasswordMapLoader
 from agti.utilities.settings import CredentialManager
@@ -16,48 +16,75 @@ class FXDroidCache:
         self.google_sheet_manager = GoogleSheetManager(prod_trading=True)
         self.bloomberg_daily_data_tool= BloombergDailyDataTool(pw_map=pw_map, 
                                                                bloomberg_connection=True)
+        self.indexed_tables = set()
+
+    def load_ticker_watermarks(self, dbconnx, table_name, field_name):
+        """ticker -> last cached bar as naive UTC (the time base of IntradayBarRequest), {} if the table is new"""
+        if not sqlalchemy.inspect(dbconnx).has_table(table_name):
+            return {}
+        self.ensure_intraday_cache_indexes(dbconnx, table_name)
+        watermarks = pd.read_sql(sqlalchemy.text(f"""
+            SELECT ticker, MAX(date) AS max_date FROM {table_name}
+            WHERE field_name = :field_name GROUP BY ticker"""), dbconnx, params={'field_name': field_name})
+        max_dates = pd.to_datetime(watermarks['max_date'], utc=True).dt.tz_convert('UTC').dt.tz_localize(None)
+        return dict(zip(watermarks['ticker'], max_dates))
+
+    def write_incremental_intraday_history(self, dbconnx, table_name, history):
+        """Bulk insert that skips bars already cached by unique_identifier"""
+        if history.empty:
+            return 0
+        if table_name not in self.indexed_tables and not sqlalchemy.inspect(dbconnx).has_table(table_name):
+            history.to_sql(table_name, dbconnx, if_exists='append')
+        else:
+            self.ensure_intraday_cache_indexes(dbconnx, table_name)
+            history.to_sql(table_name, dbconnx, if_exists='append',
+                           method=insert_on_conflict_do_nothing(['unique_identifier']))
+        self.ensure_intraday_cache_indexes(dbconnx, table_name)
+        return len(history)
+
+    def ensure_intraday_cache_indexes(self, dbconnx, table_name):
+        """unique_identifier backs ON CONFLICT, (ticker, date) keeps the watermark query off a full scan"""
+        if table_name in self.indexed_tables:
+            return
+        ensure_unique_index(dbconnx, table_name, ['unique_identifier'])
+        with dbconnx.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_ticker_date_idx ON {table_name} (ticker, date)"))
+        self.indexed_tables.add(table_name)
+
+    def update_intraday_cache(self, table_name, tickers, field_name, interval, default_startDateTime):
+        """
+        Requests only the bars after each ticker's last cached bar and appends them to table_name.
+        Tickers without history start from default_startDateTime
+        """
+        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
+        watermarks = self.load_ticker_watermarks(dbconnx, table_name, field_name)
+        endDateTime = datetime.datetime.now() + timedelta(1)
+        start_map = {ticker: watermarks.get(ticker, default_startDateTime) for ticker in tickers}
+        histories = self.intraday_bloomberg_tool.get_intraday_history_for_ticker_list(
+            tickers=tickers,
+            field_name=field_name,
+            interval=interval,
+            startDateTime=start_map,
+            endDateTime=endDateTime
+        )
+        for ticker, new_data in histories.items():
+            length_added = self.write_incremental_intraday_history(dbconnx, table_name, new_data)
+            print(f'Completed {ticker} from {start_map[ticker]}')
+            print(f"{length_added} bars sent")
+        dbconnx.dispose()
+
     def update_all_forex_half_hourly_history(self):
-        existing_unique_ids = []
-        try:
-            dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-            all_hist = pd.read_sql('spm_angron__bloomberg_halfhour_cache__close', dbconnx)
-            existing_unique_ids = all_hist['unique_identifier'].unique()
-        except:
-            pass
         g10_fx_crosses = ['eurusd', 'usdjpy', 'gbpusd', 'audusd', 'nzdusd', 'usdcad', 'usdchf', 'usdnok', 'usdsek']
         liquid_non_g10_fx_crosses = ['usdmxn', 'usdsgd', 'usdhkd', 'usdzar','usdpln','usdhuf','usdcnh']
         all_bloomberg_ticker_constructor = g10_fx_crosses+liquid_non_g10_fx_crosses
         all_bloomberg_currencies = [i+' curncy' for i in all_bloomberg_ticker_constructor]
         startDateTime = datetime.datetime(2022,11,1,1,30)
-        for xcurrency in all_bloomberg_currencies:
-            fx_hist=self.intraday_bloomberg_tool.get_intraday_history(ticker =xcurrency, field_name='close', interval=30, startDateTime=startDateTime,
-                                    endDateTime=datetime.datetime.now())  
-            fx_dexed = fx_hist.set_index('unique_identifier')
-            incremental_write = fx_dexed[~fx_dexed.index.get_level_values(0).isin(existing_unique_ids)].reset_index().copy()
-            dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-            incremental_write.to_sql('spm_angron__bloomberg_halfhour_cache__close', dbconnx, if_exists='append')
-            dbconnx.dispose()                   
-            print(f'Completed {xcurrency}')
-            length_added = len(incremental_write)
-            print(f"{length_added} length added")
-        existing_unique_ids = []
-        try:
-            dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-            all_hist = pd.read_sql('spm_angron__bloomberg_halfhour_cache__open', dbconnx)
-            existing_unique_ids = all_hist['unique_identifier'].unique()
-        except:
-            pass
-        for xcurrency in all_bloomberg_currencies:
-            fx_hist=self.intraday_bloomberg_tool.get_intraday_history(ticker =xcurrency, field_name='open', interval=30, startDateTime=startDateTime,
-                                    endDateTime=datetime.datetime.now())  
-            fx_dexed = fx_hist.set_index('unique_identifier')
-            incremental_write = fx_dexed[~fx_dexed.index.get_level_values(0).isin(existing_unique_ids)].reset_index().copy()
-            dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-            incremental_write.to_sql('spm_angron__bloomberg_halfhour_cache__open', dbconnx, if_exists='append')
-            dbconnx.dispose()                   
-            print(f'Completed {xcurrency}')
-            length_added = len(incremental_write)
-            print(f"{length_added} length added")
+        for field_name in ['close', 'open']:
+            self.update_intraday_cache(table_name=f'spm_angron__bloomberg_halfhour_cache__{field_name}',
+                                       tickers=all_bloomberg_currencies, field_name=field_name,
+                                       interval=30, default_startDateTime=startDateTime)
+
     def generate_initial_minutely_cache(self):
         ticker_to_work='usdjpy index'
         startDateTime= datetime.datetime.now()-datetime.timedelta(365*5)
@@ -90,72 +117,13 @@ class FXDroidCache:
 
 
     def update_minutely_cache_with_unique_records(self, ticker='eurusd curncy', xdays_ago=365*5):
-        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-        
-        # Fetch all unique identifiers from the existing minutely cache
-        all_unique_identifiers = list(pd.read_sql(
-            """SELECT unique_identifier FROM spm_angron__bloomberg_minutely_cache;""",
-            dbconnx
-        )['unique_identifier'].unique())
-        
-        # Get new data from Bloomberg
-        startDateTime = datetime.datetime.now() - datetime.timedelta(xdays_ago)
-        endDateTime = datetime.datetime.now() + timedelta(1)
-        new_data = self.intraday_bloomberg_tool.get_intraday_history(
-            ticker=ticker,
-            field_name='close',
-            interval=1,
-            startDateTime=startDateTime,
-            endDateTime=endDateTime
-        )
-        
-        # Filter new data to only include records with unique identifiers not already in the database
-        new_data_dexed = new_data.set_index('unique_identifier')
-        incremental_write = new_data_dexed[~new_data_dexed.index.isin(all_unique_identifiers)].reset_index().copy()
-        
-        # Append the new unique data to the database
-        incremental_write.to_sql('spm_angron__bloomberg_minutely_cache', dbconnx, if_exists='append')
-        
-        dbconnx.dispose()
-        
-        print(f'Completed updating {ticker}')
-        length_added = len(incremental_write)
-        print(f"{length_added} new records added")
+        self.update_minutely_cache_for_multiple_tickers(tickers=[ticker], xdays_ago=xdays_ago)
 
     def update_minutely_cache_for_multiple_tickers(self, tickers, xdays_ago=365*5):
-        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-
-        # Fetch all unique identifiers from the existing minutely cache
-        all_unique_identifiers = set(pd.read_sql(
-            """SELECT unique_identifier FROM spm_angron__bloomberg_minutely_cache;""",
-            dbconnx
-        )['unique_identifier'].unique())
-
-        startDateTime = datetime.datetime.now() - datetime.timedelta(xdays_ago)
-        endDateTime = datetime.datetime.now() + timedelta(1)
-
-        for ticker in tickers:
-            # Get new data from Bloomberg
-            new_data = self.intraday_bloomberg_tool.get_intraday_history(
-                ticker=ticker,
-                field_name='close',
-                interval=1,
-                startDateTime=startDateTime,
-                endDateTime=endDateTime
-            )
-
-            # Filter new data to only include records with unique identifiers not already in the database
-            new_data_dexed = new_data.set_index('unique_identifier')
-            incremental_write = new_data_dexed[~new_data_dexed.index.isin(all_unique_identifiers)].reset_index().copy()
-            dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='spm_typhus')
-            # Append the new unique data to the database
-            incremental_write.to_sql('spm_angron__bloomberg_minutely_cache', dbconnx, if_exists='append')
-            dbconnx.dispose()
-            print(f'Completed updating {ticker}')
-            length_added = len(incremental_write)
-            print(f"{length_added} new records added")
-
-        dbconnx.dispose()
+        """ tickers already cached resume from their last bar, new tickers load xdays_ago of history """
+        self.update_intraday_cache(table_name='spm_angron__bloomberg_minutely_cache',
+                                   tickers=tickers, field_name='close', interval=1,
+                                   default_startDateTime=datetime.datetime.now() - datetime.timedelta(xdays_ago))
 
     def update_all_core_interest_rate_data(self, xdays_of_update=3):
         fx_map = self.google_sheet_manager.load_google_sheet_as_df(workbook='odv', 
@@ -171,14 +139,10 @@ class FXDroidCache:
         full_fx_df = fx_map[['fx','localbigmac','citi_economic_index','bbg_equity','bbg_total_ret']].head(10).copy()
         full_fx_df['localbigmac']=full_fx_df['localbigmac'].apply(lambda x: str(x).lower())
         all_extra_tickers = list(full_fx_df['localbigmac'])+list(full_fx_df['citi_economic_index'])+list(full_fx_df['bbg_equity'])+list(full_fx_df['bbg_total_ret'])
-        yarr=[]
-        for xticker in all_extra_tickers:
-            hist_df = self.bloomberg_daily_data_tool.BDH(bbgTicker=xticker,
-                field='px_last',
-                startDate='2006-01-01',
-                endDate=(datetime.datetime.now()+datetime.timedelta(1)).strftime('%Y-%m-%d'),
-                periodicity='DAILY',
-                overrides={})
-            yarr.append(hist_df)
-        fx_df = pd.concat(yarr)
+        fx_df = self.bloomberg_daily_data_tool.BDH_BATCH(bbgTickers=all_extra_tickers,
+            field='px_last',
+            startDate='2006-01-01',
+            endDate=(datetime.datetime.now()+datetime.timedelta(1)).strftime('%Y-%m-%d'),
+            periodicity='DAILY',
+            overrides={})
         return fx_df
\ No newline at end of file
@@ -10,8 +10,17 @@ import google.generativeai as genai
 from agti.ai.anthropic import AnthropicTool
 from agti.ai.together import TogetherAIRequestTool
 from agti.ai.gemini import GoogleGeminiResponseTool
-import time
-import signal
+import asyncio
+import nest_asyncio
+import sqlalchemy
+
+BENCHMARK_TABLE = 'financial_model_benchmark__new'
+# requests in flight per api, the anthropic tool's own default is 2
+BENCHMARK_PROVIDER_CONCURRENCY = {'together': 8, 'openai': 8, 'anthropic': 2, 'google_gemini': 4}
+BENCHMARK_REPEATS = 4
+BENCHMARK_JOB_TIMEOUT_SECONDS = 120
+BENCHMARK_RUN_TIMEOUT_SECONDS = 3600
+
 class AIFinanceBenchmark:
     def __init__(self,pw_map):
         self.pw_map= pw_map
@@ -61,272 +70,201 @@ class AIFinanceBenchmark:
                                        user_prompt.replace('___question__replacement___',x['question']), axis=1)
         self.benchmark_questions['system_prompt']=system_prompt
 
-    def create_open_ai_benchmark_df(self,model_to_work = 'gpt-4o'):
-        
-        df_to_work = self.benchmark_questions.copy()
-        df_to_work['api_args']=df_to_work.apply(lambda x:{
-                    "model": model_to_work,
-                    "messages": [
-                        {"role": "system", "content": x['system_prompt']},
-                        {"role": "user", "content": x['user_prompt']}
-                    ]
-                }, axis=1)
-        
-        def try_extract_score(score_string):
-            ret = np.nan
-            try:
-                ret = int(score_string.split('Score |')[-1:][0].replace('|','').strip())
-            except:
-                pass
-            return ret
-        
-        api_args_to_work = df_to_work.set_index('question')['api_args'].to_dict()
-        write_df = self.open_ai_request_tool.create_writable_df_for_async_chat_completion(api_args_to_work)
-        write_df['score']= write_df['choices__message__content'].apply(lambda x: try_extract_score(x))
-        question_to_score = write_df[['internal_name','score']].groupby('internal_name').first()['score']
-        df_to_work['calculated_score']= df_to_work['question'].map(question_to_score)
-        df_to_work['error']=df_to_work['answer'].astype(int)-df_to_work['calculated_score']
-        return df_to_work
+    def run_togetherai_benchmarks(self):
+        return self.run_benchmarks(providers=['together'])
 
-    def create_togetherai_benchmark_df(self,model_to_work = 'codellama/CodeLlama-34b-Instruct-hf'):
-        df_to_work = self.benchmark_questions.copy()
-        df_to_work['api_args']=df_to_work.apply(lambda x:{
-                    "model": model_to_work,
-                    "messages": [
-                        {"role": "system", "content": x['system_prompt']},
-                        {"role": "user", "content": x['user_prompt']}
-                    ]
-                }, axis=1)
-        
-        def try_extract_score(score_string):
-            ret = np.nan
-            try:
-                ret = int(score_string.split('Score |')[-1:][0].replace('|','').strip())
-            except:
-                pass
-            return ret
-        
-        api_args_to_work = df_to_work.set_index('question')['api_args'].to_dict()
-        write_df = self.together_ai_request_tool.create_writable_df_for_async_chat_completion(arg_async_map=api_args_to_work)
-        write_df['score']= write_df['choices__message__content'].apply(lambda x: try_extract_score(x))
-        question_to_score = write_df[['internal_name','score']].groupby('internal_name').first()['score']
-        df_to_work['calculated_score']= df_to_work['question'].map(question_to_score)
-        df_to_work['error']=df_to_work['answer'].astype(int)-df_to_work['calculated_score']
-        return df_to_work
+    def run_open_ai_benchmarks(self):
+        return self.run_benchmarks(providers=['openai'])
 
-    def score_together_model(self,model_to_work='meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo'):
-        xarr= []
-        for xr in range(1,5):
-            try:
-                error_frame_together = self.create_togetherai_benchmark_df(model_to_work=model_to_work)
-                total_error = error_frame_together['error'].abs().mean()
-                xarr.append(total_error)
-                time.sleep(1.5)
-            except:
-                pass
-        average_error = np.mean(xarr)
-        return average_error
+    def run_anthropic_benchmarks(self):
+        return self.run_benchmarks(providers=['anthropic'])
 
-    def score_openai_model(self,model_to_work='meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo'):
-        xarr= []
-        for xr in range(1,5):
-            try:
-                error_frame_together = self.create_open_ai_benchmark_df(model_to_work=model_to_work)
-                total_error = error_frame_together['error'].abs().mean()
-                xarr.append(total_error)
-                time.sleep(.5)
-            except:
-                pass
-        average_error = np.mean(xarr)
-        return average_error
+    def run_gemini_benchmarks(self):
+        return self.run_benchmarks(providers=['google_gemini'])
 
+    def get_benchmark_models(self, provider):
+        if provider == 'together':
+            return list(pd.DataFrame(together.Models().list())['id'].unique())
+        if provider == 'openai':
+            return [i.id for i in self.open_ai_request_tool.client.models.list()]
+        if provider == 'anthropic':
+            return list(self.key_claude_models)
+        if provider == 'google_gemini':
+            return list(self.key_gemini_models)
+        raise ValueError(f'unknown benchmark provider {provider}')
 
-    def timeout_handler(self, signum, frame):
-        raise TimeoutError("Function execution timed out")
-    
-    def run_with_timeout(self, func, timeout=180, *args, **kwargs):
-        """
-        Run a function with a specified timeout.
-        
-        Args:
-        func (callable): The function to run.
-        timeout (int): The timeout in seconds. Default is 180 (3 minutes).
-        *args, **kwargs: Arguments to pass to the function.
-        
-        Returns:
-        The result of the function if it completes within the timeout.
-        
-        Raises:
-        TimeoutError: If the function execution exceeds the timeout.
-        """
-        def wrapped_func():
-            return func(*args, **kwargs)
+    def load_completed_benchmarks(self, since):
+        """ (api_source, model) pairs already written to the benchmark table since a datetime """
+        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        if not sqlalchemy.inspect(dbconnx).has_table(BENCHMARK_TABLE):
+            return set()
+        completed = pd.read_sql(sqlalchemy.text(f'SELECT DISTINCT api_source, model FROM {BENCHMARK_TABLE} WHERE date >= :since'),
+                                dbconnx, params={'since': since})
+        return set(zip(completed['api_source'], completed['model']))
 
-        # Set the signal handler and a 3-second alarm
-        signal.signal(signal.SIGALRM, self.timeout_handler)
-        signal.alarm(timeout)
-        
+    def write_benchmark_result(self, provider, model_to_work, scoring):
+        ydf = pd.DataFrame({
+            'model': model_to_work,
+            'score': scoring,
+            'date': datetime.datetime.now(),
+            'api_source': provider
+        }, index=[0])
+        dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
+        ydf.to_sql(BENCHMARK_TABLE, dbconnx, if_exists='append')
+
+    def try_extract_score(self, score_string):
+        ret = np.nan
         try:
-            result = wrapped_func()
-        finally:
-            # Disable the alarm
-            signal.alarm(0)
-        
-        return result
+            ret = int(score_string.split('Score |')[-1:][0].replace('|','').strip())
+        except:
+            pass
+        return ret
 
-    def run_togetherai_benchmarks(self):
-        all_model_df = pd.DataFrame(together.Models().list())
-        ##import signal
-        ## import time
-        full_scoring = all_model_df['id'].unique()
-        model_to_work=mods#[22]
-        for model_to_work in list(full_scoring):
-            try:
-                scoring = self.run_with_timeout(self.score_together_model, timeout=180, model_to_work=model_to_work)
-                ydf = pd.DataFrame({'model': model_to_work,'score':scoring,'date': datetime.datetime.now()}, index=[0])
-                ydf['api_source']='together'
-                
-                dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-                ydf.to_sql('financial_model_benchmark__new', dbconnx, if_exists='append')
-            except:
-                pass
-    # Usage:
-    #scoring = self.run_with_timeout(self.score_together_model, timeout=180, model_to_work=full_scoring[3])
-    def run_open_ai_benchmarks(self):
-        all_models = [i.id for i in self.open_ai_request_tool.client.models.list()]
-        for model_to_work in list(all_models):
-            try:
-                scoring = self.run_with_timeout(self.score_openai_model, timeout=180, model_to_work=model_to_work)
-                ydf = pd.DataFrame({'model': model_to_work,'score':scoring,'date': datetime.datetime.now()}, index=[0])
-                ydf['api_source']='openai'
-                
-                dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-                ydf.to_sql('financial_model_benchmark__new', dbconnx, if_exists='append')
-            except:
-                pass
+    async def request_benchmark_text(self, provider, model_to_work, system_prompt, user_prompt):
+        """ one benchmark question against one model, returns the response text """
+        if provider in ('together', 'openai'):
+            client = self.together_ai_request_tool.async_client if provider == 'together' else self.open_ai_request_tool.async_client
+            response = await client.chat.completions.create(
+                model=model_to_work,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ])
+            return response.choices[0].message.content
+        if provider == 'anthropic':
+            api_args = {
+                "model": model_to_work,
+                "max_tokens": 1000,
+                "system": system_prompt,
+                "messages": [{"role": "user", "content": user_prompt}]
+            }
+            # goes through the tool's own rate limit and RateLimitError retry
+            job_name, response = await self.anthropic_tool.rate_limited_request(model_to_work, api_args)
+            return response.content[0].text if response.content else ''
+        if provider == 'google_gemini':
+            api_args = {
+                'model_name': model_to_work,
+                'generation_config': {
+                    'temperature': 0,
+                    'top_p': 0.95,
+                    'top_k': 64,
+                    'max_output_tokens': 8192,
+                },
+                'safety_settings': {
+                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                },
+                'user_prompt': system_prompt + '\n\n' + user_prompt
+            }
+            job_name, response = await self.google_gemini_tool.get_gemini_completion(model_to_work, api_args)
+            candidates = [self.google_gemini_tool.serialize_candidate(candidate) for candidate in response.candidates]
+            return candidates[0]['content'] if candidates and candidates[0]['content'] else ''
+        raise ValueError(f'unknown benchmark provider {provider}')
 
-    def create_anthropic_benchmark_df(self, model_to_work):
-        df_to_work = self.benchmark_questions.copy()
-        df_to_work['api_args'] = df_to_work.apply(lambda x: {
-            "model": model_to_work,
-            "max_tokens": 1000,
-            "system": x['system_prompt'],
-            "messages": [
-                {"role": "user", "content": x['user_prompt']}
-            ]
-        }, axis=1)
-        
-        def try_extract_score(score_string):
-            ret = np.nan
-            try:
-                ret = int(score_string.split('Score |')[-1:][0].replace('|','').strip())
-            except:
-                pass
-            return ret
-        
-        api_args_to_work = df_to_work.set_index('question')['api_args'].to_dict()
-        write_df = self.anthropic_tool.create_writable_df_for_async_chat_completion(api_args_to_work)
-        write_df['score'] = write_df['content'].apply(lambda x: try_extract_score(x))
-        question_to_score = write_df[['internal_name','score']].groupby('internal_name').first()['score']
-        df_to_work['calculated_score'] = df_to_work['question'].map(question_to_score)
-        df_to_work['error'] = df_to_work['answer'].astype(int) - df_to_work['calculated_score']
-        return df_to_work
+    async def score_benchmark_question(self, provider, model_to_work, question_row, semaphore,
+                                       job_timeout, max_retries):
+        """ calculated score for one question, nan if every attempt failed or timed out """
+        for attempt in range(max_retries + 1):
+            async with semaphore:
+                try:
+                    text = await asyncio.wait_for(
+                        self.request_benchmark_text(provider, model_to_work,
+                                                    question_row['system_prompt'], question_row['user_prompt']),
+                        timeout=job_timeout)
+                    return self.try_extract_score(text)
+                except asyncio.TimeoutError:
+                    print(f"{provider} {model_to_work} timed out after {job_timeout} seconds")
+                except Exception as e:
+                    print(f"{provider} {model_to_work} attempt {attempt + 1} failed: {str(e)}")
+            if attempt < max_retries:
+                # back off outside the semaphore so other models keep the slot busy
+                await asyncio.sleep(2 ** attempt)
+        return np.nan
+
+    async def benchmark_model(self, provider, model_to_work, semaphore, repeats, job_timeout, max_retries):
+        """ runs every question repeats times for one model and checkpoints the average absolute error """
+        answers = self.benchmark_questions['answer'].astype(int).values
+        question_rows = self.benchmark_questions.to_dict('records')
+        jobs = [self.score_benchmark_question(provider, model_to_work, question_row, semaphore, job_timeout, max_retries)
+                for xr in range(repeats) for question_row in question_rows]
+        calculated_scores = np.array(await asyncio.gather(*jobs), dtype=float).reshape(repeats, len(question_rows))
+        errors = pd.DataFrame(np.abs(answers - calculated_scores))
+        # a repeat where every question failed is dropped, as a failed repeat was before
+        repeat_errors = errors.mean(axis=1).dropna()
+        if len(repeat_errors) == 0:
+            print(f"No usable responses for {provider} {model_to_work}")
+            return model_to_work, np.nan
+        scoring = repeat_errors.mean()
+        await asyncio.to_thread(self.write_benchmark_result, provider, model_to_work, scoring)
+        print(f"Benchmark completed for {model_to_work}")
+        return model_to_work, scoring
 
-    def score_anthropic_model(self, model_to_work):
-        xarr = []
-        for xr in range(1, 5):
+    async def run_benchmarks_async(self, providers=None, repeats=BENCHMARK_REPEATS,
+                                   job_timeout=BENCHMARK_JOB_TIMEOUT_SECONDS,
+                                   run_timeout=BENCHMARK_RUN_TIMEOUT_SECONDS,
+                                   max_retries=2, skip_completed_since=None):
+        providers = providers or list(BENCHMARK_PROVIDER_CONCURRENCY.keys())
+        if skip_completed_since is None:
+            skip_completed_since = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        completed = self.load_completed_benchmarks(since=skip_completed_since) if skip_completed_since else set()
+        if 'google_gemini' in providers:
+            genai.configure(api_key=self.pw_map['google_gemini_api'])
+
+        tasks = {}
+        for provider in providers:
+            semaphore = asyncio.Semaphore(BENCHMARK_PROVIDER_CONCURRENCY[provider])
             try:
-                error_frame_anthropic = self.create_anthropic_benchmark_df(model_to_work=model_to_work)
-                total_error = error_frame_anthropic['error'].abs().mean()
-                xarr.append(total_error)
-                time.sleep(1.5)
+                models = self.get_benchmark_models(provider)
             except Exception as e:
-                print(f"Error in iteration {xr} for model {model_to_work}: {str(e)}")
-        average_error = np.mean(xarr)
-        return average_error
+                print(f"Could not list {provider} models: {str(e)}")
+                continue
+            models_to_run = [model_to_work for model_to_work in models if (provider, model_to_work) not in completed]
+            print(f"{provider}: benchmarking {len(models_to_run)} models, {len(models) - len(models_to_run)} already done")
+            for model_to_work in models_to_run:
+                task = asyncio.create_task(self.benchmark_model(provider, model_to_work, semaphore,
+                                                                repeats, job_timeout, max_retries))
+                tasks[task] = (provider, model_to_work)
 
-    def run_anthropic_benchmarks(self):
-        for model_to_work in self.key_claude_models:
+        results = []
+        if len(tasks) == 0:
+            return pd.DataFrame(results, columns=['api_source', 'model', 'score'])
+        done, pending = await asyncio.wait(list(tasks.keys()), timeout=run_timeout)
+        for task in done:
+            provider, model_to_work = tasks[task]
             try:
-                scoring = self.run_with_timeout(self.score_anthropic_model, timeout=900, model_to_work=model_to_work)
-                ydf = pd.DataFrame({
-                    'model': model_to_work,
-                    'score': scoring,
-                    'date': datetime.datetime.now(),
-                    'api_source': 'anthropic'
-                }, index=[0])
-                
-                dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-                ydf.to_sql('financial_model_benchmark__new', dbconnx, if_exists='append')
-                print(f"Benchmark completed for {model_to_work}")
-            except TimeoutError:
-                print(f"Benchmark for {model_to_work} timed out")
+                results.append((provider, model_to_work, task.result()[1]))
             except Exception as e:
                 print(f"Error benchmarking {model_to_work}: {str(e)}")
+        if pending:
+            print(f"Benchmark run hit its {run_timeout} second limit with {len(pending)} models unfinished, "
+                  "rerun to pick them up")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return pd.DataFrame(results, columns=['api_source', 'model', 'score'])
 
-    def create_gemini_benchmark_df(self, model_to_work='gemini-1.5-pro'):
-        df_to_work = self.benchmark_questions.copy()
-        df_to_work['api_args'] = df_to_work.apply(lambda x: {
-            'model_name': model_to_work,
-            'generation_config': {
-                'temperature': 0,
-                'top_p': 0.95,
-                'top_k': 64,
-                'max_output_tokens': 8192,
-            },
-            'safety_settings': {
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            },
-            'user_prompt': x['system_prompt'] + '\n\n' + x['user_prompt']
-        }, axis=1)
-
-        def try_extract_score(score_string):
-            ret = np.nan
-            try:
-                ret = int(score_string.split('Score |')[-1:][0].replace('|', '').strip())
-            except:
-                pass
-            return ret
-
-        api_args_to_work = df_to_work.set_index('question')['api_args'].to_dict()
-        write_df = self.google_gemini_tool.create_writable_df_for_async_chat_completion(arg_async_map=api_args_to_work)
-        write_df['score'] = write_df['text'].apply(lambda x: try_extract_score(x))
-        question_to_score = write_df[['internal_name', 'score']].groupby('internal_name').first()['score']
-        df_to_work['calculated_score'] = df_to_work['question'].map(question_to_score)
-        df_to_work['error'] = df_to_work['answer'].astype(int) - df_to_work['calculated_score']
-        return df_to_work
+    def run_benchmarks(self, providers=None, repeats=BENCHMARK_REPEATS,
+                       job_timeout=BENCHMARK_JOB_TIMEOUT_SECONDS,
+                       run_timeout=BENCHMARK_RUN_TIMEOUT_SECONDS,
+                       max_retries=2, skip_completed_since=None):
+        """
+        Benchmarks every model of every provider concurrently.
 
-    def score_gemini_model(self, model_to_work='gemini-1.5-pro'):
-        xarr = []
-        for xr in range(1, 5):
-            try:
-                error_frame_gemini = self.create_gemini_benchmark_df(model_to_work=model_to_work)
-                total_error = error_frame_gemini['error'].abs().mean()
-                xarr.append(total_error)
-                time.sleep(1.5)
-            except Exception as e:
-                print(f"Error in iteration {xr} for model {model_to_work}: {str(e)}")
-        average_error = np.mean(xarr)
-        return average_error
+        Each (model, question, repeat) is its own job with a job_timeout deadline, jobs for a
+        provider share a BENCHMARK_PROVIDER_CONCURRENCY semaphore and the whole run stops after
+        run_timeout seconds. A model's score is written to financial_model_benchmark__new as soon
+        as all of its jobs finish, and models already written since skip_completed_since (default
+        midnight today) are skipped, so rerunning after a timeout or crash only does what is left.
+        Pass skip_completed_since=False to rerun everything.
 
-    def run_gemini_benchmarks(self):
-        for model_to_work in self.key_gemini_models:
-            try:
-                scoring = self.run_with_timeout(self.score_gemini_model, timeout=500, model_to_work=model_to_work)
-                ydf = pd.DataFrame({
-                    'model': model_to_work,
-                    'score': scoring,
-                    'date': datetime.datetime.now(),
-                    'api_source': 'google_gemini'
-                }, index=[0])
-                
-                dbconnx = self.db_connection_manager.spawn_sqlalchemy_db_connection_for_user(user_name='agti_corp')
-                ydf.to_sql('financial_model_benchmark__new', dbconnx, if_exists='append')
-                print(f"Benchmark completed for {model_to_work}")
-            except TimeoutError:
-                print(f"Benchmark for {model_to_work} timed out")
-            except Exception as e:
-                print(f"Error benchmarking {model_to_work}: {str(e)}")
\ No newline at end of file
+        providers is any of together, openai, anthropic, google_gemini (default all)
+        returns a frame of api_source, model, score for the models run
+        """
+        nest_asyncio.apply()
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(self.run_benchmarks_async(providers=providers, repeats=repeats,
+                                                                 job_timeout=job_timeout, run_timeout=run_timeout,
+                                                                 max_retries=max_retries,
+                                                                 skip_completed_since=skip_completed_since))
@@ -26,15 +26,10 @@ class MosaicCreator:
         bdp_df = self.bloomberg_daily_data_tool.BDP(bbgTickers=bbgTickers, field=field, overrides={}).copy()
         bdp_df['value']=bdp_df['value'].astype(float)
         bdp_df['date']=pd.to_datetime(datetime.datetime.now().strftime('%Y-%m-%d'))
-        all_bdh_history = []
-        for xticker in bbgTickers:
-            try:
-                all_bdh_history.append(self.bloomberg_daily_data_tool.BDH(bbgTicker=xticker, field=field,
+        all_bdh_history = self.bloomberg_daily_data_tool.BDH_BATCH(bbgTickers=bbgTickers, field=field,
                                                    startDate='2006-01-01',overrides={}, 
-                                                   endDate=datetime.datetime.now().strftime('%Y-%m-%d')))
-            except:
-                pass
-        full_real_time_df = pd.concat([pd.concat(all_bdh_history).reset_index(),bdp_df.reset_index()])
+                                                   endDate=datetime.datetime.now().strftime('%Y-%m-%d'))
+        full_real_time_df = pd.concat([all_bdh_history.reset_index(),bdp_df.reset_index()])
         full_real_time_df = full_real_time_df.groupby(['bbgTicker','date']).last().sort_index()
         full_real_time_df['value']= full_real_time_df['value'].astype(float)
         return full_real_time_df
@@ -98,20 +93,11 @@ class MosaicCreator:
                           'Colombia':'IGBC INDEX',
                           'Poland': 'WIG20 INDEX'}
         
-        yarr=[]
-        for ind_to_work in self.country_equity_index.values():
-            try:
-                last_year=(datetime.datetime.now()-datetime.timedelta(365*2)).strftime('%Y-%m-%d')
-                today=(datetime.datetime.now()).strftime('%Y-%m-%d')
-                eps_hist=self.bloomberg_daily_data_tool.BDH(bbgTicker=ind_to_work.lower(), 
-                                                            field='BEST_EPS',startDate=last_year, 
-                                                            endDate=today,overrides={'BEST_FPERIOD_OVERRIDE':'1BF'})
-                yarr.append(eps_hist)
-            except:
-                print(ind_to_work)
-                pass
-        
-        full_df = pd.concat(yarr)
+        last_year=(datetime.datetime.now()-datetime.timedelta(365*2)).strftime('%Y-%m-%d')
+        today=(datetime.datetime.now()).strftime('%Y-%m-%d')
+        full_df=self.bloomberg_daily_data_tool.BDH_BATCH(bbgTickers=[i.lower() for i in self.country_equity_index.values()], 
+                                                         field='BEST_EPS',startDate=last_year, 
+                                                         endDate=today,overrides={'BEST_FPERIOD_OVERRIDE':'1BF'})
         full_df['value']=full_df['value'].astype(float)
         eps_expectations= full_df.reset_index().groupby(['date',
                                        'bbgTicker']).last()['value'].unstack().fillna(method='pad')
@@ -42,17 +42,14 @@ class AngronVolatilityAndCorrelFrame:
         implied_vol['volatility']=implied_vol[['value','hvol']].astype(float).mean(1)
         forward_vol['ticker_name']=[i[0:6] for i in forward_vol.index]
         tl_histories = [i+'TL CURNCY' for i in bloomberg_tickers]+added_ticker
-        yarr=[]
-        for xtick in tl_histories:
-            ydf = self.bloomberg_daily_data.BDH( bbgTicker=xtick,
-                field='px_last',
-                startDate='2022-01-01',
-                endDate= datetime.datetime.now().strftime("%Y-%m-%d"),
-                periodicity='DAILY',
-                overrides=None,
-            )
-            yarr.append(ydf)
-        weekly__resampled_history= pd.concat(yarr).reset_index()[['value','date',
+        tl_history = self.bloomberg_daily_data.BDH_BATCH(bbgTickers=tl_histories,
+            field='px_last',
+            startDate='2022-01-01',
+            endDate= datetime.datetime.now().strftime("%Y-%m-%d"),
+            periodicity='DAILY',
+            overrides=None,
+        )
+        weekly__resampled_history= tl_history.reset_index()[['value','date',
                                        'bbgTicker']].groupby(['date','bbgTicker']).last()['value'].unstack().astype(float).resample('W-FRI').last()
         def calculate_beta_for_fx(fx='NZDUSDTL CURNCY'):
             op=reg.calculate_rolling_beta_of_ts(weekly__resampled_history.pct_change(1)[fx],
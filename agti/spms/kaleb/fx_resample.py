@@ -31,14 +31,8 @@ class FXFrameLoader:
         fx_spot_tiingo = pd.read_sql('tiingo__fx_spot_usd_denom', dbconnx)
         bloomberg_fx__close_raw = pd.read_sql('spm_angron__bloomberg_halfhour_cache__close',dbconnx)
         bloomberg_fx__open_raw = pd.read_sql('spm_angron__bloomberg_halfhour_cache__open',dbconnx)
-        bloomberg_fx__close_raw['date_est']=bloomberg_fx__close_raw['date'].apply(lambda x: str(x).split('+')[0])
-        bloomberg_fx__close_raw['date_est'] = bloomberg_fx__close_raw['date_est'].apply(lambda x: datetime.datetime.strptime(x,"%Y-%m-%d %H:%M:%S"))
-        bloomberg_fx__open_raw['date_est']=bloomberg_fx__open_raw['date'].apply(lambda x: str(x).split('+')[0])
-        bloomberg_fx__open_raw['date_est'] = bloomberg_fx__open_raw['date_est'].apply(lambda x: datetime.datetime.strptime(x,"%Y-%m-%d %H:%M:%S"))
-        bloomberg_fx__open_raw['open']=bloomberg_fx__open_raw['value'].astype(float)
-        bloomberg_fx__close_raw['close']=bloomberg_fx__close_raw['value'].astype(float)
-        bloomberg_fx__open_raw['ticker']=bloomberg_fx__open_raw['ticker'].apply(lambda x: x.split(' curncy')[0])
-        bloomberg_fx__close_raw['ticker']=bloomberg_fx__close_raw['ticker'].apply(lambda x: x.split(' curncy')[0])
+        bloomberg_fx__open_raw = self.parse_bloomberg_half_hour_frame(bloomberg_fx__open_raw, value_name='open')
+        bloomberg_fx__close_raw = self.parse_bloomberg_half_hour_frame(bloomberg_fx__close_raw, value_name='close')
         fx_spot_tiingo['data_source']='tiingo'
         bloomberg_frame = pd.concat([bloomberg_fx__open_raw[['date_est','open',
                                 'ticker']].groupby(['ticker',
@@ -50,28 +44,65 @@ class FXFrameLoader:
         tiingo_frame = fx_spot_tiingo[['ticker','open','close','date_est','data_source']]
         full_forex_history_df = pd.concat([bloomberg_frame,tiingo_frame])
         dollar_constructor = full_forex_history_df.groupby(['ticker','date_est']).last().copy()[['open','close']]
-        all_crosses = dollar_constructor.index.get_level_values(0).unique()
-        all_liquid_crosses = list(set([i[0:3] for i in all_crosses]+[i[-3:] for i in all_crosses]))
-        
-        all_pairs = [''.join(i) for i in list(itertools.permutations(all_liquid_crosses,2))]
-        non_usd_crosses = [i for i in all_pairs if 'usd' not in i]
-        full_cross_constructor_arr=[]
-        for ticker in non_usd_crosses:
-            ticker_num= ticker[0:3]
-            ticker_denom=ticker[-3:]
-            cross_constructor = (dollar_constructor.loc[f'{ticker_num}usd']*dollar_constructor.loc[f'usd{ticker_denom}']).copy()
-            cross_constructor['ticker']=ticker
-            full_cross_constructor_arr.append(cross_constructor)
-        full_constructor = pd.concat(full_cross_constructor_arr).dropna()
-        full_constructor= full_constructor.reset_index()
+        full_constructor = self.construct_non_usd_cross_history(dollar_constructor)
         full_forex_history_df=pd.concat([full_constructor,dollar_constructor.reset_index()])
-        date_to_type_map = pd.DataFrame(list(full_forex_history_df['date_est'].unique()))
-        date_to_type_map['hour_map']=date_to_type_map[0].apply(lambda x: str(x).split(' ')[-1:][0])
-        date_to_type_map['date_map']=date_to_type_map[0].apply(lambda x: str(x).split(' ')[0])
-        full_forex_history_df['hour']=full_forex_history_df['date_est'].map(date_to_type_map.groupby(0).first()['hour_map'])
-        full_forex_history_df['simple_date']=full_forex_history_df['date_est'].map(date_to_type_map.groupby(0).first()['date_map'])
+        # hour and date strings only need formatting once per distinct half hour
+        unique_dates = pd.Series(full_forex_history_df['date_est'].unique())
+        hour_map = pd.Series(unique_dates.dt.strftime('%H:%M:%S').values, index=unique_dates.values)
+        date_map = pd.Series(unique_dates.dt.strftime('%Y-%m-%d').values, index=unique_dates.values)
+        full_forex_history_df['hour']=full_forex_history_df['date_est'].map(hour_map)
+        full_forex_history_df['simple_date']=full_forex_history_df['date_est'].map(date_map)
         return full_forex_history_df
 
+    def parse_bloomberg_half_hour_frame(self, raw_frame, value_name):
+        """ strips the utc offset off the half hour cache dates and the curncy suffix off tickers
+        raw_frame is a spm_angron__bloomberg_halfhour_cache__ table, value is copied into value_name"""
+        date_strings = raw_frame['date'].astype(str).str.split('+').str[0]
+        raw_frame['date_est'] = pd.to_datetime(date_strings, format="%Y-%m-%d %H:%M:%S")
+        raw_frame[value_name] = raw_frame['value'].astype(float)
+        raw_frame['ticker'] = raw_frame['ticker'].str.split(' curncy').str[0]
+        return raw_frame
+
+    def construct_non_usd_cross_history(self, dollar_constructor):
+        """ builds every non usd cross from the usd legs, ie eurjpy = eurusd * usdjpy
+        dollar_constructor is indexed by ticker, date_est with open and close columns.
+        The usd legs are pivoted to wide date x ticker matrices and every cross is the outer product
+        of the numerator (xxxusd) and denominator (usdyyy) columns. Rows missing either leg are dropped
+        returns a long frame with date_est, open, close, ticker """
+        all_crosses = dollar_constructor.index.get_level_values(0).unique()
+        all_liquid_crosses = sorted(set([i[0:3] for i in all_crosses]+[i[-3:] for i in all_crosses]))
+        all_pairs = [(num, denom) for num, denom in itertools.permutations(all_liquid_crosses,2)
+                     if 'usd' not in num+denom]
+        missing_legs = [f'{num}{denom}' for num, denom in all_pairs
+                        if (f'{num}usd' not in all_crosses) or (f'usd{denom}' not in all_crosses)]
+        if len(missing_legs) > 0:
+            print(f'Skipping {len(missing_legs)} crosses without both usd legs')
+        all_pairs = [(num, denom) for num, denom in all_pairs if f'{num}{denom}' not in missing_legs]
+        numerators = sorted(set(num for num, denom in all_pairs))
+        denominators = sorted(set(denom for num, denom in all_pairs))
+        pair_positions = [numerators.index(num)*len(denominators) + denominators.index(denom)
+                          for num, denom in all_pairs]
+
+        cross_fields = {}
+        date_index = None
+        for field in ['open','close']:
+            wide = dollar_constructor[field].unstack(level=0)
+            date_index = wide.index
+            # legs are held as currency x date so each cross comes out as one contiguous row
+            num_matrix = wide[[f'{num}usd' for num in numerators]].values.T
+            denom_matrix = wide[[f'usd{denom}' for denom in denominators]].values.T
+            outer = num_matrix[:, None, :] * denom_matrix[None, :, :]
+            cross_fields[field] = outer.reshape(-1, len(date_index))[pair_positions].ravel()
+            del outer
+        has_both = ~(np.isnan(cross_fields['open']) | np.isnan(cross_fields['close']))
+        cross_tickers = np.array([f'{num}{denom}' for num, denom in all_pairs], dtype=object)
+        full_constructor = pd.DataFrame({
+            'date_est': np.tile(date_index.values, len(all_pairs))[has_both],
+            'open': cross_fields['open'][has_both],
+            'close': cross_fields['close'][has_both],
+            'ticker': np.repeat(cross_tickers, len(date_index))[has_both]})
+        return full_constructor
+
     def get_live_fx_price_for_all_crosses(self):
         full_list_of_tickers = """mxnhuf|mxnnok|mxnchf|mxnzar|mxncnh|mxnaud|mxnjpy|mxnsek|mxneur|mxnhkd|mxnsgd|mxngbp|mxnpln|mxncad|mxnnzd|hufmxn|hufnok|hufchf|hufzar|hufcnh|hufaud|hufjpy|hufsek|hufeur|hufhkd|hufsgd|hufgbp|hufpln|hufcad|hufnzd|nokmxn|nokhuf|nokchf|nokzar|nokcnh|nokaud|nokjpy|noksek|nokeur|nokhkd|noksgd|nokgbp|nokpln|nokcad|noknzd|chfmxn|chfhuf|chfnok|chfzar|chfcnh|chfaud|chfjpy|chfsek|chfeur|chfhkd|chfsgd|chfgbp|chfpln|chfcad|chfnzd|zarmxn|zarhuf|zarnok|zarchf|zarcnh|zaraud|zarjpy|zarsek|zareur|zarhkd|zarsgd|zargbp|zarpln|zarcad|zarnzd|cnhmxn|cnhhuf|cnhnok|cnhchf|cnhzar|cnhaud|cnhjpy|cnhsek|cnheur|cnhhkd|cnhsgd|cnhgbp|cnhpln|cnhcad|cnhnzd|audmxn|audhuf|audnok|audchf|audzar|audcnh|audjpy|audsek|audeur|audhkd|audsgd|audgbp|audpln|audcad|audnzd|jpymxn|jpyhuf|jpynok|jpychf|jpyzar|jpycnh|jpyaud|jpysek|jpyeur|jpyhkd|jpysgd|jpygbp|jpypln|jpycad|jpynzd|sekmxn|sekhuf|seknok|sekchf|sekzar|sekcnh|sekaud|sekjpy|sekeur|sekhkd|seksgd|sekgbp|sekpln|sekcad|seknzd|eurmxn|eurhuf|eurnok|eurchf|eurzar|eurcnh|euraud|eurjpy|eursek|eurhkd|eursgd|eurgbp|eurpln|eurcad|eurnzd|hkdmxn|hkdhuf|hkdnok|hkdchf|hkdzar|hkdcnh|hkdaud|hkdjpy|hkdsek|hkdeur|hkdsgd|hkdgbp|hkdpln|hkdcad|hkdnzd|sgdmxn|sgdhuf|sgdnok|sgdchf|sgdzar|sgdcnh|sgdaud|sgdjpy|sgdsek|sgdeur|sgdhkd|sgdgbp|sgdpln|sgdcad|sgdnzd|gbpmxn|gbphuf|gbpnok|gbpchf|gbpzar|gbpcnh|gbpaud|gbpjpy|gbpsek|gbpeur|gbphkd|gbpsgd|gbppln|gbpcad|gbpnzd|plnmxn|plnhuf|plnnok|plnchf|plnzar|plncnh|plnaud|plnjpy|plnsek|plneur|plnhkd|plnsgd|plngbp|plncad|plnnzd|cadmxn|cadhuf|cadnok|cadchf|cadzar|cadcnh|cadaud|cadjpy|cadsek|cadeur|cadhkd|cadsgd|cadgbp|cadpln|cadnzd|nzdmxn|nzdhuf|nzdnok|nzdchf|nzdzar|nzdcnh|nzdaud|nzdjpy|nzdsek|nzdeur|nzdhkd|nzdsgd|nzdgbp|nzdpln|nzdcad|audusd|cadusd|chfusd|cnhusd|eurusd|gbpusd|hkdusd|hufusd|jpyusd|mxnusd|nokusd|nzdusd|plnusd|sekusd|sgdusd|usdaud|usdcad|usdchf|usdcnh|usdeur|usdgbp|usdhkd|usdhuf|usdjpy|usdmxn|usdnok|usdnzd|usdpln|usdsek|usdsgd|usdzar|zarusd"""
         all_fields = full_list_of_tickers.split('|')
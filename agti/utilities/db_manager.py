@@ -1,5 +1,7 @@
+import hashlib
 import pandas as pd
 import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
 import datetime
 from agti.utilities import settings as gset
 import numpy as np
@@ -35,3 +37,60 @@ class DBConnectionManager:
                                             host=db_host, database=db_name)
         return psycop_conn
 
+
+
+def insert_on_conflict_do_nothing(conflict_columns):
+    """
+    pandas to_sql method that skips rows already present on a unique key, e.g.
+    df.to_sql('table', engine, if_exists='append', method=insert_on_conflict_do_nothing(['html_url']))
+    The table needs a unique index or constraint on conflict_columns.
+    """
+    def insert_rows(table, conn, keys, data_iter):
+        rows = [dict(zip(keys, row)) for row in data_iter]
+        if len(rows) == 0:
+            return 0
+        statement = postgres_insert(table.table).values(rows).on_conflict_do_nothing(index_elements=conflict_columns)
+        return conn.execute(statement).rowcount
+    return insert_rows
+
+
+POSTGRES_MAX_IDENTIFIER_LENGTH = 63
+
+
+def get_unique_index_name(table_name, columns):
+    """Default unique index name, shortened with a hash suffix to fit Postgres' 63 character identifiers"""
+    index_name = f"{table_name}_{'_'.join(columns)}_uidx"
+    if len(index_name) <= POSTGRES_MAX_IDENTIFIER_LENGTH:
+        return index_name
+    name_hash = hashlib.sha1(index_name.encode()).hexdigest()[:8]
+    prefix_length = POSTGRES_MAX_IDENTIFIER_LENGTH - len(name_hash) - len('__uidx')
+    return f"{index_name[:prefix_length]}_{name_hash}_uidx"
+
+
+def ensure_unique_index(dbconnx, table_name, columns, index_name=None):
+    """
+    Creates a unique index on columns if the table has none on exactly those columns yet, first
+    deleting rows that duplicate an earlier row on those columns (tables written with plain appends
+    can have them). Existing indexes are matched by columns, whatever they are named.
+    """
+    index_name = index_name or get_unique_index_name(table_name, columns)
+    column_list = ', '.join(columns)
+    duplicate_match = ' AND '.join(f'a.{column} = b.{column}' for column in columns)
+    with dbconnx.begin() as conn:
+        # ON CONFLICT infers its arbiter index from the column set, so column order does not matter
+        index_exists = conn.execute(sqlalchemy.text("""
+            SELECT 1 FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            WHERE t.relname = :table_name AND pg_table_is_visible(t.oid)
+              AND i.indisunique AND i.indpred IS NULL
+              AND ARRAY(SELECT a.attname::text FROM unnest(i.indkey::int2[]) AS k(attnum)
+                        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                        ORDER BY a.attname::text) = CAST(:columns AS text[])
+            """), {'table_name': table_name, 'columns': sorted(columns)}).scalar()
+        if index_exists:
+            return
+        deleted = conn.execute(sqlalchemy.text(
+            f"DELETE FROM {table_name} a USING {table_name} b WHERE {duplicate_match} AND a.ctid > b.ctid")).rowcount
+        if deleted:
+            print(f'Removed {deleted} duplicate rows from {table_name}')
+        conn.execute(sqlalchemy.text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_list})"))
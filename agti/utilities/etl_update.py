@@ -17,6 +17,7 @@ class ETLUpdateManager:
         self.data_update_details = DataUpdateDetails(pw_map=pw_map)
         self.sheet_manager = GoogleSheetManager(prod_trading=prod_trading)
         self.last_update_count = 0
+        self.worksheet_ready = False
         
     def get_current_updates(self, days=1):
         """Get current updates from database."""
@@ -25,6 +26,7 @@ class ETLUpdateManager:
     def update_sheet_if_changed(self, days=1):
         """
         Update the 'corbanu_etl' worksheet in the 'odv' workbook if there are new updates.
+        Only changed or appended rows are written after the first update.
         
         Args:
             days: Number of days of updates to consider (default: 1)
@@ -34,19 +36,17 @@ class ETLUpdateManager:
             updates_df = self.get_current_updates(days=days)
             current_update_count = len(updates_df)
             
-            # Check if there are new updates
-            if current_update_count > self.last_update_count:
-                print(f"Found {current_update_count - self.last_update_count} new updates. Updating sheet...")
-                
-                # Ensure the worksheet exists
+            # Ensure the worksheet exists
+            if not self.worksheet_ready:
                 self.sheet_manager.create_worksheet_if_does_not_exist('odv', 'corbanu_etl')
-                
-                # Write the updated dataframe to the sheet
-                self.sheet_manager.write_dataframe_to_sheet('odv', 'corbanu_etl', updates_df)
-                
-                # Update the last update count
+                self.worksheet_ready = True
+            
+            # Only rows that differ from the last write are sent to the sheet
+            rows_written = self.sheet_manager.write_dataframe_to_sheet('odv', 'corbanu_etl', updates_df)
+            
+            if rows_written > 0:
+                print(f"Wrote {rows_written} new or changed rows to sheet ({current_update_count} updates total)")
                 self.last_update_count = current_update_count
-                
                 print(f"Successfully updated sheet at {datetime.now()}")
                 return True
             else:
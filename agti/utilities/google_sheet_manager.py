@@ -2,7 +2,10 @@ from agti.utilities.settings import CredentialManager
 
 import pandas as pd
 import os
+import threading
+import time
 import gspread
+from gspread.utils import rowcol_to_a1
 from gspread_dataframe import set_with_dataframe
 from oauth2client.service_account import ServiceAccountCredentials
 ## The default is to have two types of Google Sheet managers
@@ -11,13 +14,30 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 import os
 
+SHEET_CACHE_TTL_SECONDS = 60
+# cached values are re-read after this long even if Drive modifiedTime says nothing changed
+SHEET_CACHE_MAX_AGE_SECONDS = 900
+
+# Shared across every GoogleSheetManager in the process so modules loading the same
+# target sheets reuse one authorized client and one copy of the data
+# credential file path -> authorized gspread client
+_AUTHORIZED_CLIENTS = {}
+# (credential file path, workbook) -> {'spreadsheet', 'spreadsheet_id', 'modified_time', 'checked_at', 'worksheets', 'read_at'}
+_SHEET_CACHE = {}
+_SHEET_CACHE_LOCK = threading.RLock()
+
 class GoogleSheetManager:
-    def __init__(self, prod_trading=False):
+    def __init__(self, prod_trading=False, sheet_cache_ttl_seconds=SHEET_CACHE_TTL_SECONDS,
+                 sheet_cache_max_age_seconds=SHEET_CACHE_MAX_AGE_SECONDS):
         self.credential_manager = CredentialManager()
         self.credentials_directory = self.credential_manager.get_credentials_directory()
         self.check_and_prompt_for_credentials()
         self.file_path_of_gsheets = self.get_credential_file_path(prod_trading)
         self.gspread_tool = self.authorize_gspread()
+        self.sheet_cache_ttl_seconds = sheet_cache_ttl_seconds
+        self.sheet_cache_max_age_seconds = sheet_cache_max_age_seconds
+        # (workbook, worksheet) -> rows last written by this process, used to diff the next write
+        self.written_sheet_snapshots = {}
 
     def check_and_prompt_for_credentials(self):
         required_files = ['prod_trading_google_creds.json', 'public_facing_google_creds.json']
@@ -40,41 +60,220 @@ class GoogleSheetManager:
         return file_path_of_gsheets
 
     def authorize_gspread(self):
+        with _SHEET_CACHE_LOCK:
+            if self.file_path_of_gsheets in _AUTHORIZED_CLIENTS:
+                return _AUTHORIZED_CLIENTS[self.file_path_of_gsheets]
         scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
         credentials = ServiceAccountCredentials.from_json_keyfile_name(self.file_path_of_gsheets, scope)
-        return gspread.authorize(credentials)
-
-    def load_google_sheet_as_df(self, workbook='odv', worksheet='crm'):
-        '''Outputs a worksheet from a workbook as a dataframe'''
-        gc = self.gspread_tool
-        workbook_to_load = gc.open(workbook)
-        worksheet_to_work = workbook_to_load.worksheet(worksheet)
-        temp_df = pd.DataFrame(worksheet_to_work.get_all_values())
+        client = gspread.authorize(credentials)
+        with _SHEET_CACHE_LOCK:
+            return _AUTHORIZED_CLIENTS.setdefault(self.file_path_of_gsheets, client)
+
+    def get_workbook_metadata(self, workbook):
+        """Drive metadata (id, name, modifiedTime) for a workbook, one cheap call without reading any cells"""
+        files = self.gspread_tool.list_spreadsheet_files(title=workbook)
+        if len(files) == 0:
+            raise gspread.SpreadsheetNotFound(workbook)
+        return files[0]
+
+    def get_workbook_cache_entry(self, workbook, workbook_metadata=None):
+        cache_key = (self.file_path_of_gsheets, workbook)
+        with _SHEET_CACHE_LOCK:
+            entry = _SHEET_CACHE.get(cache_key)
+            if entry is not None and (workbook_metadata is None or entry['spreadsheet_id'] == workbook_metadata['id']):
+                return entry
+        # network calls stay outside the lock, two racing openers just open the same workbook twice
+        workbook_metadata = workbook_metadata or self.get_workbook_metadata(workbook)
+        spreadsheet = self.gspread_tool.open_by_key(workbook_metadata['id'])
+        with _SHEET_CACHE_LOCK:
+            entry = _SHEET_CACHE.get(cache_key)
+            if entry is None or entry['spreadsheet_id'] != workbook_metadata['id']:
+                entry = {'spreadsheet': spreadsheet,
+                         'spreadsheet_id': workbook_metadata['id'],
+                         'modified_time': None,
+                         'checked_at': None,
+                         'worksheets': {},
+                         'read_at': {}}
+                _SHEET_CACHE[cache_key] = entry
+            return entry
+
+    def open_workbook(self, workbook):
+        """Spreadsheet handle for a workbook, opened once per process"""
+        return self.get_workbook_cache_entry(workbook)['spreadsheet']
+
+    @staticmethod
+    def sheet_values_to_df(values):
+        """Matches get_all_values: first row is the header, short rows padded with blanks"""
+        if len(values) == 0:
+            return pd.DataFrame()
+        width = max(len(row) for row in values)
+        temp_df = pd.DataFrame([row + [''] * (width - len(row)) for row in values])
         column_headers = list(temp_df.head(1).loc[0])
         temp_df = temp_df[1:]
         temp_df.columns = column_headers
         return temp_df
 
-    def write_dataframe_to_sheet(self, workbook, worksheet, df_to_write):
-        '''Outputs a worksheet from a workbook as a dataframe'''
-        gc = self.gspread_tool
-        sh = gc.open(workbook)
-        worksheet = sh.worksheet(worksheet)
-        range_of_cells = worksheet.range('A2:C1000')  # Select the range you want to clear
-        for cell in range_of_cells:
-            cell.value = ''
-        worksheet.update_cells(range_of_cells)
+    def batch_read_worksheets(self, spreadsheet, worksheets):
+        """Reads several worksheets of one workbook in a single values request"""
+        ranges = ["'" + worksheet.replace("'", "''") + "'" for worksheet in worksheets]
+        response = spreadsheet.values_batch_get(ranges)
+        value_ranges = response.get('valueRanges', [])
+        return {worksheet: self.sheet_values_to_df(value_range.get('values', []))
+                for worksheet, value_range in zip(worksheets, value_ranges)}
+
+    def load_google_sheets_as_dfs(self, workbook='odv', worksheets=['crm'], max_age_seconds=None):
+        """
+        Outputs {worksheet: dataframe} for several worksheets of a workbook through the process wide cache.
+
+        Cached frames younger than max_age_seconds (default sheet_cache_ttl_seconds) are returned without
+        any API call. Older ones are revalidated against the workbook's Drive modifiedTime; only when it
+        changed, or when a worksheet's values are older than sheet_cache_max_age_seconds, are the
+        worksheets read again, all of them in one batch request. The hard maximum age bounds how stale
+        formula driven values can get, since recalculation does not move modifiedTime.
+
+        max_age_seconds=0 always reads the values. modifiedTime does not move when formulas recalculate
+        (IMPORTRANGE, GOOGLEFINANCE, cross sheet references) and can lag cell edits, so trading targets
+        must not be served from a revalidated cache.
+        """
+        max_age_seconds = self.sheet_cache_ttl_seconds if max_age_seconds is None else max_age_seconds
+        worksheets = list(dict.fromkeys(worksheets))
+        cache_key = (self.file_path_of_gsheets, workbook)
+        now = time.monotonic()
+        if max_age_seconds <= 0:
+            entry = self.get_workbook_cache_entry(workbook)
+            fresh_frames = self.batch_read_worksheets(entry['spreadsheet'], worksheets)
+            with _SHEET_CACHE_LOCK:
+                entry['worksheets'].update(fresh_frames)
+                entry['read_at'].update({worksheet: now for worksheet in fresh_frames})
+            return {worksheet: fresh_frames[worksheet].copy() for worksheet in worksheets}
+
+        with _SHEET_CACHE_LOCK:
+            entry = _SHEET_CACHE.get(cache_key)
+            if (entry is not None and entry['checked_at'] is not None
+                    and now - entry['checked_at'] <= max_age_seconds
+                    and all(worksheet in entry['worksheets']
+                            and now - entry['read_at'].get(worksheet, now) <= self.sheet_cache_max_age_seconds
+                            for worksheet in worksheets)):
+                return {worksheet: entry['worksheets'][worksheet].copy() for worksheet in worksheets}
+
+        workbook_metadata = self.get_workbook_metadata(workbook)
+        entry = self.get_workbook_cache_entry(workbook, workbook_metadata=workbook_metadata)
+        modified_time = workbook_metadata.get('modifiedTime')
+        with _SHEET_CACHE_LOCK:
+            workbook_changed = modified_time is None or modified_time != entry['modified_time']
+            if workbook_changed:
+                # the workbook changed, refresh everything cached for it in the same request
+                worksheets_to_read = list(dict.fromkeys(list(entry['worksheets']) + worksheets))
+            else:
+                worksheets_to_read = [worksheet for worksheet in worksheets if worksheet not in entry['worksheets']
+                                      or now - entry['read_at'].get(worksheet, now) > self.sheet_cache_max_age_seconds]
+            # held here so a concurrent refresh cannot drop them before we return
+            cached_frames = {worksheet: entry['worksheets'][worksheet] for worksheet in worksheets
+                             if worksheet not in worksheets_to_read}
+        fresh_frames = self.batch_read_worksheets(entry['spreadsheet'], worksheets_to_read) if worksheets_to_read else {}
+        with _SHEET_CACHE_LOCK:
+            if workbook_changed:
+                entry['worksheets'] = {}
+                entry['read_at'] = {}
+                entry['modified_time'] = modified_time
+            entry['worksheets'].update(fresh_frames)
+            entry['read_at'].update({worksheet: now for worksheet in fresh_frames})
+            entry['checked_at'] = now
+        cached_frames.update(fresh_frames)
+        return {worksheet: cached_frames[worksheet].copy() for worksheet in worksheets}
+
+    def load_google_sheet_as_df(self, workbook='odv', worksheet='crm', max_age_seconds=None):
+        '''Outputs a worksheet from a workbook as a dataframe, served from the process wide sheet cache'''
+        return self.load_google_sheets_as_dfs(workbook=workbook, worksheets=[worksheet],
+                                              max_age_seconds=max_age_seconds)[worksheet]
+
+    def invalidate_sheet_cache(self, workbook, worksheet=None):
+        """Drops cached frames for a worksheet (or the whole workbook) so the next load reads the sheet"""
+        with _SHEET_CACHE_LOCK:
+            entry = _SHEET_CACHE.get((self.file_path_of_gsheets, workbook))
+            if entry is None:
+                return
+            if worksheet is None:
+                entry['worksheets'] = {}
+            else:
+                entry['worksheets'].pop(worksheet, None)
+
+    @staticmethod
+    def dataframe_to_sheet_rows(df):
+        """Header plus rows as the strings the sheet will display, NaN written as blank"""
+        values = df.astype(object).where(pd.notnull(df), '')
+        return [[str(i) for i in df.columns]] + [[str(i) for i in row] for row in values.values.tolist()]
+
+    def write_dataframe_to_sheet(self, workbook, worksheet, df_to_write, incremental=True):
+        """
+        Writes a dataframe to a worksheet, sending only the rows that changed since the last write
+        from this process. Returns the number of rows sent (0 when nothing changed, without any API call)
+        """
+        snapshot_key = (workbook, worksheet)
+        new_rows = self.dataframe_to_sheet_rows(df_to_write)
+        if incremental and self.written_sheet_snapshots.get(snapshot_key) == new_rows:
+            return 0
+        sh = self.open_workbook(workbook)
+        worksheet_to_work = sh.worksheet(worksheet)
+        self.invalidate_sheet_cache(workbook, worksheet)
+        return self.write_dataframe_to_worksheet(worksheet=worksheet_to_work, df_to_write=df_to_write,
+                                                 snapshot_key=snapshot_key, incremental=incremental,
+                                                 sheet_rows=new_rows)
+
+    def write_dataframe_to_worksheet(self, worksheet, df_to_write, snapshot_key=None, incremental=True, sheet_rows=None):
+        """
+        Diff aware write against a gspread worksheet object.
+
+        The first write, a changed header, or incremental=False rewrites the whole sheet. Otherwise
+        changed and appended rows go out as one batched values update and rows that disappeared
+        from the end are cleared. sheet_rows is dataframe_to_sheet_rows(df_to_write) when the caller
+        already has it.
+        """
+        snapshot_key = snapshot_key or (worksheet.spreadsheet.title, worksheet.title)
+        new_rows = sheet_rows if sheet_rows is not None else self.dataframe_to_sheet_rows(df_to_write)
+        old_rows = self.written_sheet_snapshots.get(snapshot_key)
+        if not incremental or old_rows is None or old_rows[0] != new_rows[0]:
+            self.written_sheet_snapshots.pop(snapshot_key, None)
+            clear_ranges = ['A2:C1000']
+            if old_rows is not None:
+                clear_ranges.append(f'A2:{rowcol_to_a1(max(len(old_rows), 2), max(len(old_rows[0]), 1))}')
+            worksheet.batch_clear(clear_ranges)
+            set_with_dataframe(worksheet, df_to_write)
+            self.written_sheet_snapshots[snapshot_key] = new_rows
+            return len(new_rows) - 1
+
+        # group changed or appended rows into contiguous blocks, one range per block
+        changed_blocks = []
+        for row_index in range(1, len(new_rows)):
+            if row_index < len(old_rows) and old_rows[row_index] == new_rows[row_index]:
+                continue
+            if changed_blocks and changed_blocks[-1][-1] == row_index - 1:
+                changed_blocks[-1].append(row_index)
+            else:
+                changed_blocks.append([row_index])
+        column_count = len(new_rows[0])
+        updates = [{'range': f'{rowcol_to_a1(block[0] + 1, 1)}:{rowcol_to_a1(block[-1] + 1, column_count)}',
+                    'values': [new_rows[i] for i in block]}
+                   for block in changed_blocks]
+        if updates:
+            worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+        if len(old_rows) > len(new_rows):
+            worksheet.batch_clear([f'{rowcol_to_a1(len(new_rows) + 1, 1)}:{rowcol_to_a1(len(old_rows), column_count)}'])
+        self.written_sheet_snapshots[snapshot_key] = new_rows
+        return sum(len(block) for block in changed_blocks)
 
-        # Append data to sheet
-        set_with_dataframe(worksheet, df_to_write)
+    def reset_write_snapshot(self, workbook, worksheet):
+        """Forget the last written rows so the next write is a full rewrite, e.g. after a manual edit"""
+        self.written_sheet_snapshots.pop((workbook, worksheet), None)
 
     def create_worksheet_if_does_not_exist(self, workbook_name, worksheet_name):
-        wb = self.gspread_tool.open(workbook_name)
+        wb = self.open_workbook(workbook_name)
         all_sheets = [i.title for i in wb.worksheets()]
         if worksheet_name not in all_sheets:
             wb.add_worksheet(worksheet_name, rows=1000, cols=100)
 
     def clear_worksheet(self, workbook, worksheet):
-        wb = self.gspread_tool.open(workbook)
+        wb = self.open_workbook(workbook)
         ws = wb.worksheet(worksheet)
         ws.clear()
+        self.invalidate_sheet_cache(workbook, worksheet)
@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket for throttling calls against a per-second API quota.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. acquire blocks
+    until a token is available, so any number of worker threads can share one bucket.
+
+    Example:
+        limiter = TokenBucket(rate=4)
+        limiter.acquire()
+        session.post(url, ...)
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available and take them. Returns seconds spent waiting."""
+        if tokens > self.capacity:
+            raise ValueError('cannot acquire more tokens than the bucket capacity')
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+            waited += wait_seconds
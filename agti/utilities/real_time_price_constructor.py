@@ -3,32 +3,137 @@ from agti.data.fmp.market_data import FMPMarketDataRetriever
 import pandas as pd
 import datetime
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HISTORY_COLUMNS = ['date', 'ticker', 'adjClose', 'volume']
+
 class RealTimePriceDataframeConstructor:
     """
     A class to handle real-time financial data processing.
+
+    Daily histories are cached per ticker, so overlapping universes reuse what is already loaded
+    and only the tail since the last cached date is requested again.
     """
 
-    def __init__(self, pw_map):
+    def __init__(self, pw_map, max_workers=8, max_cached_tickers=2000,
+                 cache_ttl_seconds=6*60*60, tail_refresh_seconds=60):
         """
         Initialize the RealTimeValues class.
 
         Args:
             pw_map (dict): A dictionary containing password mappings.
+            max_workers (int): Number of concurrent Tiingo requests.
+            max_cached_tickers (int): Histories kept in memory; least recently used are evicted.
+            cache_ttl_seconds (int): Age after which a history is refetched in full. adjClose is
+                back-adjusted for splits and dividends, so appending tails forever would drift.
+            tail_refresh_seconds (int): Histories fetched more recently than this are reused as is.
         """
         self.pw_map = pw_map
         self.tiingo_equity_tool = TiingoDataTool(pw_map=pw_map)
         self.fmp_market_data_tool = FMPMarketDataRetriever(pw_map=pw_map)
-        self._cached_data = {}
+        self.max_workers = max_workers
+        self.max_cached_tickers = max_cached_tickers
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.tail_refresh_seconds = tail_refresh_seconds
+        # ticker -> {'history', 'requested_start', 'loaded_at', 'refreshed_at'} in least recently used order
+        self._history_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def clear_cache(self):
+        """Drop every cached ticker history."""
+        with self._cache_lock:
+            self._history_cache.clear()
+
+    def _get_cache_entry(self, ticker):
+        with self._cache_lock:
+            entry = self._history_cache.get(ticker)
+            if entry is not None:
+                self._history_cache.move_to_end(ticker)
+            return entry
+
+    def _set_cache_entry(self, ticker, entry):
+        with self._cache_lock:
+            self._history_cache[ticker] = entry
+            self._history_cache.move_to_end(ticker)
+            while len(self._history_cache) > self.max_cached_tickers:
+                self._history_cache.popitem(last=False)
+
+    def _load_tiingo_history(self, ticker, start_date, end_date):
+        df = self.tiingo_equity_tool.raw_load_tiingo_data(
+            ticker=ticker,
+            start_date=start_date,
+            end_date=end_date
+        )
+        df['date'] = pd.to_datetime(df['date'].apply(lambda x: str(x)[:10]))
+        df['ticker'] = ticker
+        return df[HISTORY_COLUMNS]
+
+    def get_ticker_history(self, ticker, start_date, end_date):
+        """
+        Daily adjClose and volume history for one ticker from the cache, fetching only what is missing.
+
+        A cached history requested from a later start than start_date, or older than cache_ttl_seconds,
+        is refetched in full. The requested start is what counts, so a ticker listed after start_date
+        still uses the incremental path. Otherwise only the tail from the last cached date onwards is requested, replacing the
+        last cached day in case it was loaded intraday.
+        """
+        now = time.monotonic()
+        entry = self._get_cache_entry(ticker)
+        start_timestamp = pd.Timestamp(start_date)
+        full_reload = (entry is None
+                       or now - entry['loaded_at'] > self.cache_ttl_seconds
+                       or entry['requested_start'] > start_timestamp)
+        if full_reload:
+            history = self._load_tiingo_history(ticker, start_date, end_date)
+            entry = {'history': history, 'requested_start': start_timestamp, 'loaded_at': now, 'refreshed_at': now}
+            self._set_cache_entry(ticker, entry)
+        elif now - entry['refreshed_at'] > self.tail_refresh_seconds:
+            last_cached_date = entry['history']['date'].max()
+            try:
+                tail = self._load_tiingo_history(ticker, last_cached_date.strftime('%Y-%m-%d'), end_date)
+                if len(tail) > 0:
+                    history = pd.concat([entry['history'][entry['history']['date'] < tail['date'].min()], tail])
+                else:
+                    history = entry['history']
+            except Exception as e:
+                logger.warning(f"Could not refresh tail for {ticker}, using cached history: {str(e)}")
+                history = entry['history']
+            entry = {'history': history, 'requested_start': entry['requested_start'],
+                     'loaded_at': entry['loaded_at'], 'refreshed_at': now}
+            self._set_cache_entry(ticker, entry)
+        history = entry['history']
+        return history[history['date'] >= start_timestamp]
+
+    def _fetch_ticker_history(self, ticker, start_date, end_date):
+        """Worker wrapper returning (ticker, history, not_found, error) instead of raising."""
+        try:
+            history = self.get_ticker_history(ticker, start_date, end_date)
+            logger.info(f"Successfully loaded data for {ticker}")
+            return ticker, history, False, None
+        except HTTPError as e:
+            if e.code == 404:
+                logger.warning(f"Ticker {ticker} not found in Tiingo database")
+                return ticker, None, True, e
+            logger.error(f"HTTP error loading {ticker}: {str(e)}")
+            return ticker, None, False, e
+        except Exception as e:
+            logger.error(f"Error loading data for {ticker}: {str(e)}")
+            return ticker, None, False, e
 
     def get_data(self, start_date='2021-01-01', tickers=['MSTR','IEF'], skip_tickers=None):
         """
         Retrieve both price and volume data for the specified tickers in a single pass.
 
+        Histories are loaded concurrently through the per ticker cache; the real-time FMP
+        quote is always fetched fresh.
+
         Args:
             start_date (str): Start date for historical data in YYYY-MM-DD format
             tickers (list): List of stock tickers to fetch data for
@@ -38,10 +143,7 @@ class RealTimePriceDataframeConstructor:
             tuple: (price_df, volume_df) containing price and volume data
         """
         end_date = (datetime.datetime.now() + datetime.timedelta(5)).strftime('%Y-%m-%d')
-        cache_key = (start_date, end_date, tuple(sorted(tickers)))
-        
-        if cache_key in self._cached_data:
-            return self._cached_data[cache_key]
+        tickers = list(dict.fromkeys(tickers))
         
         if skip_tickers:
             tickers = [t for t in tickers if t not in skip_tickers]
@@ -52,25 +154,13 @@ class RealTimePriceDataframeConstructor:
         tiingo_data_list = []
         failed_tickers = set()
 
-        for ticker in tickers:
-            try:
-                df = self.tiingo_equity_tool.raw_load_tiingo_data(
-                    ticker=ticker,
-                    start_date=start_date,
-                    end_date=end_date
-                )
-                df['date'] = pd.to_datetime(df['date'].apply(lambda x: str(x)[:10]))
-                df['ticker'] = ticker
-                tiingo_data_list.append(df)
-                logger.info(f"Successfully loaded data for {ticker}")
-            except HTTPError as e:
-                if e.code == 404:
-                    failed_tickers.add(ticker)
-                    logger.warning(f"Ticker {ticker} not found in Tiingo database")
-                else:
-                    logger.error(f"HTTP error loading {ticker}: {str(e)}")
-            except Exception as e:
-                logger.error(f"Error loading data for {ticker}: {str(e)}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda ticker: self._fetch_ticker_history(ticker, start_date, end_date), tickers))
+        for ticker, history, not_found, error in results:
+            if history is not None:
+                tiingo_data_list.append(history)
+            elif not_found:
+                failed_tickers.add(ticker)
         
         if not tiingo_data_list:
             logger.warning("No data was successfully loaded for any tickers")
@@ -112,9 +202,7 @@ class RealTimePriceDataframeConstructor:
             real_timevalues = rt_px_df
             real_timevolumes = rt_volume_df
 
-        result = (real_timevalues, real_timevolumes)
-        self._cached_data[cache_key] = result
-        return result
+        return real_timevalues, real_timevolumes
 
     def get_combined_close_data(self, start_date='2021-01-01', tickers=['MSTR','IEF'], skip_tickers=None):
         """
@@ -173,53 +173,204 @@ def sharpe_ratio_ts(xts):
     return (xts.mean() * np.sqrt(252))/ (xts.std())
 
 
+def _raw_chg_2d(xarr):
+    ''' raw_chg down the rows of a 2d array, first row and nan changes are 0 '''
+    chg = np.zeros_like(xarr)
+    chg[1:] = xarr[1:] - xarr[:-1]
+    chg[np.isnan(chg)] = 0
+    return chg
+
+def _hold_periods_2d(cross_in, cross_out):
+    ''' stateful position pass over a (dates x combos) array of crossing flags.
+    The last non zero crossing is carried forward, the second row is forced flat
+    and the first row is nan exactly as indicator_timseseries_strategy does.
+    returns hold_periods, enter_days, exit_days'''
+    integ = cross_in - cross_out
+    integ[1] = -1
+    row_number = np.arange(integ.shape[0])[:, None]
+    last_cross = np.where(integ != 0, row_number, 0)
+    last_cross[0] = 0
+    np.maximum.accumulate(last_cross, axis=0, out=last_cross)
+    state = np.take_along_axis(integ, last_cross, axis=0)
+    state[0] = np.nan
+    enter_days = np.sign(_raw_chg_2d(state) - 2) + 1
+    exit_days = np.abs(np.sign(_raw_chg_2d(state) + 2) - 1)
+    hold_periods = (enter_days - exit_days).cumsum(axis=0)
+    return hold_periods, enter_days, exit_days
+
+def _max_dd_index_2d(pnl_index):
+    ''' max_dd_index for every column of a 2d array. Columns that never draw down are 0 '''
+    running_max = np.maximum.accumulate(pnl_index, axis=0)
+    i = np.argmax(running_max - pnl_index, axis=0)
+    columns = np.arange(pnl_index.shape[1])
+    peak_value = running_max[np.maximum(i - 1, 0), columns]
+    j = np.argmax(running_max >= peak_value, axis=0)
+    max_dd = (pnl_index[i, columns] - pnl_index[j, columns]) / pnl_index[i, columns]
+    return np.where(i == 0, 0.0, max_dd)
+
+def indicator_timseseries_strategy_sweep(asset_ret,
+                                         ref_timeseries,
+                                         enter_threshes,
+                                         exit_threshes,
+                                         lag_days_list,
+                                         windows=[252],
+                                         z_indicator=False,
+                                         size_up_by_indic=False,
+                                         tcost_bps=1,
+                                         return_pnl_frame=False):
+    '''
+    Grid search version of indicator_timseseries_strategy. Every combination of
+    enter_thresh, exit_thresh, lag_days and window (window only matters if z_indicator)
+    is run at once as a (dates x combos) numpy array. The daily pnl of each combination
+    is bit for bit the pnl column of the single run.
+
+    example:
+    sweep = reg.indicator_timseseries_strategy_sweep(asset_ret=to_trade_df.adjClose.pct_change(1),
+                                                     ref_timeseries=-reg.rolling_z(to_trade_df.adjClose.pct_change(21),252),
+                                                     enter_threshes=[1, 1.5, 2], exit_threshes=[0, .4, .8],
+                                                     lag_days_list=[1, 5], windows=[126, 252], z_indicator=True)
+    sweep.sort_values('sharpe').tail()
+
+    returns a frame with one row per combination and columns
+    lag_days, window, enter_thresh, exit_thresh, pnl, sharpe, max_dd
+    where pnl is the summed pnl, sharpe is sharpe_ratio_ts of the daily pnl and max_dd is
+    max_dd_index of (1 + daily pnl).cumprod(). With return_pnl_frame=True the daily pnl
+    frame (one column per row of the summary) is returned as well
+    '''
+    if len(ref_timeseries) < 2:
+        raise ValueError('ref_timeseries needs at least two observations')
+    threshes = pd.MultiIndex.from_product([enter_threshes, exit_threshes],
+                                          names=['enter_thresh', 'exit_thresh']).to_frame(index=False)
+    enter_row = threshes['enter_thresh'].values.astype(float)[None, :]
+    exit_row = threshes['exit_thresh'].values.astype(float)[None, :]
+    if z_indicator != True:
+        windows = [np.nan]
+    # the single run multiplies series with different indices, which aligns on their union
+    output_index = ref_timeseries.index
+    if not output_index.equals(asset_ret.index):
+        output_index = output_index.union(asset_ret.index)
+    output_rows = ref_timeseries.index.get_indexer(output_index)
+    missing_rows = output_rows == -1
+    ret = asset_ret.reindex(output_index).values.astype(float)[:, None]
+
+    summary_arr = []
+    pnl_arr = []
+    for lag_days in lag_days_list:
+        lagged = ref_timeseries.shift(lag_days)
+        for window in windows:
+            z = lagged
+            if z_indicator == True:
+                z = (lagged - lagged.rolling(window).mean())/(lagged.rolling(window).std())
+            z_col = z.values.astype(float)[:, None]
+
+            cross_above_top = np.sign(_raw_chg_2d(np.sign(z_col - enter_row)) - 2) + 1
+            cross_below_top = np.abs(np.sign(_raw_chg_2d(np.sign(z_col - exit_row)) + 2) - 1)
+            hold_periods, enter_days, exit_days = _hold_periods_2d(cross_above_top, cross_below_top)
+            cross_below_bottom = np.abs(np.sign(_raw_chg_2d(np.sign(z_col + enter_row)) + 2) - 1)
+            cross_above_bottom = np.sign(_raw_chg_2d(np.sign(z_col + exit_row)) - 2) + 1
+            hold_short_periods, short_enter_days, short_exit_days = _hold_periods_2d(cross_below_bottom,
+                                                                                     cross_above_bottom)
+
+            def align_rows(xarr):
+                aligned = xarr[output_rows]
+                aligned[missing_rows] = np.nan
+                return aligned
+            hold_periods = align_rows(hold_periods)
+            enter_days = align_rows(enter_days)
+            hold_short_periods = align_rows(hold_short_periods)
+            short_enter_days = align_rows(short_enter_days)
+
+            if size_up_by_indic == True:
+                z_abs = align_rows(np.abs(z_col))
+                long_profit = (hold_periods*ret*z_abs) - ((tcost_bps*z_abs/10000) * enter_days)
+                short_profit = (hold_short_periods*-ret*z_abs) - ((tcost_bps*z_abs/10000) * short_enter_days)
+            else:
+                long_profit = (hold_periods*ret) - ((tcost_bps/10000) * enter_days)
+                short_profit = (hold_short_periods*-ret) - ((tcost_bps/10000) * short_enter_days)
+            # fortran order keeps every combination contiguous so the column reductions match the 1d ones
+            total_profit = np.asfortranarray(long_profit + short_profit)
+
+            pnl_frame = pd.DataFrame(total_profit, index=output_index)
+            pnl_index = (1 + pnl_frame.fillna(0)).cumprod()
+            combo_summary = threshes.copy()
+            combo_summary.insert(0, 'window', window)
+            combo_summary.insert(0, 'lag_days', lag_days)
+            combo_summary['pnl'] = pnl_frame.sum().values
+            combo_summary['sharpe'] = sharpe_ratio_ts(pnl_frame).values
+            combo_summary['max_dd'] = _max_dd_index_2d(pnl_index.values)
+            summary_arr.append(combo_summary)
+            if return_pnl_frame == True:
+                pnl_arr.append(pnl_frame)
+
+    summary = pd.concat(summary_arr, ignore_index=True)
+    if return_pnl_frame == True:
+        pnl_frame = pd.concat(pnl_arr, axis=1)
+        pnl_frame.columns = range(len(summary))
+        return summary, pnl_frame
+    return summary
+
+
+
+XPER_DROPNA_STATS = ['sum', 'mean', 'std', 'delta', 'pct_change', 'z']
+
+def xper_rolling_stats_dropna(xdf, xwin=4, stats=XPER_DROPNA_STATS):
+    ''' rolling stats over the non null values of every column, computed for all columns at once.
+    xdf is stacked into a long (column, date) series without nulls and rolled per column with a single
+    groupby, so each column only sees its own observations (ie 4 reported quarters on a ragged SF1 frame)
+
+    stats is any of sum, mean, std, delta, pct_change, z
+    returns {stat: wide frame}, identical to the matching xper_*_dropna function
+    example: xper_rolling_stats_dropna(sf1_revenue, xwin=4, stats=['mean','z'])['z'] '''
+    unknown_stats = set(stats) - set(XPER_DROPNA_STATS)
+    if len(unknown_stats) > 0:
+        raise ValueError(f'unknown stats {sorted(unknown_stats)}')
+    long_values = xdf.unstack().dropna()
+    by_column = long_values.groupby(level=0, sort=False)
+    observed_dates = xdf.index[xdf.notna().any(axis=1).values]
+
+    def to_wide(long_stat):
+        wide = long_stat.unstack(level=0).reindex(index=observed_dates, columns=xdf.columns)
+        wide.columns = list(xdf.columns)
+        return wide
+
+    def rolled(rolling_stat):
+        long_stat = getattr(by_column.rolling(xwin), rolling_stat)()
+        return to_wide(long_stat.droplevel(0))
+
+    output = {}
+    if 'sum' in stats:
+        output['sum'] = rolled('sum')
+    if ('mean' in stats) or ('z' in stats):
+        output['mean'] = rolled('mean')
+    if ('std' in stats) or ('z' in stats):
+        output['std'] = rolled('std')
+    if 'delta' in stats:
+        output['delta'] = to_wide(long_values - by_column.shift(4))
+    if 'pct_change' in stats:
+        lagged = by_column.shift(xwin)
+        output['pct_change'] = to_wide((long_values - lagged)/lagged)
+    if 'z' in stats:
+        output['z'] = (xdf - output['mean'])/output['std']
+    return {stat: output[stat] for stat in stats}
 
 def xper_sum_dropna(xdf,xwin=4): 
-    arr=[]
-    for xcol in xdf.columns:
-        tdf = xdf[xcol].dropna().rolling(xwin).sum()
-        arr.append(tdf)
-    xdf2 = pd.concat(arr,1)
-    return xdf2
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['sum'])['sum']
 
 def xper_mean_dropna(xdf,xwin=4): 
-    arr=[]
-    for xcol in xdf.columns:
-        tdf = xdf[xcol].dropna().rolling(xwin).mean()
-        arr.append(tdf)
-    xdf2 = pd.concat(arr,1)
-    return xdf2
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['mean'])['mean']
 
 def xper_std_dropna(xdf,xwin=4): 
-    arr=[]
-    for xcol in xdf.columns:
-        tdf = xdf[xcol].dropna().rolling(xwin).std()
-        arr.append(tdf)
-    xdf2 = pd.concat(arr,1)
-    return xdf2
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['std'])['std']
 
 def xper_delta_dropna(xdf,xwin=4): 
-    arr=[]
-    for xcol in xdf.columns:
-        tdfa = xdf[xcol].dropna()
-        tdf = tdfa-tdfa.shift(4)
-        arr.append(tdf)
-    xdf2 = pd.concat(arr,1)
-    return xdf2
-
+    ''' note the delta is always over 4 observations, xwin is ignored '''
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['delta'])['delta']
 
 def xper_pct_change_dropna(xdf,xwin=4): 
-    arr=[]
-    for xcol in xdf.columns:
-        tdfa = xdf[xcol].dropna()
-        tdf = (tdfa-tdfa.shift(xwin))/tdfa.shift(xwin)
-        arr.append(tdf)
-    xdf2 = pd.concat(arr,1)
-    return xdf2
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['pct_change'])['pct_change']
 
 def xper_z_dropna(xdf,xwin=4): 
-    xdf2 = (xdf - xper_mean_dropna(xdf= xdf, xwin=xwin))/xper_std_dropna(xdf= xdf, xwin=xwin)
-    return xdf2
+    return xper_rolling_stats_dropna(xdf, xwin=xwin, stats=['z'])['z']
 
 def calculate_rolling_beta_of_ts(ts_to_measure,market_ts,win=63):
     '''example ts_to_measure=daily_pnl__pct,market_ts = 'SPY',
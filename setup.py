@@ -15,7 +15,7 @@ setup(
         'nest_asyncio','brotli','sec-cik-mapper','psycopg2-binary','quandl','schedule','openai','lxml',
         'gspread_dataframe','gspread','oauth2client',
         'selenium','selenium-wire>=5.1.0<6','boto3','blinker==1.7',
-        'ua_generator',
+        'ua_generator','pyarrow','watchdog',
     ],
     author='Alex Good',
     author_email='alex@agti.net',